@@ -5,7 +5,14 @@ from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 
 from config import get_settings
-from session import create_session, validate_and_renew_session, invalidate_session
+from session import (
+    create_session,
+    create_session_async,
+    validate_and_renew_session,
+    validate_and_renew_session_async,
+    invalidate_session,
+    invalidate_session_async,
+)
 
 security = HTTPBearer()
 
@@ -43,6 +50,27 @@ def create_access_token(subject: str, scopes: list[str] | None = None) -> str:
     return create_session(subject, scopes or [])
 
 
+async def create_access_token_async(subject: str, scopes: list[str] | None = None) -> str:
+    """Versión async de create_access_token() (no bloquea el event loop)."""
+    return await create_session_async(subject, scopes or [])
+
+
+def _token_data_from_session(session_data: dict | None) -> TokenData:
+    """Convierte el resultado de la validación de sesión en TokenData o lanza 401."""
+    if not session_data:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido o expirado",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    return TokenData(
+        sub=session_data["username"],
+        scopes=session_data["scopes"],
+        session_id=session_data["session_id"]
+    )
+
+
 def validate_token(token: str) -> TokenData:
     """
     Valida el token (SessionID) y renueva la sesión si es válida.
@@ -58,19 +86,18 @@ def validate_token(token: str) -> TokenData:
     """
     settings = get_settings()
     session_data = validate_and_renew_session(token, timeout_minutes=settings.JWT_EXPIRATION_MINUTES)
+    return _token_data_from_session(session_data)
 
-    if not session_data:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token inválido o expirado",
-            headers={"WWW-Authenticate": "Bearer"}
-        )
 
-    return TokenData(
-        sub=session_data["username"],
-        scopes=session_data["scopes"],
-        session_id=session_data["session_id"]
-    )
+async def validate_token_async(token: str) -> TokenData:
+    """
+    Versión async de validate_token().
+    Responde desde el cache de sesiones en el event loop; si hay que consultar MSSQL,
+    la consulta se ejecuta en el executor de sesiones.
+    """
+    settings = get_settings()
+    session_data = await validate_and_renew_session_async(token, timeout_minutes=settings.JWT_EXPIRATION_MINUTES)
+    return _token_data_from_session(session_data)
 
 
 async def get_current_user(
@@ -78,9 +105,9 @@ async def get_current_user(
 ) -> TokenData:
     """
     Dependency para obtener el usuario actual desde el token.
-    Valida y renueva automáticamente la sesión.
+    Valida y renueva automáticamente la sesión sin bloquear el event loop.
     """
-    return validate_token(credentials.credentials)
+    return await validate_token_async(credentials.credentials)
 
 
 def require_scope(required_scope: str):
@@ -116,3 +143,8 @@ def logout(token: str) -> bool:
         True si se invalidó correctamente
     """
     return invalidate_session(token)
+
+
+async def logout_async(token: str) -> bool:
+    """Versión async de logout() (no bloquea el event loop)."""
+    return await invalidate_session_async(token)
@@ -34,6 +34,17 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = "HS256"
     JWT_EXPIRATION_MINUTES: int = 30
 
+    # Cache de sesiones en memoria
+    SESSION_CACHE_TTL_SECONDS: float = 60.0
+    SESSION_CACHE_MAX_ENTRIES: int = 10000
+    SESSION_FLUSH_INTERVAL_SECONDS: float = 30.0
+    SESSION_EXECUTOR_WORKERS: int = 8
+
+    # Executors para trabajo bloqueante fuera del event loop
+    MSSQL_EXECUTOR_WORKERS: int = 4
+    HANA_EXECUTOR_WORKERS: int = 4
+    SL_EXECUTOR_WORKERS: int = 4
+
     # MSSQL
     MSSQL_HOST: str = "mssql"
     MSSQL_PORT: int = 1433
@@ -41,17 +52,82 @@ class Settings(BaseSettings):
     MSSQL_PASSWORD: str
     MSSQL_DATABASE: str
 
+    # Pool de conexiones MSSQL (un sub-pool por base de datos)
+    MSSQL_POOL_SIZE: int = 10
+    MSSQL_POOL_TIMEOUT: float = 30.0
+    MSSQL_POOL_MAX_LIFETIME: int = 1800
+    MSSQL_POOL_MAX_IDLE: int = 300
+
     # SAP HANA
     SAP_HANA_HOST: str
     SAP_HANA_PORT: int
     SAP_HANA_USER: str
     SAP_HANA_PASSWORD: str
 
+    # Pool de conexiones HANA (compartido por todo el proceso)
+    HANA_POOL_SIZE: int = 8
+    HANA_POOL_TIMEOUT: float = 60.0
+    HANA_POOL_MAX_LIFETIME: int = 1800
+    HANA_POOL_MAX_IDLE: int = 300
+
     # SAP B1 Service Layer (opcional)
     SAP_B1_SERVICE_LAYER_URL: str | None = None
     SAP_B1_USER: str | None = None
     SAP_B1_PASSWORD: str | None = None
     SAP_B1_COMPANY_DB: str | None = None
+    # SessionTimeout configurado en Service Layer (se usa si el Login no lo informa)
+    SL_SESSION_TIMEOUT_MINUTES: int = 30
+
+    # Clientes HTTP compartidos hacia Service Layer
+    SL_HTTP_MAX_CONNECTIONS: int = 20
+    SL_HTTP_MAX_KEEPALIVE: int = 10
+    SL_HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    SL_HTTP_CONNECT_TIMEOUT: float = 10.0
+    SL_HTTP_READ_TIMEOUT: float = 60.0
+    SL_HTTP2: bool = False
+
+    # Paginación de consultas a Service Layer
+    SL_PAGE_SIZE: int = 500
+    SL_PAGE_RETRIES: int = 3
+
+    # Prueba de login de todas las instancias: logins simultáneos y plazo por login (segundos)
+    SL_PROBE_CONCURRENCIA: int = 16
+    SL_PROBE_TIMEOUT: float = 30.0
+
+    # Circuit breaker por CompanyDB: fallas seguidas (red, timeout o 5xx) para abrir el
+    # circuito y segundos que permanece abierto antes de dejar pasar una petición de prueba
+    SL_CIRCUITO_FALLOS: int = 3
+    SL_CIRCUITO_ESPERA_SEGUNDOS: float = 120.0
+
+    # Sincronización de SAP_PROVEEDORES: cada cuántos días se fuerza la reconciliación
+    # completa de una instancia (0 = solo cuando se pide con completa=true)
+    SYNC_PROVEEDORES_COMPLETA_DIAS: int = 7
+    # Instancias sincronizadas en paralelo: descargas simultáneas de Service Layer
+    # y conexiones/transacciones MSSQL simultáneas
+    SYNC_PROVEEDORES_MAX_SL: int = 4
+    SYNC_PROVEEDORES_MAX_MSSQL: int = 4
+
+    # Análisis de actividad de proveedores: tablas de documentos de HANA (separadas por coma)
+    ACTIVIDAD_TABLAS: str = "OPCH,OPOR"
+    # Instancias consultadas en HANA al mismo tiempo (conexiones HANA simultáneas)
+    ACTIVIDAD_HANA_PARALELISMO: int = 4
+
+    # Almacén de jobs (inicialización): "mssql" usa la base de datos JOBS_DATABASE
+    # (default: {MSSQL_DATABASE}_JOBS); "sqlite" usa el archivo JOBS_SQLITE_PATH
+    JOBS_BACKEND: str = "mssql"
+    JOBS_DATABASE: str | None = None
+    JOBS_SQLITE_PATH: str = "data/jobs.sqlite3"
+    # Cada cuánto se buscan jobs pendientes, cada cuánto renueva su latido un job en
+    # ejecución y tras cuántos segundos sin latido se da por interrumpido
+    JOBS_POLL_SECONDS: float = 5.0
+    JOBS_HEARTBEAT_SECONDS: float = 15.0
+    JOBS_STALE_SECONDS: float = 120.0
+    JOBS_RETENTION_HOURS: float = 24.0
+    # Stream SSE de progreso: cada cuánto se relee el job si está pendiente o lo ejecuta
+    # otro worker (un job en ejecución en este proceso avisa sus cambios y no se relee)
+    # y cada cuánto se envía un ping
+    JOBS_STREAM_POLL_SECONDS: float = 2.0
+    JOBS_STREAM_KEEPALIVE_SECONDS: float = 15.0
 
     # Email
     EMAIL_SUPERVISOR: str | None = None
@@ -2,23 +2,46 @@ import pyodbc
 import httpx
 import smtplib
 import json
+import hashlib
+import re
+import threading
+import time
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from email.utils import make_msgid
-from datetime import datetime
+from datetime import date, datetime, time as dtime
+from typing import Callable, Iterator
 from hdbcli import dbapi
 from config import get_settings
+from pool import ConnectionPool
+from sap_service_layer import (
+    ServiceLayerCircuitOpenError,
+    ServiceLayerLoginError,
+    ServiceLayerRequestError,
+    SL_PROBE_PATH,
+    get_sl_health,
+    get_sl_http_client,
+    get_sl_session_pool,
+    iter_sl_pages,
+    probar_logins_sl,
+    sl_error_message,
+)
 from utils import now as tz_now
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment
 from io import BytesIO
 
 
-def get_mssql_connection(database: str | None = None):
-    """Obtiene conexión a MSSQL. Si database es None, usa la configurada en settings."""
+# Sub-pools de conexiones MSSQL por base de datos (app DB, master, ...)
+_mssql_pools: dict[str, ConnectionPool] = {}
+_mssql_pools_lock = threading.Lock()
+
+
+def _connect_mssql(db: str):
+    """Abre una conexión física nueva a MSSQL."""
     settings = get_settings()
-    db = database if database else settings.MSSQL_DATABASE
     connection_string = (
         f"DRIVER={{ODBC Driver 18 for SQL Server}};"
         f"SERVER={settings.MSSQL_HOST},{settings.MSSQL_PORT};"
@@ -30,6 +53,137 @@ def get_mssql_connection(database: str | None = None):
     return pyodbc.connect(connection_string)
 
 
+def _ping_mssql(conn) -> None:
+    """Valida que la conexión siga viva antes de entregarla."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def _reset_mssql(conn) -> None:
+    """
+    Descarta la transacción pendiente, restaura autocommit y NOCOUNT al devolver la conexión.
+    Un batch que deja SET NOCOUNT ON haría que el siguiente usuario de la conexión
+    reciba cursor.rowcount == -1.
+    """
+    if conn.autocommit:
+        conn.autocommit = False
+    else:
+        conn.rollback()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET NOCOUNT OFF")
+    finally:
+        cursor.close()
+
+
+def get_mssql_pool(database: str | None = None) -> ConnectionPool:
+    """Retorna el sub-pool de la base de datos indicada, creándolo si no existe."""
+    settings = get_settings()
+    db = database if database else settings.MSSQL_DATABASE
+
+    with _mssql_pools_lock:
+        pool = _mssql_pools.get(db)
+        if pool is None:
+            pool = ConnectionPool(
+                name=f"mssql:{db}",
+                factory=lambda: _connect_mssql(db),
+                ping=_ping_mssql,
+                reset=_reset_mssql,
+                max_size=settings.MSSQL_POOL_SIZE,
+                timeout=settings.MSSQL_POOL_TIMEOUT,
+                max_lifetime=settings.MSSQL_POOL_MAX_LIFETIME,
+                max_idle=settings.MSSQL_POOL_MAX_IDLE
+            )
+            _mssql_pools[db] = pool
+        return pool
+
+
+def get_mssql_connection(database: str | None = None):
+    """
+    Obtiene conexión a MSSQL desde el pool. Si database es None, usa la configurada en settings.
+    conn.close() devuelve la conexión al pool en lugar de cerrarla.
+    """
+    return get_mssql_pool(database).acquire()
+
+
+@contextmanager
+def mssql_connection(database: str | None = None):
+    """Context manager que entrega una conexión del pool MSSQL y la devuelve al salir."""
+    with get_mssql_pool(database).connection() as conn:
+        yield conn
+
+
+def dispose_mssql_pools(database: str | None = None) -> None:
+    """
+    Cierra las conexiones inactivas del pool de una base de datos
+    (o de todos los pools si database es None).
+    """
+    with _mssql_pools_lock:
+        if database is None:
+            pools = list(_mssql_pools.values())
+        else:
+            pools = [p for db, p in _mssql_pools.items() if db == database]
+    for pool in pools:
+        pool.dispose()
+
+
+def get_mssql_pool_stats() -> list[dict]:
+    """Retorna métricas de todos los sub-pools MSSQL."""
+    with _mssql_pools_lock:
+        pools = list(_mssql_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+# Registro de verificaciones de esquema (ensure_*_exists).
+# Se ejecutan una sola vez por proceso y de nuevo solo después de recrear la base de datos.
+_schema_checks: list[Callable[[], object]] = []
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def register_schema_check(func: Callable[[], object]) -> Callable[[], object]:
+    """Decorador que registra una función ensure_*_exists en el registro de esquema."""
+    if func not in _schema_checks:
+        _schema_checks.append(func)
+    return func
+
+
+def ensure_schema_ready(force: bool = False) -> bool:
+    """
+    Verifica la base de datos y todas las tablas registradas solo si no se ha hecho
+    antes en este proceso (o si force=True). En el camino normal no toca la BD.
+    Si alguna verificación falla, se reintenta en la siguiente llamada.
+    """
+    global _schema_ready
+
+    if _schema_ready and not force:
+        return True
+
+    # session registra la verificación de USER_SESSIONS al importarse
+    import session  # noqa: F401
+
+    with _schema_lock:
+        if _schema_ready and not force:
+            return True
+
+        ensure_database_exists()
+        for check in list(_schema_checks):
+            check()
+        _schema_ready = True
+
+    return True
+
+
+def invalidate_schema_ready() -> None:
+    """Marca el esquema como no verificado (p. ej. después de recrear la base de datos)."""
+    global _schema_ready
+    _schema_ready = False
+
+
 def drop_and_create_database() -> bool:
     """
     Elimina la base de datos si existe y la recrea desde cero.
@@ -37,28 +191,35 @@ def drop_and_create_database() -> bool:
     """
     settings = get_settings()
 
+    # Las conexiones inactivas a la base de datos quedarían rotas tras el DROP
+    dispose_mssql_pools(settings.MSSQL_DATABASE)
+    invalidate_schema_ready()
+
     # Conectar a master para eliminar/crear la base de datos
-    conn = get_mssql_connection(database="master")
-    conn.autocommit = True
-    cursor = conn.cursor()
+    with mssql_connection(database="master") as conn:
+        conn.autocommit = True
+        cursor = conn.cursor()
 
-    try:
-        # Eliminar base de datos si existe
-        cursor.execute(f"""
-            IF EXISTS (SELECT name FROM sys.databases WHERE name = '{settings.MSSQL_DATABASE}')
-            BEGIN
-                ALTER DATABASE [{settings.MSSQL_DATABASE}] SET SINGLE_USER WITH ROLLBACK IMMEDIATE;
-                DROP DATABASE [{settings.MSSQL_DATABASE}];
-            END
-        """)
+        try:
+            # Eliminar base de datos si existe
+            cursor.execute(f"""
+                IF EXISTS (SELECT name FROM sys.databases WHERE name = '{settings.MSSQL_DATABASE}')
+                BEGIN
+                    ALTER DATABASE [{settings.MSSQL_DATABASE}] SET SINGLE_USER WITH ROLLBACK IMMEDIATE;
+                    DROP DATABASE [{settings.MSSQL_DATABASE}];
+                END
+            """)
+
+            # Crear base de datos nueva
+            cursor.execute(f"CREATE DATABASE [{settings.MSSQL_DATABASE}]")
+        finally:
+            cursor.close()
 
-        # Crear base de datos nueva
-        cursor.execute(f"CREATE DATABASE [{settings.MSSQL_DATABASE}]")
+    # Descartar las conexiones que estaban en uso durante el DROP (fueron terminadas)
+    dispose_mssql_pools(settings.MSSQL_DATABASE)
+    invalidate_schema_ready()
 
-        return True
-    finally:
-        cursor.close()
-        conn.close()
+    return True
 
 
 def ensure_database_exists() -> bool:
@@ -69,58 +230,57 @@ def ensure_database_exists() -> bool:
     settings = get_settings()
 
     # Conectar a master para verificar/crear la base de datos
-    conn = get_mssql_connection(database="master")
-    conn.autocommit = True
-    cursor = conn.cursor()
+    with mssql_connection(database="master") as conn:
+        conn.autocommit = True
+        cursor = conn.cursor()
 
-    try:
-        cursor.execute(
-            "SELECT COUNT(*) FROM sys.databases WHERE name = ?",
-            (settings.MSSQL_DATABASE,)
-        )
-        exists = cursor.fetchone()[0] > 0
+        try:
+            cursor.execute(
+                "SELECT COUNT(*) FROM sys.databases WHERE name = ?",
+                (settings.MSSQL_DATABASE,)
+            )
+            exists = cursor.fetchone()[0] > 0
 
-        if not exists:
-            cursor.execute(f"CREATE DATABASE [{settings.MSSQL_DATABASE}]")
+            if not exists:
+                cursor.execute(f"CREATE DATABASE [{settings.MSSQL_DATABASE}]")
 
-        return True
-    finally:
-        cursor.close()
-        conn.close()
+            return True
+        finally:
+            cursor.close()
 
 
+@register_schema_check
 def ensure_table_settings_exists() -> bool:
     """
     Verifica si la tabla SETTINGS existe, si no existe la crea.
     Retorna True si ya existía o fue creada exitosamente.
     """
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
-            WHERE TABLE_NAME = 'SETTINGS'
-        """)
-        exists = cursor.fetchone()[0] > 0
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
 
-        if not exists:
+        try:
             cursor.execute("""
-                CREATE TABLE SETTINGS (
-                    id INT IDENTITY(1,1) PRIMARY KEY,
-                    modo INT NOT NULL,
-                    s_activas INT NOT NULL,
-                    anos_activos INT NOT NULL,
-                    correo NVARCHAR(255) NOT NULL,
-                    fecha DATETIME NOT NULL DEFAULT GETDATE()
-                )
+                SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_NAME = 'SETTINGS'
             """)
-            conn.commit()
+            exists = cursor.fetchone()[0] > 0
 
-        return True
-    finally:
-        cursor.close()
-        conn.close()
+            if not exists:
+                cursor.execute("""
+                    CREATE TABLE SETTINGS (
+                        id INT IDENTITY(1,1) PRIMARY KEY,
+                        modo INT NOT NULL,
+                        s_activas INT NOT NULL,
+                        anos_activos INT NOT NULL,
+                        correo NVARCHAR(255) NOT NULL,
+                        fecha DATETIME NOT NULL DEFAULT GETDATE()
+                    )
+                """)
+                conn.commit()
+
+            return True
+        finally:
+            cursor.close()
 
 
 def insertar_configuracion_settings(modo: int, s_activas: int, anos_activos: int, correo: str) -> bool:
@@ -136,159 +296,245 @@ def insertar_configuracion_settings(modo: int, s_activas: int, anos_activos: int
     Returns:
         True si se insertó exitosamente
     """
-    ensure_table_settings_exists()
+    ensure_schema_ready()
 
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        cursor.execute("""
-            INSERT INTO SETTINGS (modo, s_activas, anos_activos, correo, fecha)
-            VALUES (?, ?, ?, ?, GETDATE())
-        """, (modo, s_activas, anos_activos, correo))
-        conn.commit()
-        return True
-    finally:
-        cursor.close()
-        conn.close()
+        try:
+            cursor.execute("""
+                INSERT INTO SETTINGS (modo, s_activas, anos_activos, correo, fecha)
+                VALUES (?, ?, ?, ?, GETDATE())
+            """, (modo, s_activas, anos_activos, correo))
+            conn.commit()
+            return True
+        finally:
+            cursor.close()
 
 
+@register_schema_check
 def ensure_table_sap_empresas_exists() -> bool:
     """
     Verifica si la tabla SAP_EMPRESAS existe, si no existe la crea.
     Retorna True si ya existía o fue creada exitosamente.
     """
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute("""
-            SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
-            WHERE TABLE_NAME = 'SAP_EMPRESAS'
-        """)
-        exists = cursor.fetchone()[0] > 0
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
 
-        if not exists:
+        try:
             cursor.execute("""
-                CREATE TABLE SAP_EMPRESAS (
-                    Instancia NVARCHAR(100) NOT NULL,
-                    SL BIT NOT NULL DEFAULT 0,
-                    Prueba BIT NOT NULL DEFAULT 0,
-                    SLP BIT NOT NULL DEFAULT 0,
-                    PrintHeadr NVARCHAR(255),
-                    CompnyAddr NVARCHAR(500),
-                    TaxIdNum NVARCHAR(50),
-                    PRIMARY KEY (Instancia)
-                )
+                SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_NAME = 'SAP_EMPRESAS'
             """)
-            conn.commit()
+            exists = cursor.fetchone()[0] > 0
 
-        return True
-    finally:
-        cursor.close()
-        conn.close()
+            if not exists:
+                cursor.execute("""
+                    CREATE TABLE SAP_EMPRESAS (
+                        Instancia NVARCHAR(100) NOT NULL,
+                        SL BIT NOT NULL DEFAULT 0,
+                        Prueba BIT NOT NULL DEFAULT 0,
+                        SLP BIT NOT NULL DEFAULT 0,
+                        PrintHeadr NVARCHAR(255),
+                        CompnyAddr NVARCHAR(500),
+                        TaxIdNum NVARCHAR(50),
+                        PRIMARY KEY (Instancia)
+                    )
+                """)
+                conn.commit()
+
+            return True
+        finally:
+            cursor.close()
 
 
+@register_schema_check
 def ensure_table_sap_proveedores_exists() -> bool:
     """
     Verifica si la tabla SAP_PROVEEDORES existe, si no existe la crea.
     Retorna True si ya existía o fue creada exitosamente.
     """
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        cursor.execute("""
-            SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
-            WHERE TABLE_NAME = 'SAP_PROVEEDORES'
-        """)
-        exists = cursor.fetchone()[0] > 0
+        try:
+            cursor.execute("""
+                SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_NAME = 'SAP_PROVEEDORES'
+            """)
+            exists = cursor.fetchone()[0] > 0
+
+            if not exists:
+                cursor.execute("""
+                    CREATE TABLE SAP_PROVEEDORES (
+                        -- Identificación básica
+                        Instancia NVARCHAR(100) NOT NULL,
+                        CardCode NVARCHAR(50) NOT NULL,
+                        CardName NVARCHAR(200),
+                        GroupCode INT,
+                        FederalTaxID NVARCHAR(50),
+                        -- Fechas de auditoría
+                        CreateDate DATE,
+                        CreateTime TIME,
+                        UpdateDate DATE,
+                        UpdateTime TIME,
+                        -- Dirección principal
+                        Address NVARCHAR(500),
+                        Block NVARCHAR(200),
+                        ZipCode NVARCHAR(20),
+                        City NVARCHAR(100),
+                        County NVARCHAR(100),
+                        BillToState NVARCHAR(10),
+                        Country NVARCHAR(10),
+                        -- Dirección postal / Envío
+                        MailAddress NVARCHAR(500),
+                        MailZipCode NVARCHAR(20),
+                        ShipToState NVARCHAR(10),
+                        ShipToDefault NVARCHAR(100),
+                        -- Contacto
+                        Phone1 NVARCHAR(50),
+                        Phone2 NVARCHAR(50),
+                        Fax NVARCHAR(50),
+                        Cellular NVARCHAR(50),
+                        EmailAddress NVARCHAR(200),
+                        ContactPerson NVARCHAR(200),
+                        -- Condiciones financieras
+                        PayTermsGrpCode INT,
+                        PeymentMethodCode NVARCHAR(50),
+                        CreditLimit DECIMAL(18,2),
+                        MaxCommitment DECIMAL(18,2),
+                        DiscountPercent DECIMAL(5,2),
+                        PriceListNum INT,
+                        Currency NVARCHAR(10),
+                        -- Impuestos y deducciones
+                        DeductibleAtSource NVARCHAR(10),
+                        DeductionPercent DECIMAL(5,2),
+                        DeductionValidUntil DATE,
+                        VatGroupLatinAmerica NVARCHAR(20),
+                        -- Datos bancarios
+                        DefaultBankCode NVARCHAR(50),
+                        DefaultAccount NVARCHAR(100),
+                        BankCountry NVARCHAR(10),
+                        HouseBank NVARCHAR(50),
+                        HouseBankCountry NVARCHAR(10),
+                        HouseBankAccount NVARCHAR(50),
+                        HouseBankBranch NVARCHAR(20),
+                        HouseBankIBAN NVARCHAR(50),
+                        IBAN NVARCHAR(50),
+                        CreditCardCode INT,
+                        CreditCardNum NVARCHAR(50),
+                        CreditCardExpiration DATE,
+                        DebitorAccount NVARCHAR(50),
+                        -- Saldos y oportunidades
+                        CurrentAccountBalance DECIMAL(18,2),
+                        OpenDeliveryNotesBalance DECIMAL(18,2),
+                        OpenOrdersBalance DECIMAL(18,2),
+                        OpenChecksBalance DECIMAL(18,2),
+                        OpenOpportunities INT,
+                        -- Estado del proveedor
+                        Valid NVARCHAR(10),
+                        Frozen NVARCHAR(10),
+                        BlockDunning NVARCHAR(10),
+                        BackOrder NVARCHAR(10),
+                        PartialDelivery NVARCHAR(10),
+                        -- Hash SHA-256 de los campos de SAP (detección de cambios)
+                        RowHash VARBINARY(32),
+                        PRIMARY KEY (Instancia, CardCode)
+                    )
+                """)
+                conn.commit()
+            else:
+                # Tablas creadas antes de existir RowHash
+                cursor.execute("""
+                    IF COL_LENGTH('SAP_PROVEEDORES', 'RowHash') IS NULL
+                        ALTER TABLE SAP_PROVEEDORES ADD RowHash VARBINARY(32) NULL
+                """)
+                conn.commit()
+
+            return True
+        finally:
+            cursor.close()
+
+
+@register_schema_check
+def ensure_table_sap_prov_sync_exists() -> bool:
+    """
+    Verifica si la tabla SAP_PROV_SYNC existe, si no existe la crea.
+    Guarda por instancia la marca de agua (UpdateDate/UpdateTime más recientes
+    sincronizados) para la sincronización incremental de SAP_PROVEEDORES.
+    Retorna True si ya existía o fue creada exitosamente.
+    """
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
 
-        if not exists:
+        try:
             cursor.execute("""
-                CREATE TABLE SAP_PROVEEDORES (
-                    -- Identificación básica
-                    Instancia NVARCHAR(100) NOT NULL,
-                    CardCode NVARCHAR(50) NOT NULL,
-                    CardName NVARCHAR(200),
-                    GroupCode INT,
-                    FederalTaxID NVARCHAR(50),
-                    -- Fechas de auditoría
-                    CreateDate DATE,
-                    CreateTime TIME,
-                    UpdateDate DATE,
-                    UpdateTime TIME,
-                    -- Dirección principal
-                    Address NVARCHAR(500),
-                    Block NVARCHAR(200),
-                    ZipCode NVARCHAR(20),
-                    City NVARCHAR(100),
-                    County NVARCHAR(100),
-                    BillToState NVARCHAR(10),
-                    Country NVARCHAR(10),
-                    -- Dirección postal / Envío
-                    MailAddress NVARCHAR(500),
-                    MailZipCode NVARCHAR(20),
-                    ShipToState NVARCHAR(10),
-                    ShipToDefault NVARCHAR(100),
-                    -- Contacto
-                    Phone1 NVARCHAR(50),
-                    Phone2 NVARCHAR(50),
-                    Fax NVARCHAR(50),
-                    Cellular NVARCHAR(50),
-                    EmailAddress NVARCHAR(200),
-                    ContactPerson NVARCHAR(200),
-                    -- Condiciones financieras
-                    PayTermsGrpCode INT,
-                    PeymentMethodCode NVARCHAR(50),
-                    CreditLimit DECIMAL(18,2),
-                    MaxCommitment DECIMAL(18,2),
-                    DiscountPercent DECIMAL(5,2),
-                    PriceListNum INT,
-                    Currency NVARCHAR(10),
-                    -- Impuestos y deducciones
-                    DeductibleAtSource NVARCHAR(10),
-                    DeductionPercent DECIMAL(5,2),
-                    DeductionValidUntil DATE,
-                    VatGroupLatinAmerica NVARCHAR(20),
-                    -- Datos bancarios
-                    DefaultBankCode NVARCHAR(50),
-                    DefaultAccount NVARCHAR(100),
-                    BankCountry NVARCHAR(10),
-                    HouseBank NVARCHAR(50),
-                    HouseBankCountry NVARCHAR(10),
-                    HouseBankAccount NVARCHAR(50),
-                    HouseBankBranch NVARCHAR(20),
-                    HouseBankIBAN NVARCHAR(50),
-                    IBAN NVARCHAR(50),
-                    CreditCardCode INT,
-                    CreditCardNum NVARCHAR(50),
-                    CreditCardExpiration DATE,
-                    DebitorAccount NVARCHAR(50),
-                    -- Saldos y oportunidades
-                    CurrentAccountBalance DECIMAL(18,2),
-                    OpenDeliveryNotesBalance DECIMAL(18,2),
-                    OpenOrdersBalance DECIMAL(18,2),
-                    OpenChecksBalance DECIMAL(18,2),
-                    OpenOpportunities INT,
-                    -- Estado del proveedor
-                    Valid NVARCHAR(10),
-                    Frozen NVARCHAR(10),
-                    BlockDunning NVARCHAR(10),
-                    BackOrder NVARCHAR(10),
-                    PartialDelivery NVARCHAR(10),
-                    PRIMARY KEY (Instancia, CardCode)
-                )
+                SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_NAME = 'SAP_PROV_SYNC'
             """)
-            conn.commit()
+            exists = cursor.fetchone()[0] > 0
+
+            if not exists:
+                cursor.execute("""
+                    CREATE TABLE SAP_PROV_SYNC (
+                        Instancia NVARCHAR(100) NOT NULL PRIMARY KEY,
+                        InstanciaSL NVARCHAR(120) NOT NULL,
+                        UltimaUpdateDate DATE,
+                        UltimaUpdateTime TIME,
+                        UltimaSync DATETIME NOT NULL,
+                        UltimaSyncCompleta DATETIME
+                    )
+                """)
+                conn.commit()
+
+            return True
+        finally:
+            cursor.close()
 
-        return True
-    finally:
-        cursor.close()
-        conn.close()
+
+@register_schema_check
+def ensure_tables_actividad_exists() -> bool:
+    """
+    Verifica si existen las tablas del análisis incremental de actividad, si no existen las crea:
+    - SAP_PROV_ACTIVIDAD_ANUAL: agregados por instancia, tabla de documentos, proveedor y año
+    - SAP_PROV_ACTIVIDAD_MARCA: último DocEntry escaneado por instancia y tabla de documentos
+    Retorna True si ya existían o fueron creadas exitosamente.
+    """
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+                IF OBJECT_ID('SAP_PROV_ACTIVIDAD_ANUAL', 'U') IS NULL
+                    CREATE TABLE SAP_PROV_ACTIVIDAD_ANUAL (
+                        Instancia NVARCHAR(50) NOT NULL,
+                        Tabla NVARCHAR(30) NOT NULL,
+                        CardCode NVARCHAR(50) NOT NULL,
+                        Ano INT NOT NULL,
+                        TotalDocumentos INT NOT NULL,
+                        UltimaFecha DATE,
+                        PRIMARY KEY (Instancia, Tabla, CardCode, Ano)
+                    )
+            """)
+            cursor.execute("""
+                IF OBJECT_ID('SAP_PROV_ACTIVIDAD_MARCA', 'U') IS NULL
+                    CREATE TABLE SAP_PROV_ACTIVIDAD_MARCA (
+                        Instancia NVARCHAR(50) NOT NULL,
+                        Tabla NVARCHAR(30) NOT NULL,
+                        UltimoDocEntry INT,
+                        DesdeAno INT NOT NULL,
+                        ActualizadoEn DATETIME NOT NULL,
+                        PRIMARY KEY (Instancia, Tabla)
+                    )
+            """)
+            conn.commit()
+            return True
+        finally:
+            cursor.close()
 
 
 def get_hana_connection():
+    """Abre una conexión física nueva a SAP HANA (fuera del pool)."""
     settings = get_settings()
     return dbapi.connect(
         address=settings.SAP_HANA_HOST,
@@ -298,64 +544,216 @@ def get_hana_connection():
     )
 
 
-def get_empresas_sap() -> list[str]:
-    conn = get_hana_connection()
+# Pool de conexiones HANA compartido por todo el proceso
+_hana_pool: ConnectionPool | None = None
+_hana_pool_lock = threading.Lock()
+
+
+def _ping_hana(conn) -> None:
+    """Valida que la conexión HANA siga viva antes de entregarla."""
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT SCHEMA_NAME
-        FROM SCHEMAS
-        WHERE SCHEMA_NAME NOT LIKE 'B1%'
-          AND SCHEMA_NAME NOT LIKE '_SYS%'
-          AND SCHEMA_NAME NOT LIKE 'SAP%'
-          AND SCHEMA_NAME NOT LIKE 'XSSQLCC%'
-          AND SCHEMA_NAME NOT LIKE '%_PRUEBAS%'
-          AND SCHEMA_NAME NOT LIKE '%_MIGRACION%'
-          AND SCHEMA_NAME NOT IN ('SYS', 'SYSTEM', 'SBOCOMMON', 'SLDDATA', 'HANA_XS_BASE', 'UIS', 'COMMON')
-        ORDER BY SCHEMA_NAME
-    """)
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    try:
+        cursor.execute("SELECT 1 FROM DUMMY")
+        cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def _reset_hana(conn) -> None:
+    """Descarta la transacción pendiente (si la hay) al devolver la conexión."""
+    if not conn.getautocommit():
+        conn.rollback()
+
+
+def get_hana_pool() -> ConnectionPool:
+    """Retorna el pool de conexiones HANA, creándolo si no existe."""
+    global _hana_pool
+
+    with _hana_pool_lock:
+        if _hana_pool is None:
+            settings = get_settings()
+            _hana_pool = ConnectionPool(
+                name="hana",
+                factory=get_hana_connection,
+                ping=_ping_hana,
+                reset=_reset_hana,
+                max_size=settings.HANA_POOL_SIZE,
+                timeout=settings.HANA_POOL_TIMEOUT,
+                max_lifetime=settings.HANA_POOL_MAX_LIFETIME,
+                max_idle=settings.HANA_POOL_MAX_IDLE
+            )
+        return _hana_pool
+
+
+@contextmanager
+def hana_connection():
+    """
+    Context manager que entrega una conexión del pool HANA y la devuelve al salir.
+    Si el bloque falla y la conexión quedó desconectada (error de red), se descarta
+    en lugar de devolverla, y la siguiente petición abre una nueva.
+    """
+    conn = get_hana_pool().acquire()
+    try:
+        yield conn
+    except BaseException:
+        try:
+            conectada = conn.isconnected()
+        except Exception:
+            conectada = False
+        conn.close(discard=not conectada)
+        raise
+    else:
+        conn.close()
+
+
+def dispose_hana_pool() -> None:
+    """Cierra las conexiones inactivas del pool HANA."""
+    with _hana_pool_lock:
+        pool = _hana_pool
+    if pool is not None:
+        pool.dispose()
+
+
+def get_hana_pool_stats() -> dict | None:
+    """Retorna métricas del pool HANA (None si aún no se ha usado)."""
+    with _hana_pool_lock:
+        pool = _hana_pool
+    return pool.stats() if pool is not None else None
+
+
+def get_empresas_sap() -> list[str]:
+    with hana_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT SCHEMA_NAME
+                FROM SCHEMAS
+                WHERE SCHEMA_NAME NOT LIKE 'B1%'
+                  AND SCHEMA_NAME NOT LIKE '_SYS%'
+                  AND SCHEMA_NAME NOT LIKE 'SAP%'
+                  AND SCHEMA_NAME NOT LIKE 'XSSQLCC%'
+                  AND SCHEMA_NAME NOT LIKE '%_PRUEBAS%'
+                  AND SCHEMA_NAME NOT LIKE '%_MIGRACION%'
+                  AND SCHEMA_NAME NOT IN ('SYS', 'SYSTEM', 'SBOCOMMON', 'SLDDATA', 'HANA_XS_BASE', 'UIS', 'COMMON')
+                ORDER BY SCHEMA_NAME
+            """)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
     return [row[0] for row in rows]
 
 
 def schema_exists_in_hana(schema_name: str) -> bool:
     """Verifica si un schema existe en HANA."""
-    conn = get_hana_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT COUNT(*) FROM SCHEMAS WHERE SCHEMA_NAME = ?",
-        (schema_name,)
-    )
-    result = cursor.fetchone()[0]
-    cursor.close()
-    conn.close()
+    with hana_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT COUNT(*) FROM SCHEMAS WHERE SCHEMA_NAME = ?",
+                (schema_name,)
+            )
+            result = cursor.fetchone()[0]
+        finally:
+            cursor.close()
     return result > 0
 
 
 def get_oadm_data(schema_name: str) -> dict:
     """Obtiene PrintHeadr, CompnyAddr, TaxIdNum de la tabla OADM de una instancia."""
-    conn = get_hana_connection()
-    cursor = conn.cursor()
+    with hana_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f'''
+                SELECT "PrintHeadr", "CompnyAddr", "TaxIdNum"
+                FROM "{schema_name}"."OADM"
+                LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            if row:
+                return {
+                    "PrintHeadr": row[0] or "",
+                    "CompnyAddr": row[1] or "",
+                    "TaxIdNum": row[2] or ""
+                }
+        except Exception:
+            pass
+        finally:
+            cursor.close()
+    return _oadm_vacio()
+
+
+# Instancias por consulta UNION ALL al leer OADM en lote
+OADM_LOTE = 100
+
+
+def _oadm_vacio() -> dict:
+    return {"PrintHeadr": "", "CompnyAddr": "", "TaxIdNum": ""}
+
+
+def _leer_oadm_lote(cursor, instancias: list[str]) -> dict:
+    """
+    Lee el encabezado de OADM de varias instancias con una sola consulta UNION ALL.
+    Si la consulta del lote falla (por ejemplo, un schema sin OADM o sin permisos),
+    repite el lote instancia por instancia sobre el mismo cursor.
+    """
+    subconsultas = [
+        f"""SELECT '{instancia.replace("'", "''")}' AS "Instancia", "PrintHeadr", "CompnyAddr", "TaxIdNum"
+            FROM (SELECT "PrintHeadr", "CompnyAddr", "TaxIdNum" FROM "{instancia.replace('"', '""')}"."OADM" LIMIT 1)"""
+        for instancia in instancias
+    ]
     try:
-        cursor.execute(f'''
-            SELECT "PrintHeadr", "CompnyAddr", "TaxIdNum"
-            FROM "{schema_name}"."OADM"
-            LIMIT 1
-        ''')
-        row = cursor.fetchone()
-        if row:
-            return {
-                "PrintHeadr": row[0] or "",
-                "CompnyAddr": row[1] or "",
-                "TaxIdNum": row[2] or ""
-            }
+        cursor.execute("\nUNION ALL\n".join(subconsultas))
+        filas = cursor.fetchall()
     except Exception:
-        pass
-    finally:
-        cursor.close()
-        conn.close()
-    return {"PrintHeadr": "", "CompnyAddr": "", "TaxIdNum": ""}
+        filas = []
+        for instancia, subconsulta in zip(instancias, subconsultas):
+            try:
+                cursor.execute(subconsulta)
+                filas.extend(cursor.fetchall())
+            except Exception:
+                pass
+
+    return {
+        row[0]: {"PrintHeadr": row[1] or "", "CompnyAddr": row[2] or "", "TaxIdNum": row[3] or ""}
+        for row in filas
+    }
+
+
+def get_metadata_empresas(empresas: list[str]) -> dict:
+    """
+    Obtiene de HANA, con una sola conexión del pool, los datos de SAP_EMPRESAS de todas las instancias:
+    - existencia de la versión _PRUEBAS (una consulta a SCHEMAS)
+    - PrintHeadr, CompnyAddr, TaxIdNum de OADM (consultas UNION ALL de hasta OADM_LOTE instancias)
+    Retorna {instancia: {"tiene_pruebas", "PrintHeadr", "CompnyAddr", "TaxIdNum"}}.
+    Las instancias sin OADM legible quedan con los datos de OADM vacíos, como en get_oadm_data.
+    """
+    if not empresas:
+        return {}
+
+    with hana_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            schemas_pruebas = [f"{instancia}_PRUEBAS" for instancia in empresas]
+            placeholders = ", ".join(["?"] * len(schemas_pruebas))
+            cursor.execute(
+                f"SELECT SCHEMA_NAME FROM SCHEMAS WHERE SCHEMA_NAME IN ({placeholders})",
+                schemas_pruebas
+            )
+            existentes = {row[0] for row in cursor.fetchall()}
+
+            oadm = {}
+            for inicio in range(0, len(empresas), OADM_LOTE):
+                oadm.update(_leer_oadm_lote(cursor, empresas[inicio:inicio + OADM_LOTE]))
+        finally:
+            cursor.close()
+
+    return {
+        instancia: {
+            "tiene_pruebas": f"{instancia}_PRUEBAS" in existentes,
+            **oadm.get(instancia, _oadm_vacio())
+        }
+        for instancia in empresas
+    }
 
 
 def inicializa_sap_empresas() -> dict:
@@ -366,82 +764,73 @@ def inicializa_sap_empresas() -> dict:
     3. Crea la tabla SAP_PROVEEDORES
     4. Crea la tabla USER_SESSIONS (para el sistema de sesiones)
     5. Obtiene las instancias de HANA
-    6. Para cada instancia, verifica si existe versión _PRUEBAS
-    7. Obtiene datos de OADM
-    8. Inserta en SAP_EMPRESAS
+    6. Obtiene en lote si existe versión _PRUEBAS y los datos de OADM
+    7. Inserta en SAP_EMPRESAS
     """
-    from session import ensure_sessions_table_exists
-
     # Eliminar y recrear la base de datos
     drop_and_create_database()
 
     # Pequeña pausa para asegurar que la base de datos esté completamente lista
-    import time
     time.sleep(0.5)
 
-    ensure_table_sap_empresas_exists()
-    ensure_table_sap_proveedores_exists()
-
-    # Recrear tabla de sesiones (necesaria para el sistema de autenticación)
-    ensure_sessions_table_exists()
+    # Recrear todas las tablas registradas (SETTINGS, SAP_EMPRESAS, SAP_PROVEEDORES
+    # y USER_SESSIONS, necesaria para el sistema de autenticación)
+    ensure_schema_ready()
 
     empresas = get_empresas_sap()
+    metadata = get_metadata_empresas(empresas)
 
-    mssql_conn = get_mssql_connection()
-    mssql_cursor = mssql_conn.cursor()
-
-    insertados = 0
-    errores = []
+    with mssql_connection() as mssql_conn:
+        mssql_cursor = mssql_conn.cursor()
 
-    for instancia in empresas:
-        try:
-            # Verificar si existe versión _PRUEBAS
-            tiene_pruebas = schema_exists_in_hana(f"{instancia}_PRUEBAS")
+        insertados = 0
+        errores = []
 
-            # Obtener datos de OADM
-            oadm = get_oadm_data(instancia)
+        for instancia in empresas:
+            try:
+                oadm = metadata[instancia]
+                tiene_pruebas = oadm["tiene_pruebas"]
 
-            # Si PrintHeadr está vacío, usar el nombre de la instancia
-            print_headr = oadm["PrintHeadr"] if oadm["PrintHeadr"] else instancia
+                # Si PrintHeadr está vacío, usar el nombre de la instancia
+                print_headr = oadm["PrintHeadr"] if oadm["PrintHeadr"] else instancia
 
-            # Insertar en SAP_EMPRESAS
-            mssql_cursor.execute(
-                """
-                INSERT INTO SAP_EMPRESAS (Instancia, Prueba, PrintHeadr, CompnyAddr, TaxIdNum)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (
-                    instancia,
-                    1 if tiene_pruebas else 0,
-                    print_headr,
-                    oadm["CompnyAddr"],
-                    oadm["TaxIdNum"]
+                # Insertar en SAP_EMPRESAS
+                mssql_cursor.execute(
+                    """
+                    INSERT INTO SAP_EMPRESAS (Instancia, Prueba, PrintHeadr, CompnyAddr, TaxIdNum)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (
+                        instancia,
+                        1 if tiene_pruebas else 0,
+                        print_headr,
+                        oadm["CompnyAddr"],
+                        oadm["TaxIdNum"]
+                    )
                 )
-            )
-            insertados += 1
-        except Exception as e:
-            errores.append({"instancia": instancia, "error": str(e)})
+                insertados += 1
+            except Exception as e:
+                errores.append({"instancia": instancia, "error": str(e)})
 
-    mssql_conn.commit()
+        mssql_conn.commit()
 
-    # Crear vistas para los modos de operación (productivo/pruebas)
-    mssql_cursor.execute("""
-        CREATE OR ALTER VIEW dbo.vw_productivo AS
-        SELECT Instancia, PrintHeadr, CompnyAddr, TaxIdNum
-        FROM SAP_EMPRESAS
-        WHERE SL = 1
-    """)
+        # Crear vistas para los modos de operación (productivo/pruebas)
+        mssql_cursor.execute("""
+            CREATE OR ALTER VIEW dbo.vw_productivo AS
+            SELECT Instancia, PrintHeadr, CompnyAddr, TaxIdNum
+            FROM SAP_EMPRESAS
+            WHERE SL = 1
+        """)
 
-    mssql_cursor.execute("""
-        CREATE OR ALTER VIEW dbo.vw_pruebas AS
-        SELECT Instancia, PrintHeadr, CompnyAddr, TaxIdNum
-        FROM SAP_EMPRESAS
-        WHERE SLP = 1 AND Prueba = 1
-    """)
+        mssql_cursor.execute("""
+            CREATE OR ALTER VIEW dbo.vw_pruebas AS
+            SELECT Instancia, PrintHeadr, CompnyAddr, TaxIdNum
+            FROM SAP_EMPRESAS
+            WHERE SLP = 1 AND Prueba = 1
+        """)
 
-    mssql_conn.commit()
-    mssql_cursor.close()
-    mssql_conn.close()
+        mssql_conn.commit()
+        mssql_cursor.close()
 
     return {
         "total_empresas": len(empresas),
@@ -453,6 +842,10 @@ def inicializa_sap_empresas() -> dict:
 def test_service_layer_login(company_db: str) -> dict:
     """
     Prueba login en SAP B1 Service Layer para una instancia específica.
+    Usa el pool de sesiones: si ya hay una sesión vigente para la instancia se reutiliza
+    y la sesión queda abierta para las siguientes llamadas (no se hace Logout).
+    La sesión en caché no basta: se hace una consulta autenticada (SL_PROBE_PATH) que
+    llega al servidor, con login de nuevo si la sesión venció.
     Retorna el resultado del intento de conexión.
     """
     settings = get_settings()
@@ -460,33 +853,15 @@ def test_service_layer_login(company_db: str) -> dict:
     if not settings.SAP_B1_SERVICE_LAYER_URL:
         return {"success": False, "error": "SAP_B1_SERVICE_LAYER_URL no configurada"}
 
-    login_url = f"{settings.SAP_B1_SERVICE_LAYER_URL}Login"
-
-    payload = {
-        "CompanyDB": company_db,
-        "UserName": settings.SAP_B1_USER,
-        "Password": settings.SAP_B1_PASSWORD
-    }
-
     try:
-        with httpx.Client(verify=False, timeout=30.0) as client:
-            response = client.post(login_url, json=payload)
-
-            if response.status_code == 200:
-                # Hacer logout para liberar la sesión
-                session_id = response.cookies.get("B1SESSION")
-                if session_id:
-                    logout_url = f"{settings.SAP_B1_SERVICE_LAYER_URL}Logout"
-                    client.post(logout_url, cookies={"B1SESSION": session_id})
-                return {"success": True, "status_code": response.status_code}
-            else:
-                error_msg = response.text
-                try:
-                    error_json = response.json()
-                    error_msg = error_json.get("error", {}).get("message", {}).get("value", response.text)
-                except:
-                    pass
-                return {"success": False, "status_code": response.status_code, "error": error_msg}
+        response = get_sl_session_pool().request(get_sl_http_client(), "GET", company_db, SL_PROBE_PATH)
+        if not response.is_success:
+            return {"success": False, "status_code": response.status_code, "error": sl_error_message(response)}
+        return {"success": True, "status_code": response.status_code}
+    except ServiceLayerCircuitOpenError as e:
+        return {"success": False, "circuito_abierto": True, "error": e.message}
+    except ServiceLayerLoginError as e:
+        return {"success": False, "status_code": e.status_code, "error": e.message}
     except httpx.TimeoutException:
         return {"success": False, "error": "Timeout de conexión"}
     except httpx.ConnectError as e:
@@ -532,6 +907,88 @@ def send_email(to_email: str, subject: str, body: str, attachment: dict | None =
         return {"success": False, "error": str(e)}
 
 
+# Campos de BusinessPartners que se consultan en Service Layer - Campos ordenados lógicamente:
+# 1. Identificación, 2. Fechas, 3. Dirección, 4. Dirección postal, 5. Contacto,
+# 6. Financiero, 7. Impuestos, 8. Bancario, 9. Saldos, 10. Estado
+PROVEEDORES_SL_SELECT = (
+    # Identificación básica
+    "CardCode,CardName,GroupCode,FederalTaxID,"
+    # Fechas de auditoría
+    "CreateDate,CreateTime,UpdateDate,UpdateTime,"
+    # Dirección principal (Calle, Colonia, CP, Ciudad, Municipio/Condado, Estado, País)
+    "Address,Block,ZipCode,City,County,BillToState,Country,"
+    # Dirección postal / Envío
+    "MailAddress,MailZipCode,ShipToState,ShipToDefault,"
+    # Contacto (Teléfonos, Fax, Email, Celular, Persona de contacto)
+    "Phone1,Phone2,Fax,Cellular,EmailAddress,ContactPerson,"
+    # Condiciones financieras
+    "PayTermsGrpCode,PeymentMethodCode,CreditLimit,MaxCommitment,"
+    "DiscountPercent,PriceListNum,Currency,"
+    # Impuestos y deducciones
+    "DeductibleAtSource,DeductionPercent,DeductionValidUntil,VatGroupLatinAmerica,"
+    # Datos bancarios
+    "DefaultBankCode,DefaultAccount,BankCountry,HouseBank,HouseBankCountry,"
+    "HouseBankAccount,HouseBankBranch,HouseBankIBAN,IBAN,"
+    "CreditCardCode,CreditCardNum,CreditCardExpiration,DebitorAccount,"
+    # Saldos y oportunidades
+    "CurrentAccountBalance,OpenDeliveryNotesBalance,OpenOrdersBalance,"
+    "OpenChecksBalance,OpenOpportunities,"
+    # Estado del proveedor
+    "Valid,Frozen,BlockDunning,BackOrder,PartialDelivery"
+)
+
+
+def _proveedores_sl_endpoint(
+    card_code: str | None = None,
+    card_name: str | None = None,
+    federal_tax_id: str | None = None,
+    top: int | None = None,
+    actualizado_desde: date | None = None,
+    select: str = PROVEEDORES_SL_SELECT
+) -> str:
+    """
+    Construye la consulta de proveedores (CardType='S') para Service Layer.
+    actualizado_desde: solo proveedores con UpdateDate >= esa fecha (sincronización incremental)
+    select: campos a consultar (por ejemplo solo "CardCode" para el pase de llaves)
+    """
+    filters = ["CardType eq 'S'"]
+    if actualizado_desde:
+        filters.append(f"UpdateDate ge '{actualizado_desde.isoformat()}'")
+    if card_code:
+        filters.append(f"contains(CardCode, '{card_code}')")
+    if card_name:
+        filters.append(f"contains(CardName, '{card_name}')")
+    if federal_tax_id:
+        filters.append(f"contains(FederalTaxID, '{federal_tax_id}')")
+    filter_str = " and ".join(filters)
+
+    endpoint = (
+        "BusinessPartners"
+        f"?$filter={filter_str}"
+        f"&$select={select}"
+        f"&$orderby=CardCode"
+        f"&$inlinecount=allpages"
+    )
+    if top is not None:
+        endpoint += f"&$top={top}"
+    return endpoint
+
+
+def iter_paginas_proveedores_sl(company_db: str, page_size: int | None = None, **filtros) -> Iterator[list[dict]]:
+    """
+    Generador de páginas de proveedores desde Service Layer (una lista de registros por página).
+    Lanza ServiceLayerLoginError / ServiceLayerRequestError si el login o una página fallan.
+    """
+    for pagina in iter_sl_pages(company_db, _proveedores_sl_endpoint(**filtros), page_size=page_size):
+        yield pagina.get("value", [])
+
+
+def iter_proveedores_sl(company_db: str, page_size: int | None = None, **filtros) -> Iterator[dict]:
+    """Generador de proveedores desde Service Layer, registro por registro."""
+    for pagina in iter_paginas_proveedores_sl(company_db, page_size=page_size, **filtros):
+        yield from pagina
+
+
 def get_proveedores_sl(
     company_db: str,
     top: int | None = None,
@@ -541,6 +998,7 @@ def get_proveedores_sl(
 ) -> dict:
     """
     Obtiene los proveedores (BusinessPartners con CardType='S') desde Service Layer.
+    Se consultan por páginas (SL_PAGE_SIZE) en lugar de una sola respuesta con todo.
     top: limita el número de registros retornados (opcional)
     card_code: filtra por CardCode específico (opcional)
     card_name: filtra por CardName que contenga el valor (opcional)
@@ -551,103 +1009,32 @@ def get_proveedores_sl(
     if not settings.SAP_B1_SERVICE_LAYER_URL:
         return {"success": False, "error": "SAP_B1_SERVICE_LAYER_URL no configurada"}
 
-    login_url = f"{settings.SAP_B1_SERVICE_LAYER_URL}Login"
-
-    payload = {
-        "CompanyDB": company_db,
-        "UserName": settings.SAP_B1_USER,
-        "Password": settings.SAP_B1_PASSWORD
-    }
+    endpoint = _proveedores_sl_endpoint(card_code, card_name, federal_tax_id, top)
+    page_size = min(top, settings.SL_PAGE_SIZE) if top else None
 
     try:
-        with httpx.Client(verify=False, timeout=60.0) as client:
-            # Login
-            response = client.post(login_url, json=payload)
-
-            if response.status_code != 200:
-                error_msg = response.text
-                try:
-                    error_json = response.json()
-                    error_msg = error_json.get("error", {}).get("message", {}).get("value", response.text)
-                except:
-                    pass
-                return {"success": False, "error": error_msg}
-
-            session_id = response.cookies.get("B1SESSION")
-
-            # Consultar proveedores - Campos ordenados lógicamente:
-            # 1. Identificación, 2. Fechas, 3. Dirección, 4. Dirección postal, 5. Contacto,
-            # 6. Financiero, 7. Impuestos, 8. Bancario, 9. Saldos, 10. Estado
-            select_fields = (
-                # Identificación básica
-                "CardCode,CardName,GroupCode,FederalTaxID,"
-                # Fechas de auditoría
-                "CreateDate,CreateTime,UpdateDate,UpdateTime,"
-                # Dirección principal (Calle, Colonia, CP, Ciudad, Municipio/Condado, Estado, País)
-                "Address,Block,ZipCode,City,County,BillToState,Country,"
-                # Dirección postal / Envío
-                "MailAddress,MailZipCode,ShipToState,ShipToDefault,"
-                # Contacto (Teléfonos, Fax, Email, Celular, Persona de contacto)
-                "Phone1,Phone2,Fax,Cellular,EmailAddress,ContactPerson,"
-                # Condiciones financieras
-                "PayTermsGrpCode,PeymentMethodCode,CreditLimit,MaxCommitment,"
-                "DiscountPercent,PriceListNum,Currency,"
-                # Impuestos y deducciones
-                "DeductibleAtSource,DeductionPercent,DeductionValidUntil,VatGroupLatinAmerica,"
-                # Datos bancarios
-                "DefaultBankCode,DefaultAccount,BankCountry,HouseBank,HouseBankCountry,"
-                "HouseBankAccount,HouseBankBranch,HouseBankIBAN,IBAN,"
-                "CreditCardCode,CreditCardNum,CreditCardExpiration,DebitorAccount,"
-                # Saldos y oportunidades
-                "CurrentAccountBalance,OpenDeliveryNotesBalance,OpenOrdersBalance,"
-                "OpenChecksBalance,OpenOpportunities,"
-                # Estado del proveedor
-                "Valid,Frozen,BlockDunning,BackOrder,PartialDelivery"
-            )
-
-            # Construir filtro
-            filters = ["CardType eq 'S'"]
-            if card_code:
-                filters.append(f"contains(CardCode, '{card_code}')")
-            if card_name:
-                filters.append(f"contains(CardName, '{card_name}')")
-            if federal_tax_id:
-                filters.append(f"contains(FederalTaxID, '{federal_tax_id}')")
-            filter_str = " and ".join(filters)
-
-            endpoint = (
-                f"{settings.SAP_B1_SERVICE_LAYER_URL}BusinessPartners"
-                f"?$filter={filter_str}"
-                f"&$select={select_fields}"
-                f"&$inlinecount=allpages"
-            )
-
-            if top is not None:
-                endpoint += f"&$top={top}"
-
-            # Usar top para maxpagesize si está presente, sino 0 (sin límite)
-            max_pagesize = top if top is not None else 0
-            headers = {"Prefer": f"odata.maxpagesize={max_pagesize}"}
-            bp_response = client.get(
-                endpoint,
-                cookies={"B1SESSION": session_id},
-                headers=headers
-            )
-
-            # Logout
-            logout_url = f"{settings.SAP_B1_SERVICE_LAYER_URL}Logout"
-            client.post(logout_url, cookies={"B1SESSION": session_id})
+        proveedores = []
+        total = None
+        for pagina in iter_sl_pages(company_db, endpoint, page_size=page_size):
+            if total is None:
+                total = pagina.get("odata.count", pagina.get("@odata.count"))
+            proveedores.extend(pagina.get("value", []))
+            if top is not None and len(proveedores) >= top:
+                proveedores = proveedores[:top]
+                break
 
-            if bp_response.status_code != 200:
-                return {"success": False, "error": f"Error al consultar proveedores: {bp_response.text}"}
-
-            data = bp_response.json()
-            return {
-                "success": True,
-                "total": data.get("odata.count", len(data.get("value", []))),
-                "proveedores": data.get("value", [])
-            }
+        return {
+            "success": True,
+            "total": total if total is not None else len(proveedores),
+            "proveedores": proveedores
+        }
 
+    except ServiceLayerCircuitOpenError as e:
+        return {"success": False, "circuito_abierto": True, "error": e.message}
+    except ServiceLayerLoginError as e:
+        return {"success": False, "error": e.message}
+    except ServiceLayerRequestError as e:
+        return {"success": False, "error": f"Error al consultar proveedores: {e.message}"}
     except httpx.TimeoutException:
         return {"success": False, "error": "Timeout de conexión"}
     except httpx.ConnectError as e:
@@ -656,29 +1043,90 @@ def get_proveedores_sl(
         return {"success": False, "error": str(e)}
 
 
-def test_service_layer_all_instances(sap_empresas_result: dict | None = None, skip_email: bool = False) -> dict:
+# Filas por UPDATE de flags SL/SLP (3 parámetros por fila, límite de 2100 parámetros de MSSQL)
+FLAGS_SL_LOTE = 500
+
+
+def actualizar_flags_sl(flags: dict) -> int:
     """
-    Prueba la conexión a Service Layer para todas las instancias de SAP.
-    Actualiza los campos SL y SLP en SAP_EMPRESAS:
-    - SL: Service Layer de instancia productiva
-    - SLP: Service Layer de instancia de prueba (instancia_PRUEBAS)
+    Aplica los resultados de las pruebas de Service Layer a SAP_EMPRESAS con un UPDATE
+    unido a una tabla VALUES (Instancia, SL, SLP), en una sola transacción.
+    flags: {instancia: {"SL": 0/1, "SLP": 0/1}}; una llave ausente conserva el valor actual.
+    Retorna cuántas filas se actualizaron.
+    """
+    filas = [
+        (instancia, valores.get("SL"), valores.get("SLP"))
+        for instancia, valores in flags.items()
+        if valores
+    ]
+    if not filas:
+        return 0
 
-    Opcionalmente envía correo con resultados.
+    actualizadas = 0
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            for inicio in range(0, len(filas), FLAGS_SL_LOTE):
+                lote = filas[inicio:inicio + FLAGS_SL_LOTE]
+                valores_sql = ", ".join(["(?, CAST(? AS BIT), CAST(? AS BIT))"] * len(lote))
+                cursor.execute(f"""
+                    UPDATE e
+                    SET SL = COALESCE(v.SL, e.SL),
+                        SLP = COALESCE(v.SLP, e.SLP)
+                    FROM SAP_EMPRESAS e
+                    INNER JOIN (VALUES {valores_sql}) AS v (Instancia, SL, SLP)
+                        ON e.Instancia = v.Instancia
+                """, [valor for fila in lote for valor in fila])
+                actualizadas += cursor.rowcount
+            conn.commit()
+        finally:
+            cursor.close()
 
-    sap_empresas_result: resultado de inicializa_sap_empresas() para incluir en el correo
-    skip_email: si es True, no envía correo (para cuando se llama desde inicializa_datos)
+    return actualizadas
+
+
+def get_instancias_sap_empresas() -> dict:
+    """Instancias de SAP_EMPRESAS con su versión de prueba: {instancia: {"tiene_prueba": bool}}."""
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT Instancia, Prueba FROM SAP_EMPRESAS ORDER BY Instancia")
+            return {row[0]: {"tiene_prueba": bool(row[1])} for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+
+def pruebas_service_layer(instancias_info: dict) -> list[tuple[str, str, str, str]]:
+    """Logins a probar: (company_db, instancia, tipo, columna en SAP_EMPRESAS)."""
+    pruebas = []
+    for instancia, info in instancias_info.items():
+        pruebas.append((instancia, instancia, "productivo", "SL"))
+        if info["tiene_prueba"]:
+            pruebas.append((f"{instancia}_PRUEBAS", instancia, "pruebas", "SLP"))
+    return pruebas
+
+
+def probar_service_layer(company_dbs: list[str]) -> dict[str, dict]:
     """
-    import concurrent.futures
-    settings = get_settings()
+    Prueba login/logout de las CompanyDB con el motor async (probar_logins_sl).
+    Sin SAP_B1_SERVICE_LAYER_URL o si se agota el plazo, todas quedan como fallidas.
+    """
+    if not get_settings().SAP_B1_SERVICE_LAYER_URL:
+        return {
+            company_db: {"success": False, "error": "SAP_B1_SERVICE_LAYER_URL no configurada"}
+            for company_db in company_dbs
+        }
+    try:
+        return probar_logins_sl(company_dbs)
+    except TimeoutError as e:
+        return {company_db: {"success": False, "timeout": True, "error": str(e)} for company_db in company_dbs}
 
-    # Obtener instancias con información de si tienen versión de prueba
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT Instancia, Prueba FROM SAP_EMPRESAS ORDER BY Instancia")
-    instancias_info = {row[0]: {"tiene_prueba": bool(row[1])} for row in cursor.fetchall()}
-    cursor.close()
-    conn.close()
 
+def resumir_pruebas_service_layer(instancias_info: dict, pruebas: list, probados: dict) -> tuple[dict, dict]:
+    """
+    Arma el resultado de las pruebas de Service Layer y los valores SL/SLP por instancia.
+    Retorna (resultado, flags) con flags = {instancia: {"SL": 0/1, "SLP": 0/1}}.
+    """
     resultados = {
         "productivo": {
             "exitosos": [],
@@ -690,116 +1138,25 @@ def test_service_layer_all_instances(sap_empresas_result: dict | None = None, sk
         }
     }
 
-    def test_instancia_productiva(instancia: str):
-        """Prueba login en instancia productiva."""
-        try:
-            resultado = test_service_layer_login(instancia)
-
-            # Actualizar SL en base de datos
-            conn_local = get_mssql_connection()
-            cursor_local = conn_local.cursor()
-            try:
-                cursor_local.execute(
-                    "UPDATE SAP_EMPRESAS SET SL = ? WHERE Instancia = ?",
-                    (1 if resultado["success"] else 0, instancia)
-                )
-                conn_local.commit()
-            finally:
-                cursor_local.close()
-                conn_local.close()
-
-            if resultado["success"]:
-                return {"instancia": instancia, "success": True, "tipo": "productivo"}
-            else:
-                return {
-                    "instancia": instancia,
-                    "success": False,
-                    "tipo": "productivo",
-                    "error": resultado.get("error", "Error desconocido")
-                }
-        except Exception as e:
-            return {
-                "instancia": instancia,
-                "success": False,
-                "tipo": "productivo",
-                "error": str(e)
-            }
-
-    def test_instancia_prueba(instancia: str):
-        """Prueba login en instancia de prueba (instancia_PRUEBAS)."""
-        try:
-            instancia_prueba = f"{instancia}_PRUEBAS"
-            resultado = test_service_layer_login(instancia_prueba)
+    # Resultado de cada prueba por instancia: {"SL": 0/1, "SLP": 0/1}
+    flags = {instancia: {} for instancia in instancias_info}
 
-            # Actualizar columna SLP
-            conn_local = get_mssql_connection()
-            cursor_local = conn_local.cursor()
-            try:
-                cursor_local.execute(
-                    "UPDATE SAP_EMPRESAS SET SLP = ? WHERE Instancia = ?",
-                    (1 if resultado["success"] else 0, instancia)
-                )
-                conn_local.commit()
-            finally:
-                cursor_local.close()
-                conn_local.close()
+    for company_db, instancia, tipo, columna in pruebas:
+        resultado = probados.get(company_db, {"success": False, "error": "Sin resultado"})
+        flags[instancia][columna] = 1 if resultado["success"] else 0
 
-            if resultado["success"]:
-                return {"instancia": instancia_prueba, "success": True, "tipo": "prueba"}
-            else:
-                return {
-                    "instancia": instancia_prueba,
-                    "success": False,
-                    "tipo": "prueba",
-                    "error": resultado.get("error", "Error desconocido")
-                }
-        except Exception as e:
-            return {
-                "instancia": f"{instancia}_PRUEBAS",
-                "success": False,
-                "tipo": "prueba",
-                "error": str(e)
+        if resultado["success"]:
+            resultados[tipo]["exitosos"].append(company_db)
+        else:
+            fallido = {
+                "instancia": company_db,
+                "error": resultado.get("error", "Error desconocido")
             }
-
-    # Ejecutar pruebas en paralelo para mejorar performance
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        futures = []
-
-        # Programar pruebas de instancias productivas
-        for instancia in instancias_info.keys():
-            futures.append(executor.submit(test_instancia_productiva, instancia))
-
-        # Programar pruebas de instancias de prueba (solo si tienen versión _PRUEBAS)
-        for instancia, info in instancias_info.items():
-            if info["tiene_prueba"]:
-                futures.append(executor.submit(test_instancia_prueba, instancia))
-
-        # Recolectar resultados
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                resultado = future.result(timeout=60)  # Timeout de 60 segundos por prueba
-                if resultado["tipo"] == "productivo":
-                    if resultado["success"]:
-                        resultados["productivo"]["exitosos"].append(resultado["instancia"])
-                    else:
-                        resultados["productivo"]["fallidos"].append({
-                            "instancia": resultado["instancia"],
-                            "error": resultado.get("error", "Error desconocido")
-                        })
-                else:  # prueba
-                    if resultado["success"]:
-                        resultados["pruebas"]["exitosos"].append(resultado["instancia"])
-                    else:
-                        resultados["pruebas"]["fallidos"].append({
-                            "instancia": resultado["instancia"],
-                            "error": resultado.get("error", "Error desconocido")
-                        })
-            except concurrent.futures.TimeoutError:
-                # Timeout - registrar como fallido
-                pass
-            except Exception as e:
-                # Error en el thread, registrar como fallido
-                pass
+            if resultado.get("timeout"):
+                fallido["timeout"] = True
+            if resultado.get("circuito_abierto"):
+                fallido["circuito_abierto"] = True
+            resultados[tipo]["fallidos"].append(fallido)
 
     resultado_final = {
         "total_instancias": len(instancias_info),
@@ -807,6 +1164,7 @@ def test_service_layer_all_instances(sap_empresas_result: dict | None = None, sk
             "total": len(instancias_info),
             "exitosos": len(resultados["productivo"]["exitosos"]),
             "fallidos": len(resultados["productivo"]["fallidos"]),
+            "timeouts": sum(1 for f in resultados["productivo"]["fallidos"] if f.get("timeout")),
             "detalle_exitosos": sorted(resultados["productivo"]["exitosos"]),
             "detalle_fallidos": resultados["productivo"]["fallidos"]
         },
@@ -814,10 +1172,37 @@ def test_service_layer_all_instances(sap_empresas_result: dict | None = None, sk
             "total": sum(1 for info in instancias_info.values() if info["tiene_prueba"]),
             "exitosos": len(resultados["pruebas"]["exitosos"]),
             "fallidos": len(resultados["pruebas"]["fallidos"]),
+            "timeouts": sum(1 for f in resultados["pruebas"]["fallidos"] if f.get("timeout")),
             "detalle_exitosos": sorted(resultados["pruebas"]["exitosos"]),
             "detalle_fallidos": resultados["pruebas"]["fallidos"]
         }
     }
+    return resultado_final, flags
+
+
+def test_service_layer_all_instances(sap_empresas_result: dict | None = None, skip_email: bool = False) -> dict:
+    """
+    Prueba la conexión a Service Layer para todas las instancias de SAP.
+    Actualiza los campos SL y SLP en SAP_EMPRESAS:
+    - SL: Service Layer de instancia productiva
+    - SLP: Service Layer de instancia de prueba (instancia_PRUEBAS)
+
+    Las instancias productivas y las _PRUEBAS se prueban en una sola pasada async
+    (SL_PROBE_CONCURRENCIA logins simultáneos, SL_PROBE_TIMEOUT segundos por login).
+    Los logins que exceden el plazo se reportan como fallidos con "timeout": True.
+
+    Opcionalmente envía correo con resultados.
+
+    sap_empresas_result: resultado de inicializa_sap_empresas() para incluir en el correo
+    skip_email: si es True, no envía correo (para cuando se llama desde inicializa_datos)
+    """
+    settings = get_settings()
+
+    instancias_info = get_instancias_sap_empresas()
+    pruebas = pruebas_service_layer(instancias_info)
+    probados = probar_service_layer([company_db for company_db, _, _, _ in pruebas])
+    resultado_final, flags = resumir_pruebas_service_layer(instancias_info, pruebas, probados)
+    actualizar_flags_sl(flags)
 
     # Enviar correo con resultados (solo si no se omite)
     if settings.EMAIL_SUPERVISOR and not skip_email:
@@ -885,12 +1270,15 @@ def enviar_correo_inicializacion(
         total_actualizados = sap_proveedores_result.get('proveedores_actualizados', 0)
         total_insertados = sap_proveedores_result.get('proveedores_insertados', 0)
         total_eliminados = sap_proveedores_result.get('proveedores_eliminados', 0)
+        total_sin_cambios = sap_proveedores_result.get('proveedores_sin_cambios', 0)
         total_instancias = sap_proveedores_result.get('total_instancias', 0)
-        total_proveedores = total_actualizados + total_insertados
+        total_proveedores = total_actualizados + total_insertados + total_sin_cambios
 
         body_lines.append(f"SAP Proveedores: {total_proveedores:,} sincronizados de {total_instancias} instancias")
         body_lines.append(f"  - Actualizados: {total_actualizados:,}")
         body_lines.append(f"  - Insertados: {total_insertados:,}")
+        if total_sin_cambios > 0:
+            body_lines.append(f"  - Sin cambios: {total_sin_cambios:,}")
         if total_eliminados > 0:
             body_lines.append(f"  - Eliminados: {total_eliminados:,}")
 
@@ -917,6 +1305,7 @@ def enviar_correo_inicializacion(
             "proveedores_actualizados": sap_proveedores_result.get('proveedores_actualizados', 0),
             "proveedores_insertados": sap_proveedores_result.get('proveedores_insertados', 0),
             "proveedores_eliminados": sap_proveedores_result.get('proveedores_eliminados', 0),
+            "proveedores_sin_cambios": sap_proveedores_result.get('proveedores_sin_cambios', 0),
             "errores": sap_proveedores_result.get('errores', [])
         }
 
@@ -935,20 +1324,19 @@ def get_instancias_con_service_layer() -> list[str]:
     """
     from config import get_modo_pruebas
 
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
-    try:
-        if get_modo_pruebas():
-            # Modo pruebas: usar vw_pruebas (instancias con SLP=1 y Prueba=1)
-            cursor.execute("SELECT Instancia FROM vw_pruebas")
-        else:
-            # Modo productivo: usar vw_productivo (instancias con SL=1)
-            cursor.execute("SELECT Instancia FROM vw_productivo")
-        rows = cursor.fetchall()
-        return [row[0] for row in rows]
-    finally:
-        cursor.close()
-        conn.close()
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if get_modo_pruebas():
+                # Modo pruebas: usar vw_pruebas (instancias con SLP=1 y Prueba=1)
+                cursor.execute("SELECT Instancia FROM vw_pruebas")
+            else:
+                # Modo productivo: usar vw_productivo (instancias con SL=1)
+                cursor.execute("SELECT Instancia FROM vw_productivo")
+            rows = cursor.fetchall()
+            return [row[0] for row in rows]
+        finally:
+            cursor.close()
 
 
 def actualizar_sap_empresas() -> dict:
@@ -961,96 +1349,583 @@ def actualizar_sap_empresas() -> dict:
     - Preserva el campo SL existente
     """
     # Asegurar que exista la base de datos y tabla
-    ensure_database_exists()
-    ensure_table_sap_empresas_exists()
+    ensure_schema_ready()
 
     # Obtener empresas actuales de HANA
     empresas_hana = get_empresas_sap()
+    metadata = get_metadata_empresas(empresas_hana)
 
-    mssql_conn = get_mssql_connection()
-    mssql_cursor = mssql_conn.cursor()
+    with mssql_connection() as mssql_conn:
+        mssql_cursor = mssql_conn.cursor()
 
-    resultados = {
-        "total_empresas": len(empresas_hana),
-        "actualizadas": 0,
-        "insertadas": 0,
-        "eliminadas": 0,
-        "errores": []
+        resultados = {
+            "total_empresas": len(empresas_hana),
+            "actualizadas": 0,
+            "insertadas": 0,
+            "eliminadas": 0,
+            "errores": []
+        }
+
+        # Eliminar empresas que ya no existen en HANA
+        if empresas_hana:
+            placeholders = ", ".join(["?" for _ in empresas_hana])
+            mssql_cursor.execute(
+                f"DELETE FROM SAP_EMPRESAS WHERE Instancia NOT IN ({placeholders})",
+                empresas_hana
+            )
+            resultados["eliminadas"] = mssql_cursor.rowcount
+        else:
+            mssql_cursor.execute("DELETE FROM SAP_EMPRESAS")
+            resultados["eliminadas"] = mssql_cursor.rowcount
+
+        for instancia in empresas_hana:
+            try:
+                oadm = metadata[instancia]
+                tiene_pruebas = oadm["tiene_pruebas"]
+                print_headr = oadm["PrintHeadr"] if oadm["PrintHeadr"] else instancia
+
+                # Verificar si ya existe en MSSQL
+                mssql_cursor.execute(
+                    "SELECT SL FROM SAP_EMPRESAS WHERE Instancia = ?",
+                    [instancia]
+                )
+                row = mssql_cursor.fetchone()
+
+                if row is not None:
+                    # UPDATE - preservar SL
+                    mssql_cursor.execute(
+                        """
+                        UPDATE SAP_EMPRESAS
+                        SET Prueba = ?, PrintHeadr = ?, CompnyAddr = ?, TaxIdNum = ?
+                        WHERE Instancia = ?
+                        """,
+                        (
+                            1 if tiene_pruebas else 0,
+                            print_headr,
+                            oadm["CompnyAddr"],
+                            oadm["TaxIdNum"],
+                            instancia
+                        )
+                    )
+                    resultados["actualizadas"] += 1
+                else:
+                    # INSERT - SL en 0 por defecto
+                    mssql_cursor.execute(
+                        """
+                        INSERT INTO SAP_EMPRESAS (Instancia, SL, Prueba, SLP, PrintHeadr, CompnyAddr, TaxIdNum)
+                        VALUES (?, 0, ?, 0, ?, ?, ?)
+                        """,
+                        (
+                            instancia,
+                            1 if tiene_pruebas else 0,
+                            print_headr,
+                            oadm["CompnyAddr"],
+                            oadm["TaxIdNum"]
+                        )
+                    )
+                    resultados["insertadas"] += 1
+
+            except Exception as e:
+                resultados["errores"].append({"instancia": instancia, "error": str(e)})
+
+        mssql_conn.commit()
+        mssql_cursor.close()
+
+    return resultados
+
+
+# Campos de SAP_PROVEEDORES que vienen de Service Layer (sin Instancia y CardCode que son la llave)
+CAMPOS_PROVEEDOR = [
+    "CardName", "GroupCode", "FederalTaxID",
+    "CreateDate", "CreateTime", "UpdateDate", "UpdateTime",
+    "Address", "Block", "ZipCode", "City", "County", "BillToState", "Country",
+    "MailAddress", "MailZipCode", "ShipToState", "ShipToDefault",
+    "Phone1", "Phone2", "Fax", "Cellular", "EmailAddress", "ContactPerson",
+    "PayTermsGrpCode", "PeymentMethodCode", "CreditLimit", "MaxCommitment",
+    "DiscountPercent", "PriceListNum", "Currency",
+    "DeductibleAtSource", "DeductionPercent", "DeductionValidUntil", "VatGroupLatinAmerica",
+    "DefaultBankCode", "DefaultAccount", "BankCountry", "HouseBank", "HouseBankCountry",
+    "HouseBankAccount", "HouseBankBranch", "HouseBankIBAN", "IBAN",
+    "CreditCardCode", "CreditCardNum", "CreditCardExpiration", "DebitorAccount",
+    "CurrentAccountBalance", "OpenDeliveryNotesBalance", "OpenOrdersBalance",
+    "OpenChecksBalance", "OpenOpportunities",
+    "Valid", "Frozen", "BlockDunning", "BackOrder", "PartialDelivery"
+]
+
+_CAMPOS_FECHA = {"CreateDate", "UpdateDate", "DeductionValidUntil", "CreditCardExpiration"}
+_CAMPOS_HORA = {"CreateTime", "UpdateTime"}
+
+# Tabla temporal de carga masiva (misma estructura que SAP_PROVEEDORES)
+STAGE_PROVEEDORES = "#SAP_PROVEEDORES_STAGE"
+# CardCode que vinieron de SAP pero no se pudieron cargar (no se deben eliminar)
+FALLIDOS_PROVEEDORES = "#SAP_PROVEEDORES_FALLIDOS"
+
+
+def _valor_proveedor(campo: str, valor):
+    """
+    Convierte las fechas y horas de Service Layer (texto ISO) a date/time.
+    fast_executemany enlaza los parámetros con el tipo de la columna destino,
+    así que no se puede depender de la conversión implícita de texto del servidor.
+    """
+    if not isinstance(valor, str):
+        return valor
+    if valor == "":
+        return None
+    try:
+        if campo in _CAMPOS_FECHA:
+            return date.fromisoformat(valor[:10])
+        if campo in _CAMPOS_HORA:
+            return dtime.fromisoformat(valor[:8])
+    except ValueError:
+        pass
+    return valor
+
+
+def hash_proveedor(valores: list) -> bytes:
+    """SHA-256 de los valores de CAMPOS_PROVEEDOR (en ese orden), para detectar cambios."""
+    contenido = json.dumps(valores, default=str, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(contenido.encode("utf-8")).digest()
+
+
+def fila_proveedor(instancia: str, prov: dict) -> list:
+    """Fila (Instancia, CardCode, CAMPOS_PROVEEDOR..., RowHash) lista para la tabla de carga."""
+    valores = [_valor_proveedor(campo, prov.get(campo)) for campo in CAMPOS_PROVEEDOR]
+    return [instancia, prov.get("CardCode")] + valores + [hash_proveedor(valores)]
+
+
+def _crear_stage_proveedores(cursor) -> None:
+    """Crea la tabla temporal de carga con las columnas y tipos de SAP_PROVEEDORES."""
+    columnas = ", ".join(["Instancia", "CardCode"] + CAMPOS_PROVEEDOR + ["RowHash"])
+    cursor.execute(f"""
+        IF OBJECT_ID('tempdb..{STAGE_PROVEEDORES}') IS NOT NULL
+            DROP TABLE {STAGE_PROVEEDORES}
+    """)
+    cursor.execute(f"SELECT TOP 0 {columnas} INTO {STAGE_PROVEEDORES} FROM SAP_PROVEEDORES")
+    cursor.execute(f"ALTER TABLE {STAGE_PROVEEDORES} ADD PRIMARY KEY (CardCode)")
+
+
+def _cargar_stage_proveedores(
+    cursor,
+    instancia: str,
+    proveedores: list[dict],
+    vistos: set,
+    errores: list,
+    fallidos: set
+) -> int:
+    """
+    Inserta una página de proveedores en la tabla de carga con fast_executemany.
+    Los CardCode repetidos se ignoran. Si el lote falla (por ejemplo un valor que no
+    cabe en la columna), se deshace el lote parcial hasta un savepoint y se carga fila
+    por fila para registrar solo las filas con error; sus CardCode quedan en fallidos.
+    Requiere una transacción abierta (la abre la creación de la tabla de carga).
+    Retorna cuántas filas se cargaron.
+    """
+    filas = []
+    for prov in proveedores:
+        card_code = prov.get("CardCode")
+        if not card_code or card_code in vistos:
+            continue
+        vistos.add(card_code)
+        filas.append(fila_proveedor(instancia, prov))
+
+    if not filas:
+        return 0
+
+    placeholders = ", ".join(["?"] * (len(CAMPOS_PROVEEDOR) + 3))
+    insert_sql = f"INSERT INTO {STAGE_PROVEEDORES} VALUES ({placeholders})"
+
+    # fast_executemany puede dejar aplicada parte del lote si una fila falla
+    cursor.execute("SAVE TRANSACTION carga_proveedores")
+    cursor.fast_executemany = True
+    try:
+        cursor.executemany(insert_sql, filas)
+        return len(filas)
+    except Exception:
+        cursor.fast_executemany = False
+        cursor.execute("ROLLBACK TRANSACTION carga_proveedores")
+        cargadas = 0
+        for fila in filas:
+            try:
+                cursor.execute(insert_sql, fila)
+                cargadas += 1
+            except Exception as e:
+                fallidos.add(fila[1])
+                errores.append({
+                    "instancia": instancia,
+                    "cardcode": fila[1],
+                    "error": str(e)
+                })
+        return cargadas
+    finally:
+        cursor.fast_executemany = False
+
+
+def _merge_stage_proveedores(
+    cursor,
+    instancia: str,
+    eliminar: bool = True,
+    fallidos: set | None = None
+) -> dict:
+    """
+    Aplica la tabla de carga sobre SAP_PROVEEDORES en un solo lote para la instancia:
+    un MERGE actualiza solo los existentes cuyo RowHash cambió e inserta los nuevos y
+    (si eliminar=True) un DELETE borra los que ya no vienen de SAP. Los CardCode de
+    fallidos sí vinieron de SAP aunque su fila no se pudo cargar, así que no se borran.
+    Retorna los conteos por acción; "sin_cambios" son los proveedores existentes
+    que no se reescribieron.
+    """
+    columnas = ["Instancia", "CardCode"] + CAMPOS_PROVEEDOR + ["RowHash"]
+    set_clause = ",\n                ".join(f"d.{campo} = s.{campo}" for campo in CAMPOS_PROVEEDOR + ["RowHash"])
+    params = [instancia]
+    delete_sql = ""
+    if eliminar:
+        cursor.execute(f"""
+            IF OBJECT_ID('tempdb..{FALLIDOS_PROVEEDORES}') IS NOT NULL
+                DROP TABLE {FALLIDOS_PROVEEDORES}
+        """)
+        cursor.execute(f"CREATE TABLE {FALLIDOS_PROVEEDORES} (CardCode NVARCHAR(50) PRIMARY KEY)")
+        if fallidos:
+            cursor.executemany(
+                f"INSERT INTO {FALLIDOS_PROVEEDORES} (CardCode) VALUES (?)",
+                [(card_code,) for card_code in fallidos]
+            )
+        delete_sql = f"""
+        DELETE p
+        OUTPUT 'DELETE' INTO @acciones
+        FROM SAP_PROVEEDORES p
+        WHERE p.Instancia = ?
+        AND NOT EXISTS (SELECT 1 FROM {STAGE_PROVEEDORES} s WHERE s.CardCode = p.CardCode)
+        AND NOT EXISTS (SELECT 1 FROM {FALLIDOS_PROVEEDORES} f WHERE f.CardCode = p.CardCode);
+        """
+        params.append(instancia)
+
+    cursor.execute(f"""
+        SET NOCOUNT ON;
+        DECLARE @acciones TABLE (Accion NVARCHAR(10));
+
+        WITH destino AS (
+            SELECT * FROM SAP_PROVEEDORES WHERE Instancia = ?
+        )
+        MERGE destino AS d
+        USING {STAGE_PROVEEDORES} AS s
+            ON d.CardCode = s.CardCode
+        WHEN MATCHED AND (d.RowHash IS NULL OR d.RowHash <> s.RowHash) THEN
+            UPDATE SET
+                {set_clause}
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT ({", ".join(columnas)})
+            VALUES ({", ".join(f"s.{campo}" for campo in columnas)})
+        OUTPUT $action INTO @acciones;
+        {delete_sql}
+
+        SELECT
+            SUM(CASE WHEN Accion = 'UPDATE' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN Accion = 'INSERT' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN Accion = 'DELETE' THEN 1 ELSE 0 END),
+            (SELECT COUNT(*) FROM {STAGE_PROVEEDORES})
+        FROM @acciones;
+
+        SET NOCOUNT OFF;
+    """, params)
+    row = cursor.fetchone()
+    if eliminar:
+        cursor.execute(f"DROP TABLE {FALLIDOS_PROVEEDORES}")
+
+    actualizados = (row[0] or 0) if row else 0
+    insertados = (row[1] or 0) if row else 0
+    cargados = (row[3] or 0) if row else 0
+    return {
+        "actualizados": actualizados,
+        "insertados": insertados,
+        "eliminados": (row[2] or 0) if row else 0,
+        "sin_cambios": cargados - actualizados - insertados
     }
 
-    # Eliminar empresas que ya no existen en HANA
-    if empresas_hana:
-        placeholders = ", ".join(["?" for _ in empresas_hana])
-        mssql_cursor.execute(
-            f"DELETE FROM SAP_EMPRESAS WHERE Instancia NOT IN ({placeholders})",
-            empresas_hana
+
+def upsert_proveedores_instancia(cursor, instancia: str, paginas, errores: list, eliminar: bool = True) -> dict:
+    """
+    Sincroniza los proveedores de una instancia en bloque:
+    carga las páginas en la tabla temporal (fast_executemany) y aplica un MERGE.
+    paginas: iterable de listas de proveedores (por ejemplo iter_paginas_proveedores_sl()).
+    No hace commit; el llamador decide la transacción (con autocommit desactivado:
+    la carga usa savepoints).
+    """
+    _crear_stage_proveedores(cursor)
+    vistos = set()
+    fallidos = set()
+    for proveedores in paginas:
+        _cargar_stage_proveedores(cursor, instancia, proveedores, vistos, errores, fallidos)
+
+    conteos = _merge_stage_proveedores(cursor, instancia, eliminar=eliminar, fallidos=fallidos)
+    cursor.execute(f"DROP TABLE {STAGE_PROVEEDORES}")
+    return conteos
+
+
+def _leer_marca_sync(cursor, instancia: str) -> dict | None:
+    """Retorna la marca de agua de sincronización de la instancia (o None si nunca se sincronizó)."""
+    cursor.execute("""
+        SELECT InstanciaSL, UltimaUpdateDate, UltimaUpdateTime, UltimaSync, UltimaSyncCompleta
+        FROM SAP_PROV_SYNC
+        WHERE Instancia = ?
+    """, [instancia])
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {
+        "instancia_sl": row[0],
+        "update_date": row[1],
+        "update_time": row[2],
+        "ultima_sync": row[3],
+        "ultima_sync_completa": row[4]
+    }
+
+
+def _guardar_marca_sync(cursor, instancia: str, instancia_sl: str, completa: bool) -> None:
+    """
+    Guarda como marca de agua el UpdateDate/UpdateTime más reciente de la instancia
+    en SAP_PROVEEDORES (se llama dentro de la misma transacción del MERGE).
+    """
+    cursor.execute("""
+        SELECT TOP 1 UpdateDate, UpdateTime
+        FROM SAP_PROVEEDORES
+        WHERE Instancia = ? AND UpdateDate IS NOT NULL
+        ORDER BY UpdateDate DESC, UpdateTime DESC
+    """, [instancia])
+    row = cursor.fetchone()
+    update_date, update_time = (row[0], row[1]) if row else (None, None)
+    ahora = tz_now()
+
+    # Upsert en el servidor: no depende de cursor.rowcount (que NOCOUNT deja en -1)
+    cursor.execute("""
+        MERGE SAP_PROV_SYNC WITH (HOLDLOCK) AS d
+        USING (VALUES (?, ?, ?, ?, ?, ?)) AS s
+            (Instancia, InstanciaSL, UltimaUpdateDate, UltimaUpdateTime, UltimaSync, Completa)
+            ON d.Instancia = s.Instancia
+        WHEN MATCHED THEN
+            UPDATE SET
+                InstanciaSL = s.InstanciaSL,
+                UltimaUpdateDate = s.UltimaUpdateDate,
+                UltimaUpdateTime = s.UltimaUpdateTime,
+                UltimaSync = s.UltimaSync,
+                UltimaSyncCompleta = CASE WHEN s.Completa = 1 THEN s.UltimaSync ELSE d.UltimaSyncCompleta END
+        WHEN NOT MATCHED THEN
+            INSERT (Instancia, InstanciaSL, UltimaUpdateDate, UltimaUpdateTime, UltimaSync, UltimaSyncCompleta)
+            VALUES (s.Instancia, s.InstanciaSL, s.UltimaUpdateDate, s.UltimaUpdateTime, s.UltimaSync,
+                    CASE WHEN s.Completa = 1 THEN s.UltimaSync END);
+    """, [instancia, instancia_sl, update_date, update_time, ahora, 1 if completa else 0])
+
+
+def _requiere_sync_completa(marca: dict | None, instancia_sl: str, completa: bool) -> bool:
+    """
+    Decide si la instancia se sincroniza completa o incremental.
+    Es completa si se pidió, si nunca se sincronizó (o no hay marca de agua), si cambió
+    el modo productivo/pruebas o si la última completa es más antigua que
+    SYNC_PROVEEDORES_COMPLETA_DIAS.
+    """
+    if completa or marca is None or marca["update_date"] is None:
+        return True
+    if marca["instancia_sl"] != instancia_sl or marca["ultima_sync_completa"] is None:
+        return True
+    dias = get_settings().SYNC_PROVEEDORES_COMPLETA_DIAS
+    ultima_completa = marca["ultima_sync_completa"]
+    if ultima_completa.tzinfo is None:
+        ultima_completa = ultima_completa.replace(tzinfo=tz_now().tzinfo)
+    return dias > 0 and (tz_now() - ultima_completa).days >= dias
+
+
+def _eliminar_proveedores_ausentes(cursor, instancia: str, instancia_sl: str) -> int:
+    """
+    Pase de solo llaves: consulta únicamente los CardCode de los proveedores en SAP
+    y elimina de SAP_PROVEEDORES los que ya no existen. Retorna cuántos se eliminaron.
+    """
+    cursor.execute("""
+        IF OBJECT_ID('tempdb..#CardCodesSAP') IS NOT NULL
+            DROP TABLE #CardCodesSAP
+    """)
+    cursor.execute("""
+        CREATE TABLE #CardCodesSAP (CardCode NVARCHAR(50) PRIMARY KEY)
+    """)
+
+    vistos = set()
+    cursor.fast_executemany = True
+    try:
+        for proveedores in iter_paginas_proveedores_sl(instancia_sl, select="CardCode"):
+            nuevos = [(prov["CardCode"],) for prov in proveedores
+                      if prov.get("CardCode") and prov["CardCode"] not in vistos]
+            vistos.update(card_code for (card_code,) in nuevos)
+            if nuevos:
+                cursor.executemany("INSERT INTO #CardCodesSAP (CardCode) VALUES (?)", nuevos)
+    finally:
+        cursor.fast_executemany = False
+
+    cursor.execute("""
+        DELETE p FROM SAP_PROVEEDORES p
+        WHERE p.Instancia = ?
+        AND NOT EXISTS (
+            SELECT 1 FROM #CardCodesSAP t WHERE t.CardCode = p.CardCode
         )
-        resultados["eliminadas"] = mssql_cursor.rowcount
-    else:
-        mssql_cursor.execute("DELETE FROM SAP_EMPRESAS")
-        resultados["eliminadas"] = mssql_cursor.rowcount
+    """, [instancia])
+    eliminados = cursor.rowcount
+
+    cursor.execute("DROP TABLE #CardCodesSAP")
+    return eliminados
+
 
-    for instancia in empresas_hana:
+def _con_semaforo(paginas, semaforo: threading.BoundedSemaphore, tiempos: dict):
+    """
+    Envuelve un generador de páginas para que la descarga ocupe un cupo de Service Layer
+    solo mientras se recorren las páginas (el MERGE posterior ya no lo ocupa).
+    """
+    espera = time.perf_counter()
+    with semaforo:
+        tiempos["espera_sl_segundos"] += time.perf_counter() - espera
+        inicio = time.perf_counter()
         try:
-            # Verificar si existe versión _PRUEBAS
-            tiene_pruebas = schema_exists_in_hana(f"{instancia}_PRUEBAS")
+            yield from paginas
+        finally:
+            tiempos["sl_segundos"] += time.perf_counter() - inicio
 
-            # Obtener datos de OADM
-            oadm = get_oadm_data(instancia)
-            print_headr = oadm["PrintHeadr"] if oadm["PrintHeadr"] else instancia
 
-            # Verificar si ya existe en MSSQL
-            mssql_cursor.execute(
-                "SELECT SL FROM SAP_EMPRESAS WHERE Instancia = ?",
-                [instancia]
-            )
-            row = mssql_cursor.fetchone()
+def sincronizar_proveedores_instancia(
+    instancia: str,
+    instancia_sl: str,
+    completa: bool,
+    sl_slots: threading.BoundedSemaphore,
+    mssql_slots: threading.BoundedSemaphore
+) -> dict:
+    """
+    Sincroniza SAP_PROVEEDORES para una instancia con su propia conexión y transacción.
+    Se ejecuta en paralelo con las demás instancias desde actualizar_sap_proveedores().
+    Retorna {"procesada": dict | None, "errores": list}.
+    """
+    inicio = time.perf_counter()
+    tiempos = {"espera_sl_segundos": 0.0, "sl_segundos": 0.0, "espera_mssql_segundos": 0.0}
+    errores = []
 
-            if row is not None:
-                # UPDATE - preservar SL
-                mssql_cursor.execute(
-                    """
-                    UPDATE SAP_EMPRESAS
-                    SET Prueba = ?, PrintHeadr = ?, CompnyAddr = ?, TaxIdNum = ?
-                    WHERE Instancia = ?
-                    """,
-                    (
-                        1 if tiene_pruebas else 0,
-                        print_headr,
-                        oadm["CompnyAddr"],
-                        oadm["TaxIdNum"],
-                        instancia
-                    )
-                )
-                resultados["actualizadas"] += 1
+    # Instancia con el circuito de Service Layer abierto: se omite sin ocupar cupos
+    if not get_sl_health().disponible(instancia_sl):
+        return {
+            "procesada": None,
+            "errores": [{
+                "instancia": instancia,
+                "instancia_sl": instancia_sl,
+                "error": "Service Layer no disponible (circuito abierto); instancia omitida",
+                "circuito_abierto": True
+            }]
+        }
+
+    espera = time.perf_counter()
+    with mssql_slots, mssql_connection() as conn:
+        tiempos["espera_mssql_segundos"] = time.perf_counter() - espera
+        cursor = conn.cursor()
+        paginas = None
+        try:
+            marca = _leer_marca_sync(cursor, instancia)
+            sync_completa = _requiere_sync_completa(marca, instancia_sl, completa)
+
+            if sync_completa:
+                # Carga masiva de todas las páginas de SAP + un MERGE por instancia.
+                # Los proveedores que ya no existen en SAP se eliminan en el mismo lote del MERGE,
+                # solo después de recorrer todas las páginas sin errores.
+                paginas = _con_semaforo(iter_paginas_proveedores_sl(instancia_sl), sl_slots, tiempos)
+                conteos = upsert_proveedores_instancia(cursor, instancia, paginas, errores)
             else:
-                # INSERT - SL en 0 por defecto
-                mssql_cursor.execute(
-                    """
-                    INSERT INTO SAP_EMPRESAS (Instancia, SL, Prueba, SLP, PrintHeadr, CompnyAddr, TaxIdNum)
-                    VALUES (?, 0, ?, 0, ?, ?, ?)
-                    """,
-                    (
-                        instancia,
-                        1 if tiene_pruebas else 0,
-                        print_headr,
-                        oadm["CompnyAddr"],
-                        oadm["TaxIdNum"]
-                    )
+                # Solo los cambios desde la marca de agua (mismo día incluido: el MERGE es idempotente)
+                paginas = _con_semaforo(
+                    iter_paginas_proveedores_sl(instancia_sl, actualizado_desde=marca["update_date"]),
+                    sl_slots,
+                    tiempos
                 )
-                resultados["insertadas"] += 1
+                conteos = upsert_proveedores_instancia(cursor, instancia, paginas, errores, eliminar=False)
+                with sl_slots:
+                    conteos["eliminados"] = _eliminar_proveedores_ausentes(cursor, instancia, instancia_sl)
+
+            _guardar_marca_sync(cursor, instancia, instancia_sl, sync_completa)
+            conn.commit()
+
+            return {
+                "procesada": {
+                    "instancia": instancia,
+                    "sincronizacion": "completa" if sync_completa else "incremental",
+                    "actualizados": conteos["actualizados"],
+                    "insertados": conteos["insertados"],
+                    "eliminados": conteos["eliminados"],
+                    "sin_cambios": conteos["sin_cambios"],
+                    "proveedores": conteos["actualizados"] + conteos["insertados"] + conteos["sin_cambios"],
+                    "tiempos": {
+                        "total_segundos": round(time.perf_counter() - inicio, 2),
+                        **{clave: round(valor, 2) for clave, valor in tiempos.items()}
+                    }
+                },
+                "errores": errores
+            }
+
+        except (ServiceLayerLoginError, ServiceLayerRequestError) as e:
+            # No se pudo leer la instancia completa: descartar lo aplicado de ella
+            conn.rollback()
+            error = {
+                "instancia": instancia,
+                "instancia_sl": instancia_sl,
+                "error": e.message
+            }
+            if isinstance(e, ServiceLayerCircuitOpenError):
+                error["circuito_abierto"] = True
+            errores.append(error)
 
         except Exception as e:
-            resultados["errores"].append({"instancia": instancia, "error": str(e)})
+            conn.rollback()
+            errores.append({
+                "instancia": instancia,
+                "error": str(e)
+            })
 
-    mssql_conn.commit()
-    mssql_cursor.close()
-    mssql_conn.close()
+        finally:
+            if paginas is not None:
+                paginas.close()
+            cursor.close()
 
-    return resultados
+    return {"procesada": None, "errores": errores}
+
+
+def nuevo_resultado_proveedores(total_instancias: int) -> dict:
+    """Resultado vacío de una sincronización de SAP_PROVEEDORES (se llena con acumular_resultado_proveedores)."""
+    from config import get_modo_pruebas
+
+    return {
+        "modo": "pruebas" if get_modo_pruebas() else "productivo",
+        "total_instancias": total_instancias,
+        "proveedores_actualizados": 0,
+        "proveedores_insertados": 0,
+        "proveedores_eliminados": 0,
+        "proveedores_sin_cambios": 0,
+        "instancias_procesadas": [],
+        "errores": []
+    }
+
+
+def acumular_resultado_proveedores(resultados: dict, resultado: dict) -> None:
+    """Suma al resultado general el de una instancia ({"procesada", "errores"})."""
+    resultados["errores"].extend(resultado["errores"])
+    if resultado["procesada"] is None:
+        return
+    procesada = resultado["procesada"]
+    resultados["proveedores_eliminados"] += procesada["eliminados"]
+    resultados["proveedores_actualizados"] += procesada["actualizados"]
+    resultados["proveedores_insertados"] += procesada["insertados"]
+    resultados["proveedores_sin_cambios"] += procesada["sin_cambios"]
+    resultados["instancias_procesadas"].append(procesada)
 
 
-def actualizar_sap_proveedores() -> dict:
+def slots_sync_proveedores() -> tuple[threading.BoundedSemaphore, threading.BoundedSemaphore]:
+    """Cupos de una sincronización: (descargas de Service Layer, conexiones MSSQL)."""
+    settings = get_settings()
+    return (
+        threading.BoundedSemaphore(max(1, settings.SYNC_PROVEEDORES_MAX_SL)),
+        threading.BoundedSemaphore(max(1, settings.SYNC_PROVEEDORES_MAX_MSSQL))
+    )
+
+
+def actualizar_sap_proveedores(completa: bool = False) -> dict:
     """
     Actualiza la tabla SAP_PROVEEDORES con los proveedores de todas las instancias
     que tienen SL habilitado en SAP_EMPRESAS.
@@ -1059,235 +1934,436 @@ def actualizar_sap_proveedores() -> dict:
     - Inserta nuevos proveedores
     - Elimina proveedores que ya no existen en SAP
 
+    Sincronización incremental: si la instancia ya tiene marca de agua en SAP_PROV_SYNC,
+    solo se piden a Service Layer los proveedores con UpdateDate >= la marca y las
+    eliminaciones se detectan con un pase que consulta únicamente los CardCode.
+    completa=True fuerza la reconciliación completa de todas las instancias
+    (también se hace sola cada SYNC_PROVEEDORES_COMPLETA_DIAS días).
+
+    Las instancias se sincronizan en paralelo, cada una con su propia conexión y
+    transacción, con cupos separados para Service Layer (SYNC_PROVEEDORES_MAX_SL)
+    y MSSQL (SYNC_PROVEEDORES_MAX_MSSQL). Cada instancia procesada incluye sus tiempos.
+
     Nota: El modo (productivo/pruebas) se controla con la variable global
     configurada mediante set_modo_pruebas() o el endpoint /pruebas/{valor}
     """
-    from config import get_instancia_sl, get_modo_pruebas
+    import concurrent.futures
+    from config import get_instancia_sl
 
     # Asegurar que existe la tabla
-    ensure_table_sap_proveedores_exists()
+    ensure_schema_ready()
 
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+    settings = get_settings()
+    inicio = time.perf_counter()
 
     # Obtener instancias con Service Layer habilitado
     instancias = get_instancias_con_service_layer()
 
-    resultados = {
-        "modo": "pruebas" if get_modo_pruebas() else "productivo",
-        "total_instancias": len(instancias),
-        "proveedores_actualizados": 0,
-        "proveedores_insertados": 0,
-        "proveedores_eliminados": 0,
-        "instancias_procesadas": [],
-        "errores": []
-    }
+    resultados = nuevo_resultado_proveedores(len(instancias))
 
-    # Campos para UPDATE (sin Instancia y CardCode que son la llave)
-    campos_update = [
-        "CardName", "GroupCode", "FederalTaxID",
-        "CreateDate", "CreateTime", "UpdateDate", "UpdateTime",
-        "Address", "Block", "ZipCode", "City", "County", "BillToState", "Country",
-        "MailAddress", "MailZipCode", "ShipToState", "ShipToDefault",
-        "Phone1", "Phone2", "Fax", "Cellular", "EmailAddress", "ContactPerson",
-        "PayTermsGrpCode", "PeymentMethodCode", "CreditLimit", "MaxCommitment",
-        "DiscountPercent", "PriceListNum", "Currency",
-        "DeductibleAtSource", "DeductionPercent", "DeductionValidUntil", "VatGroupLatinAmerica",
-        "DefaultBankCode", "DefaultAccount", "BankCountry", "HouseBank", "HouseBankCountry",
-        "HouseBankAccount", "HouseBankBranch", "HouseBankIBAN", "IBAN",
-        "CreditCardCode", "CreditCardNum", "CreditCardExpiration", "DebitorAccount",
-        "CurrentAccountBalance", "OpenDeliveryNotesBalance", "OpenOrdersBalance",
-        "OpenChecksBalance", "OpenOpportunities",
-        "Valid", "Frozen", "BlockDunning", "BackOrder", "PartialDelivery"
-    ]
+    # Límites independientes: descargas simultáneas de Service Layer y conexiones MSSQL
+    sl_slots, mssql_slots = slots_sync_proveedores()
+    workers = max(1, min(len(instancias), max(settings.SYNC_PROVEEDORES_MAX_SL, settings.SYNC_PROVEEDORES_MAX_MSSQL)))
+
+    resultados_instancia = []
+    if instancias:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync-prov") as executor:
+            futures = [
+                executor.submit(
+                    sincronizar_proveedores_instancia,
+                    instancia,
+                    get_instancia_sl(instancia),
+                    completa,
+                    sl_slots,
+                    mssql_slots
+                )
+                for instancia in instancias
+            ]
+            # Mantener el orden de las instancias en el resultado
+            resultados_instancia = [future.result() for future in futures]
+
+    for resultado in resultados_instancia:
+        acumular_resultado_proveedores(resultados, resultado)
+
+    resultados["duracion_segundos"] = round(time.perf_counter() - inicio, 2)
+    return resultados
+
+
+def get_tablas_actividad() -> list[str]:
+    """
+    Tablas de documentos de HANA que cuentan como actividad (ACTIVIDAD_TABLAS, separadas por coma).
+    Solo se aceptan nombres de tabla simples porque se interpolan en el SQL.
+    """
+    tablas = []
+    for tabla in get_settings().ACTIVIDAD_TABLAS.split(","):
+        tabla = tabla.strip().upper()
+        if tabla and re.fullmatch(r"[A-Z0-9_]+", tabla) and tabla not in tablas:
+            tablas.append(tabla)
+    return tablas or ["OPCH", "OPOR"]
+
+
+def fecha_inicio_actividad(anos: int) -> date:
+    """Primer día del año (actual - anos): equivale a YEAR("DocDate") >= YEAR(CURRENT_DATE) - anos."""
+    return date(tz_now().year - anos, 1, 1)
 
-    # Todos los campos para INSERT
-    campos_insert = ["Instancia", "CardCode"] + campos_update
 
-    for instancia in instancias:
+def _consulta_actividad_hana(instancia: str, tabla: str, incremental: bool) -> str:
+    """
+    Consulta de actividad de una tabla de documentos, agrupada por CardCode y año.
+    El filtro "DocDate" >= ? es sargable (sin funciones sobre la columna) y recibe la fecha
+    como parámetro. En modo incremental solo se leen documentos con DocEntry mayor a la
+    marca (segundo parámetro).
+    """
+    filtro_docentry = 'AND "DocEntry" > ?' if incremental else ""
+    return f"""
+        SELECT
+            "CardCode",
+            YEAR("DocDate") AS ano,
+            COUNT(*) AS total_docs,
+            MAX("DocDate") AS ultima_fecha,
+            MAX("DocEntry") AS ultimo_docentry
+        FROM "{instancia}"."{tabla}"
+        WHERE "DocDate" >= ? {filtro_docentry}
+        GROUP BY "CardCode", YEAR("DocDate")
+    """
+
+
+def _leer_marcas_actividad(cursor) -> dict:
+    """Retorna {(instancia, tabla): (UltimoDocEntry, DesdeAno)} de SAP_PROV_ACTIVIDAD_MARCA."""
+    cursor.execute("SELECT Instancia, Tabla, UltimoDocEntry, DesdeAno FROM SAP_PROV_ACTIVIDAD_MARCA")
+    return {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+
+
+def _plan_escaneo_actividad(marcas: dict, instancia: str, tablas: list[str], ano_inicio: int, completo: bool) -> dict:
+    """
+    Decide por tabla si el escaneo es incremental (desde el DocEntry de la marca) o completo.
+    Es completo si se pidió, si no hay marca o si la ventana pedida empieza antes de lo
+    que cubren los agregados guardados (por ejemplo al aumentar 'anos').
+    Retorna {tabla: DocEntry desde el cual leer, o None para escaneo completo}.
+    """
+    plan = {}
+    for tabla in tablas:
+        marca = marcas.get((instancia, tabla))
+        if completo or marca is None or marca[0] is None or marca[1] > ano_inicio:
+            plan[tabla] = None
+        else:
+            plan[tabla] = marca[0]
+    return plan
+
+
+def _consultar_actividad_instancia(instancia: str, plan: dict, fecha_inicio: date) -> tuple[dict, float]:
+    """
+    Consulta en HANA la actividad de una instancia según el plan de escaneo por tabla,
+    usando una conexión del pool HANA.
+    Retorna ({tabla: {"completo", "filas", "ultimo_docentry"}}, segundos de HANA).
+    """
+    resultado = {}
+
+    with hana_connection() as conn_hana:
+        cursor_hana = conn_hana.cursor()
         try:
-            # Obtener nombre de instancia para Service Layer (agrega _PRUEBAS si está en modo pruebas)
-            instancia_sl = get_instancia_sl(instancia)
+            inicio_hana = time.perf_counter()
+            for tabla, desde_docentry in plan.items():
+                incremental = desde_docentry is not None
+                params = [fecha_inicio, desde_docentry] if incremental else [fecha_inicio]
+                cursor_hana.execute(_consulta_actividad_hana(instancia, tabla, incremental), params)
+                filas = [fila for fila in cursor_hana.fetchall() if fila[0]]
+                docentries = [fila[4] for fila in filas if fila[4] is not None]
+                resultado[tabla] = {
+                    "completo": not incremental,
+                    "filas": filas,
+                    "ultimo_docentry": max(docentries + ([desde_docentry] if incremental else []), default=None)
+                }
+            hana_segundos = round(time.perf_counter() - inicio_hana, 2)
+        finally:
+            cursor_hana.close()
 
-            # Obtener proveedores de esta instancia desde SAP
-            resultado = get_proveedores_sl(instancia_sl)
+    documentos = sum(len(r["filas"]) for r in resultado.values())
+    print(f"[Actividad] {instancia}: HANA {hana_segundos:.2f} s, {documentos} agregados nuevos")
+    return resultado, hana_segundos
 
-            if not resultado["success"]:
-                resultados["errores"].append({
-                    "instancia": instancia,
-                    "instancia_sl": instancia_sl,
-                    "error": resultado.get("error", "Error desconocido")
-                })
-                continue
 
-            proveedores = resultado.get("proveedores", [])
-            count_actualizados = 0
-            count_insertados = 0
+# Tabla temporal con los agregados de actividad de HANA de una instancia
+TEMP_ACTIVIDAD = "#ActividadHANA"
 
-            # Obtener CardCodes actuales en SAP para esta instancia
-            cardcodes_sap = {prov.get("CardCode") for prov in proveedores}
 
-            # Eliminar proveedores que ya no existen en SAP para esta instancia
-            # Nota: SQL Server tiene límite de ~2100 parámetros, así que usamos
-            # una tabla temporal para evitar el límite del NOT IN
-            if cardcodes_sap:
-                # Crear tabla temporal con los CardCodes de SAP
-                cursor.execute("""
-                    IF OBJECT_ID('tempdb..#CardCodesSAP') IS NOT NULL
-                        DROP TABLE #CardCodesSAP
-                """)
-                cursor.execute("""
-                    CREATE TABLE #CardCodesSAP (CardCode NVARCHAR(50) PRIMARY KEY)
-                """)
+def _aplicar_actividad_instancia(cursor, instancia: str, escaneo: dict, tablas: list[str], ano_inicio: int,
+                                 tabla_activos: str = "SAP_PROV_ACTIVOS") -> int:
+    """
+    Aplica el resultado de HANA de una instancia y llena tabla_activos (SAP_PROV_ACTIVOS o su tabla sombra):
+    1. Tablas escaneadas completas: se borran sus agregados anteriores
+    2. Carga los agregados nuevos en una tabla temporal (fast_executemany) y los suma
+       a SAP_PROV_ACTIVIDAD_ANUAL con un MERGE
+    3. Avanza la marca de DocEntry por tabla
+    4. Descarta los años que salieron de la ventana
+    5. Un solo INSERT ... SELECT suma los años de la ventana y une con SAP_PROVEEDORES
+       (solo proveedores existentes ahí)
+    No hace commit. Retorna cuántos proveedores activos se insertaron.
+    """
+    cursor.execute(f"""
+        IF OBJECT_ID('tempdb..{TEMP_ACTIVIDAD}') IS NOT NULL
+            DROP TABLE {TEMP_ACTIVIDAD}
+    """)
+    cursor.execute(f"""
+        CREATE TABLE {TEMP_ACTIVIDAD} (
+            Tabla NVARCHAR(30) NOT NULL,
+            CardCode NVARCHAR(50) NOT NULL,
+            Ano INT NOT NULL,
+            TotalDocumentos INT NOT NULL,
+            UltimaFecha DATE,
+            PRIMARY KEY (Tabla, CardCode, Ano)
+        )
+    """)
 
-                # Insertar CardCodes en lotes de 1000 para evitar límites
-                cardcodes_list = list(cardcodes_sap)
-                batch_size = 1000
-                for i in range(0, len(cardcodes_list), batch_size):
-                    batch = cardcodes_list[i:i + batch_size]
-                    placeholders = ", ".join(["(?)" for _ in batch])
-                    cursor.execute(
-                        f"INSERT INTO #CardCodesSAP (CardCode) VALUES {placeholders}",
-                        batch
-                    )
+    filas = []
+    for tabla, datos in escaneo.items():
+        if datos["completo"]:
+            cursor.execute(
+                "DELETE FROM SAP_PROV_ACTIVIDAD_ANUAL WHERE Instancia = ? AND Tabla = ?",
+                [instancia, tabla]
+            )
+        filas.extend((tabla, card_code, ano, total_docs, ultima_fecha)
+                     for card_code, ano, total_docs, ultima_fecha, _ in datos["filas"])
 
-                # Eliminar usando JOIN con tabla temporal (más eficiente)
-                cursor.execute("""
-                    DELETE p FROM SAP_PROVEEDORES p
-                    WHERE p.Instancia = ?
-                    AND NOT EXISTS (
-                        SELECT 1 FROM #CardCodesSAP t WHERE t.CardCode = p.CardCode
-                    )
-                """, [instancia])
-                deleted_count = cursor.rowcount
+    if filas:
+        cursor.fast_executemany = True
+        try:
+            cursor.executemany(
+                f"INSERT INTO {TEMP_ACTIVIDAD} (Tabla, CardCode, Ano, TotalDocumentos, UltimaFecha) VALUES (?, ?, ?, ?, ?)",
+                filas
+            )
+        finally:
+            cursor.fast_executemany = False
 
-                # Limpiar tabla temporal
-                cursor.execute("DROP TABLE #CardCodesSAP")
-            else:
-                # Si no hay proveedores en SAP, eliminar todos de esta instancia
-                cursor.execute("DELETE FROM SAP_PROVEEDORES WHERE Instancia = ?", [instancia])
-                deleted_count = cursor.rowcount
-
-            resultados["proveedores_eliminados"] += deleted_count
-
-            for prov in proveedores:
-                # Preparar valores para UPDATE/INSERT
-                valores_update = [
-                    prov.get("CardName"),
-                    prov.get("GroupCode"),
-                    prov.get("FederalTaxID"),
-                    prov.get("CreateDate"),
-                    prov.get("CreateTime"),
-                    prov.get("UpdateDate"),
-                    prov.get("UpdateTime"),
-                    prov.get("Address"),
-                    prov.get("Block"),
-                    prov.get("ZipCode"),
-                    prov.get("City"),
-                    prov.get("County"),
-                    prov.get("BillToState"),
-                    prov.get("Country"),
-                    prov.get("MailAddress"),
-                    prov.get("MailZipCode"),
-                    prov.get("ShipToState"),
-                    prov.get("ShipToDefault"),
-                    prov.get("Phone1"),
-                    prov.get("Phone2"),
-                    prov.get("Fax"),
-                    prov.get("Cellular"),
-                    prov.get("EmailAddress"),
-                    prov.get("ContactPerson"),
-                    prov.get("PayTermsGrpCode"),
-                    prov.get("PeymentMethodCode"),
-                    prov.get("CreditLimit"),
-                    prov.get("MaxCommitment"),
-                    prov.get("DiscountPercent"),
-                    prov.get("PriceListNum"),
-                    prov.get("Currency"),
-                    prov.get("DeductibleAtSource"),
-                    prov.get("DeductionPercent"),
-                    prov.get("DeductionValidUntil"),
-                    prov.get("VatGroupLatinAmerica"),
-                    prov.get("DefaultBankCode"),
-                    prov.get("DefaultAccount"),
-                    prov.get("BankCountry"),
-                    prov.get("HouseBank"),
-                    prov.get("HouseBankCountry"),
-                    prov.get("HouseBankAccount"),
-                    prov.get("HouseBankBranch"),
-                    prov.get("HouseBankIBAN"),
-                    prov.get("IBAN"),
-                    prov.get("CreditCardCode"),
-                    prov.get("CreditCardNum"),
-                    prov.get("CreditCardExpiration"),
-                    prov.get("DebitorAccount"),
-                    prov.get("CurrentAccountBalance"),
-                    prov.get("OpenDeliveryNotesBalance"),
-                    prov.get("OpenOrdersBalance"),
-                    prov.get("OpenChecksBalance"),
-                    prov.get("OpenOpportunities"),
-                    prov.get("Valid"),
-                    prov.get("Frozen"),
-                    prov.get("BlockDunning"),
-                    prov.get("BackOrder"),
-                    prov.get("PartialDelivery")
-                ]
-
-                try:
-                    # Verificar si existe
-                    cursor.execute(
-                        "SELECT 1 FROM SAP_PROVEEDORES WHERE Instancia = ? AND CardCode = ?",
-                        [instancia, prov.get("CardCode")]
-                    )
-                    exists = cursor.fetchone() is not None
-
-                    if exists:
-                        # UPDATE
-                        update_set = ", ".join([f"{campo} = ?" for campo in campos_update])
-                        update_sql = f"""
-                            UPDATE SAP_PROVEEDORES
-                            SET {update_set}
-                            WHERE Instancia = ? AND CardCode = ?
-                        """
-                        cursor.execute(update_sql, valores_update + [instancia, prov.get("CardCode")])
-                        count_actualizados += 1
-                    else:
-                        # INSERT
-                        placeholders = ", ".join(["?" for _ in campos_insert])
-                        insert_sql = f"INSERT INTO SAP_PROVEEDORES ({', '.join(campos_insert)}) VALUES ({placeholders})"
-                        cursor.execute(insert_sql, [instancia, prov.get("CardCode")] + valores_update)
-                        count_insertados += 1
-
-                except Exception as e:
-                    resultados["errores"].append({
-                        "instancia": instancia,
-                        "cardcode": prov.get("CardCode"),
-                        "error": str(e)
-                    })
+        cursor.execute(f"""
+            WITH destino AS (
+                SELECT * FROM SAP_PROV_ACTIVIDAD_ANUAL WHERE Instancia = ?
+            )
+            MERGE destino AS d
+            USING {TEMP_ACTIVIDAD} AS s
+                ON d.Tabla = s.Tabla AND d.CardCode = s.CardCode AND d.Ano = s.Ano
+            WHEN MATCHED THEN
+                UPDATE SET
+                    d.TotalDocumentos = d.TotalDocumentos + s.TotalDocumentos,
+                    d.UltimaFecha = CASE WHEN s.UltimaFecha > d.UltimaFecha OR d.UltimaFecha IS NULL
+                                         THEN s.UltimaFecha ELSE d.UltimaFecha END
+            WHEN NOT MATCHED BY TARGET THEN
+                INSERT (Instancia, Tabla, CardCode, Ano, TotalDocumentos, UltimaFecha)
+                VALUES (?, s.Tabla, s.CardCode, s.Ano, s.TotalDocumentos, s.UltimaFecha);
+        """, [instancia, instancia])
+
+    ahora = tz_now()
+    for tabla, datos in escaneo.items():
+        # Upsert en el servidor: no depende de cursor.rowcount (que NOCOUNT deja en -1)
+        cursor.execute("""
+            MERGE SAP_PROV_ACTIVIDAD_MARCA WITH (HOLDLOCK) AS d
+            USING (VALUES (?, ?, ?, ?, ?, ?)) AS s
+                (Instancia, Tabla, UltimoDocEntry, Completo, DesdeAno, ActualizadoEn)
+                ON d.Instancia = s.Instancia AND d.Tabla = s.Tabla
+            WHEN MATCHED THEN
+                UPDATE SET
+                    UltimoDocEntry = s.UltimoDocEntry,
+                    DesdeAno = CASE WHEN s.Completo = 1 THEN s.DesdeAno ELSE d.DesdeAno END,
+                    ActualizadoEn = s.ActualizadoEn
+            WHEN NOT MATCHED THEN
+                INSERT (Instancia, Tabla, UltimoDocEntry, DesdeAno, ActualizadoEn)
+                VALUES (s.Instancia, s.Tabla, s.UltimoDocEntry, s.DesdeAno, s.ActualizadoEn);
+        """, [instancia, tabla, datos["ultimo_docentry"], 1 if datos["completo"] else 0, ano_inicio, ahora])
+
+    # La ventana avanza restando los años vencidos en lugar de volver a escanear
+    cursor.execute(
+        "DELETE FROM SAP_PROV_ACTIVIDAD_ANUAL WHERE Instancia = ? AND Ano < ?",
+        [instancia, ano_inicio]
+    )
+    cursor.execute(
+        "UPDATE SAP_PROV_ACTIVIDAD_MARCA SET DesdeAno = ? WHERE Instancia = ? AND DesdeAno < ?",
+        [ano_inicio, instancia, ano_inicio]
+    )
 
-            conn.commit()
-            resultados["proveedores_actualizados"] += count_actualizados
-            resultados["proveedores_insertados"] += count_insertados
-            resultados["instancias_procesadas"].append({
-                "instancia": instancia,
-                "actualizados": count_actualizados,
-                "insertados": count_insertados,
-                "proveedores": count_actualizados + count_insertados
-            })
+    tablas_placeholders = ", ".join(["?"] * len(tablas))
+    cursor.execute(f"""
+        INSERT INTO {tabla_activos}
+        (Instancia, CardCode, CardName, FederalTaxID, GroupCode, TotalDocumentos, UltimaFecha, SaldoDocumentos, FechaAnalisis)
+        SELECT
+            p.Instancia,
+            p.CardCode,
+            p.CardName,
+            p.FederalTaxID,
+            p.GroupCode,
+            a.TotalDocumentos,
+            a.UltimaFecha,
+            p.CurrentAccountBalance,
+            GETDATE()
+        FROM (
+            SELECT CardCode, SUM(TotalDocumentos) AS TotalDocumentos, MAX(UltimaFecha) AS UltimaFecha
+            FROM SAP_PROV_ACTIVIDAD_ANUAL
+            WHERE Instancia = ? AND Ano >= ? AND Tabla IN ({tablas_placeholders})
+            GROUP BY CardCode
+        ) a
+        INNER JOIN SAP_PROVEEDORES p
+            ON p.Instancia = ? AND p.CardCode = a.CardCode
+    """, [instancia, ano_inicio] + tablas + [instancia])
+    activos = cursor.rowcount
+
+    cursor.execute(f"DROP TABLE {TEMP_ACTIVIDAD}")
+    return activos
+
+
+# Tablas de resultados del análisis de actividad. Cada ejecución las construye en tablas sombra
+# y al final las intercambia con sp_rename en una sola transacción, de modo que los lectores
+# (incluida vw_maestro_proveedores) siempre ven un análisis completo.
+TABLAS_ACTIVIDAD = {
+    "SAP_PROV_ACTIVOS": """
+        Instancia NVARCHAR(50) NOT NULL,
+        CardCode NVARCHAR(50) NOT NULL,
+        CardName NVARCHAR(200),
+        FederalTaxID NVARCHAR(50),
+        GroupCode INT,
+        TotalDocumentos INT,
+        UltimaFecha DATE,
+        SaldoDocumentos DECIMAL(18,2),
+        FechaAnalisis DATETIME,
+        PRIMARY KEY (Instancia, CardCode)
+    """,
+    "SAP_PROV_INACTIVOS": """
+        Instancia NVARCHAR(50) NOT NULL,
+        CardCode NVARCHAR(50) NOT NULL,
+        CardName NVARCHAR(200),
+        FederalTaxID NVARCHAR(50),
+        GroupCode INT,
+        FechaAnalisis DATETIME,
+        PRIMARY KEY (Instancia, CardCode)
+    """,
+}
+SUFIJO_SOMBRA = "_NUEVO"
+SUFIJO_ANTERIOR = "_ANTERIOR"
+
+
+def _crear_tablas_sombra_actividad(cursor) -> None:
+    """Crea vacías las tablas sombra (descarta las que haya dejado una ejecución interrumpida)."""
+    for tabla, columnas in TABLAS_ACTIVIDAD.items():
+        sombra = tabla + SUFIJO_SOMBRA
+        cursor.execute(f"DROP TABLE IF EXISTS {sombra}")
+        cursor.execute(f"CREATE TABLE {sombra} ({columnas})")
+
+
+def _copiar_snapshot_instancia(cursor, instancia: str) -> int:
+    """
+    Copia a las tablas sombra las filas vigentes de una instancia cuyo análisis falló,
+    para que el intercambio no la deje vacía. Retorna cuántas filas activas se conservaron.
+    """
+    activos = 0
+    for tabla in TABLAS_ACTIVIDAD:
+        cursor.execute(f"""
+            IF OBJECT_ID('{tabla}', 'U') IS NOT NULL
+                INSERT INTO {tabla}{SUFIJO_SOMBRA}
+                SELECT * FROM {tabla} WHERE Instancia = ?
+        """, [instancia])
+        if tabla == "SAP_PROV_ACTIVOS":
+            activos = max(cursor.rowcount, 0)
+    return activos
+
+
+def _intercambiar_tablas_actividad(cursor) -> None:
+    """
+    Publica las tablas sombra: en una sola transacción renombra las tablas vigentes a *_ANTERIOR,
+    las sombra a su nombre definitivo y recrea vw_maestro_proveedores. Los lectores solo esperan
+    los locks de esquema del intercambio, no la reconstrucción. No hace commit.
+    """
+    for tabla in TABLAS_ACTIVIDAD:
+        anterior = tabla + SUFIJO_ANTERIOR
+        cursor.execute(f"DROP TABLE IF EXISTS {anterior}")
+        cursor.execute(f"""
+            IF OBJECT_ID('{tabla}', 'U') IS NOT NULL
+                EXEC sp_rename '{tabla}', '{anterior}'
+        """)
+        cursor.execute(f"EXEC sp_rename '{tabla}{SUFIJO_SOMBRA}', '{tabla}'")
+
+    # La vista se vuelve a crear para que quede ligada a la nueva SAP_PROV_ACTIVOS
+    cursor.execute("""
+        CREATE OR ALTER VIEW dbo.vw_maestro_proveedores AS
+        SELECT p.*
+        FROM SAP_PROV_ACTIVOS a
+        INNER JOIN SAP_PROVEEDORES p
+        ON a.Instancia = p.Instancia
+        AND a.CardCode = p.CardCode
+        AND a.GroupCode = p.GroupCode
+        AND a.FederalTaxID = p.FederalTaxID
+    """)
+
+    for tabla in TABLAS_ACTIVIDAD:
+        cursor.execute(f"DROP TABLE IF EXISTS {tabla}{SUFIJO_ANTERIOR}")
 
+
+class BloqueoActividad:
+    """
+    Serializa los análisis de actividad entre todos los workers y procesos con un lock de
+    aplicación de MSSQL (sp_getapplock). Dos ejecuciones simultáneas sumarían dos veces los
+    mismos documentos en SAP_PROV_ACTIVIDAD_ANUAL y chocarían en las tablas sombra.
+
+    El lock pertenece a la sesión de una conexión a master (la base de la aplicación se
+    elimina y recrea en la inicialización) que se conserva hasta liberar().
+    liberar() se puede llamar más de una vez y desde otro thread.
+    """
+
+    def __init__(self):
+        self._recurso = f"SAP_PROV_ACTIVIDAD:{get_settings().MSSQL_DATABASE}"
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def adquirir(self) -> None:
+        """Espera hasta obtener el lock. Lanza RuntimeError si MSSQL lo rechaza."""
+        conn = get_mssql_connection("master")
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    SET NOCOUNT ON;
+                    DECLARE @resultado INT;
+                    EXEC @resultado = sp_getapplock
+                        @Resource = ?, @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = -1;
+                    SELECT @resultado;
+                    SET NOCOUNT OFF;
+                """, [self._recurso])
+                resultado = cursor.fetchone()[0]
+            finally:
+                cursor.close()
+            if resultado < 0:
+                raise RuntimeError(f"No se obtuvo el lock del análisis de actividad (sp_getapplock = {resultado})")
+        except BaseException:
+            conn.close(discard=True)
+            raise
+        with self._lock:
+            self._conn = conn
+
+    def liberar(self) -> None:
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("EXEC sp_releaseapplock @Resource = ?, @LockOwner = 'Session'", [self._recurso])
+            finally:
+                cursor.close()
         except Exception as e:
-            resultados["errores"].append({
-                "instancia": instancia,
-                "error": str(e)
-            })
+            # Cerrar la sesión también libera el lock
+            print(f"[Actividad] Error liberando el lock, se descarta la conexión: {e}")
+            conn.close(discard=True)
+            return
+        conn.close()
 
-    cursor.close()
-    conn.close()
+    def __enter__(self) -> "BloqueoActividad":
+        self.adquirir()
+        return self
 
-    return resultados
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.liberar()
 
 
-def analizar_actividad_proveedores(anos: int = 1) -> dict:
+def analizar_actividad_proveedores(anos: int = 1, completo: bool = False) -> dict:
     """
     Analiza la actividad de proveedores y crea/actualiza tablas SAP_PROV_ACTIVOS y SAP_PROV_INACTIVOS.
 
@@ -1298,192 +2374,197 @@ def analizar_actividad_proveedores(anos: int = 1) -> dict:
 
     Metodología:
     1. Consulta OPCH y OPOR en HANA para obtener CardCodes con actividad
-    2. Agrupa por CardCode, Instancia
-    3. Crea/actualiza tabla SAP_PROV_ACTIVOS con proveedores activos
+       (solo documentos con DocEntry posterior a la última ejecución)
+    2. Suma los documentos nuevos a los agregados por proveedor y año (SAP_PROV_ACTIVIDAD_ANUAL)
+    3. Crea/actualiza tabla SAP_PROV_ACTIVOS con los años de la ventana
     4. Cruza con SAP_PROVEEDORES para obtener inactivos
     5. Crea/actualiza tabla SAP_PROV_INACTIVOS
     6. Envía reporte por correo
 
     Args:
         anos: Años adicionales hacia atrás (0=solo actual, 1=actual+1 anterior [DEFAULT], etc.)
+        completo: True para volver a escanear todos los documentos de la ventana
 
     Returns:
         dict con resultados del análisis
     """
-    settings = get_settings()
-    conn_mssql = get_mssql_connection()
-    cursor_mssql = conn_mssql.cursor()
+    with BloqueoActividad():
+        return _analizar_actividad_proveedores(anos, completo)
 
+
+def preparar_analisis_actividad(conn, cursor, anos: int, completo: bool) -> dict:
+    """
+    Crea vacías las tablas sombra (SAP_PROV_ACTIVOS/INACTIVOS siguen disponibles con el
+    análisis anterior hasta el intercambio final) y retorna el contexto del análisis:
+    tablas de documentos, ventana de fechas y marcas de DocEntry por instancia.
+    """
+    _crear_tablas_sombra_actividad(cursor)
+    conn.commit()
+    return {
+        "anos": anos,
+        "completo": completo,
+        "tablas": get_tablas_actividad(),
+        "fecha_inicio": fecha_inicio_actividad(anos),
+        "marcas": _leer_marcas_actividad(cursor)
+    }
+
+
+def consultar_actividad_contexto(instancia: str, contexto: dict) -> tuple[dict, float]:
+    """Consulta en HANA la actividad de una instancia según el plan que corresponde a sus marcas."""
+    plan = _plan_escaneo_actividad(
+        contexto["marcas"], instancia, contexto["tablas"], contexto["fecha_inicio"].year, contexto["completo"]
+    )
+    return _consultar_actividad_instancia(instancia, plan, contexto["fecha_inicio"])
+
+
+def escribir_actividad_instancia(conn, cursor, instancia: str, contexto: dict, escaneo: dict, hana_segundos: float) -> dict:
+    """
+    Aplica el resultado de HANA de una instancia en las tablas sombra (activos e inactivos)
+    y hace commit. Si falla, conserva el análisis anterior de la instancia.
+    Retorna el detalle de la instancia para 'instancias_procesadas'.
+    """
+    activos_sombra = "SAP_PROV_ACTIVOS" + SUFIJO_SOMBRA
+    inactivos_sombra = "SAP_PROV_INACTIVOS" + SUFIJO_SOMBRA
     try:
-        # Obtener todas las instancias SAP
-        cursor_mssql.execute("SELECT Instancia FROM SAP_EMPRESAS ORDER BY Instancia")
-        instancias = [row[0] for row in cursor_mssql.fetchall()]
-
-        if not instancias:
-            return {"success": False, "error": "No hay instancias en SAP_EMPRESAS"}
-
-        # Eliminar tablas si existen
-        cursor_mssql.execute("DROP TABLE IF EXISTS SAP_PROV_ACTIVOS")
-        cursor_mssql.execute("DROP TABLE IF EXISTS SAP_PROV_INACTIVOS")
-        conn_mssql.commit()
-
-        # Crear tabla SAP_PROV_ACTIVOS
-        cursor_mssql.execute("""
-            CREATE TABLE SAP_PROV_ACTIVOS (
-                Instancia NVARCHAR(50) NOT NULL,
-                CardCode NVARCHAR(50) NOT NULL,
-                CardName NVARCHAR(200),
-                FederalTaxID NVARCHAR(50),
-                GroupCode INT,
-                TotalDocumentos INT,
-                UltimaFecha DATE,
-                SaldoDocumentos DECIMAL(18,2),
-                FechaAnalisis DATETIME,
-                PRIMARY KEY (Instancia, CardCode)
-            )
-        """)
+        # Sumar los documentos nuevos a los agregados anuales e insertar los
+        # proveedores activos en SAP_PROV_ACTIVOS con un INSERT ... SELECT
+        activos_instancia = _aplicar_actividad_instancia(
+            cursor, instancia, escaneo, contexto["tablas"], contexto["fecha_inicio"].year, activos_sombra
+        )
 
-        # Crear tabla SAP_PROV_INACTIVOS
-        cursor_mssql.execute("""
-            CREATE TABLE SAP_PROV_INACTIVOS (
-                Instancia NVARCHAR(50) NOT NULL,
-                CardCode NVARCHAR(50) NOT NULL,
-                CardName NVARCHAR(200),
-                FederalTaxID NVARCHAR(50),
-                GroupCode INT,
-                FechaAnalisis DATETIME,
-                PRIMARY KEY (Instancia, CardCode)
+        # Insertar proveedores inactivos (los que están en SAP_PROVEEDORES pero NO en SAP_PROV_ACTIVOS)
+        cursor.execute(f"""
+            INSERT INTO {inactivos_sombra} (Instancia, CardCode, CardName, FederalTaxID, GroupCode, FechaAnalisis)
+            SELECT
+                p.Instancia,
+                p.CardCode,
+                p.CardName,
+                p.FederalTaxID,
+                p.GroupCode,
+                GETDATE()
+            FROM SAP_PROVEEDORES p
+            WHERE p.Instancia = ?
+            AND NOT EXISTS (
+                SELECT 1 FROM {activos_sombra} a
+                WHERE a.Instancia = p.Instancia AND a.CardCode = p.CardCode
             )
-        """)
-        conn_mssql.commit()
-
-        # Crear vista vw_maestro_proveedores después de crear SAP_PROV_ACTIVOS
-        cursor_mssql.execute("""
-            CREATE OR ALTER VIEW dbo.vw_maestro_proveedores AS
-            SELECT p.*
-            FROM SAP_PROV_ACTIVOS a
-            INNER JOIN SAP_PROVEEDORES p
-            ON a.Instancia = p.Instancia
-            AND a.CardCode = p.CardCode
-            AND a.GroupCode = p.GroupCode
-            AND a.FederalTaxID = p.FederalTaxID
-        """)
-        conn_mssql.commit()
+        """, [instancia])
 
-        resultados = {
-            "fecha_analisis": tz_now().strftime("%Y-%m-%d %H:%M:%S"),
-            "anos_analizados": anos,
-            "total_activos": 0,
-            "total_inactivos": 0,
-            "instancias_procesadas": []
+        inactivos_instancia = cursor.rowcount
+        conn.commit()
+
+        return {
+            "instancia": instancia,
+            "activos": activos_instancia,
+            "inactivos": inactivos_instancia,
+            "hana_segundos": hana_segundos,
+            "escaneo": {
+                tabla: "completo" if datos["completo"] else "incremental"
+                for tabla, datos in escaneo.items()
+            }
         }
 
-        # Conectar a HANA
-        conn_hana = get_hana_connection()
-        cursor_hana = conn_hana.cursor()
+    except Exception as e:
+        conn.rollback()
+        return conservar_actividad_instancia(conn, cursor, instancia, str(e))
 
-        # Procesar cada instancia
-        for instancia in instancias:
-            try:
-                # Consultar CardCodes con actividad en HANA
-                # Obtener de OPCH y OPOR los CardCodes activos
-                query = f"""
-                    SELECT
-                        "CardCode",
-                        COUNT(*) as total_docs,
-                        MAX("DocDate") as ultima_fecha
-                    FROM (
-                        SELECT "CardCode", "DocDate"
-                        FROM "{instancia}".OPCH
-                        WHERE YEAR("DocDate") >= YEAR(CURRENT_DATE) - {anos}
-                        UNION ALL
-                        SELECT "CardCode", "DocDate"
-                        FROM "{instancia}".OPOR
-                        WHERE YEAR("DocDate") >= YEAR(CURRENT_DATE) - {anos}
-                    )
-                    GROUP BY "CardCode"
-                """
-
-                cursor_hana.execute(query)
-                cardcodes_activos = cursor_hana.fetchall()
-
-                activos_instancia = 0
-                inactivos_instancia = 0
-
-                # Insertar proveedores activos en SAP_PROV_ACTIVOS
-                for card_code, total_docs, ultima_fecha in cardcodes_activos:
-                    # Obtener información del proveedor de SAP_PROVEEDORES
-                    cursor_mssql.execute("""
-                        SELECT CardName, FederalTaxID, GroupCode, CurrentAccountBalance
-                        FROM SAP_PROVEEDORES
-                        WHERE Instancia = ? AND CardCode = ?
-                    """, [instancia, card_code])
-
-                    result = cursor_mssql.fetchone()
-                    if result:
-                        card_name, rfc, group_code, saldo = result
-
-                        cursor_mssql.execute("""
-                            INSERT INTO SAP_PROV_ACTIVOS
-                            (Instancia, CardCode, CardName, FederalTaxID, GroupCode, TotalDocumentos, UltimaFecha, SaldoDocumentos, FechaAnalisis)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, GETDATE())
-                        """, [instancia, card_code, card_name, rfc, group_code, total_docs, ultima_fecha, saldo])
-
-                        activos_instancia += 1
-
-                # Insertar proveedores inactivos (los que están en SAP_PROVEEDORES pero NO en SAP_PROV_ACTIVOS)
-                cursor_mssql.execute("""
-                    INSERT INTO SAP_PROV_INACTIVOS (Instancia, CardCode, CardName, FederalTaxID, GroupCode, FechaAnalisis)
-                    SELECT
-                        p.Instancia,
-                        p.CardCode,
-                        p.CardName,
-                        p.FederalTaxID,
-                        p.GroupCode,
-                        GETDATE()
-                    FROM SAP_PROVEEDORES p
-                    WHERE p.Instancia = ?
-                    AND NOT EXISTS (
-                        SELECT 1 FROM SAP_PROV_ACTIVOS a
-                        WHERE a.Instancia = p.Instancia AND a.CardCode = p.CardCode
-                    )
-                """, [instancia])
 
-                inactivos_instancia = cursor_mssql.rowcount
-                conn_mssql.commit()
+def conservar_actividad_instancia(conn, cursor, instancia: str, error: str) -> dict:
+    """Registra el error de una instancia y copia su análisis anterior en lugar de publicarla vacía."""
+    procesada = {
+        "instancia": instancia,
+        "error": error
+    }
+    try:
+        procesada["activos_anteriores"] = _copiar_snapshot_instancia(cursor, instancia)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+    return procesada
 
-                resultados["total_activos"] += activos_instancia
-                resultados["total_inactivos"] += inactivos_instancia
-                resultados["instancias_procesadas"].append({
-                    "instancia": instancia,
-                    "activos": activos_instancia,
-                    "inactivos": inactivos_instancia
-                })
 
-            except Exception as e:
-                resultados["instancias_procesadas"].append({
-                    "instancia": instancia,
-                    "error": str(e)
-                })
+def publicar_actividad(conn, cursor, contexto: dict, instancias: list[str], procesadas: dict) -> dict:
+    """
+    Intercambia las tablas sombra de forma atómica, envía el reporte por correo y arma
+    el resultado del análisis (instancias en el orden de SAP_EMPRESAS).
+    """
+    try:
+        _intercambiar_tablas_actividad(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
-        cursor_hana.close()
-        conn_hana.close()
+    settings = get_settings()
+    instancias_procesadas = [procesadas[instancia] for instancia in instancias]
+    resultados = {
+        "fecha_analisis": tz_now().strftime("%Y-%m-%d %H:%M:%S"),
+        "anos_analizados": contexto["anos"],
+        "fecha_inicio": contexto["fecha_inicio"].isoformat(),
+        "tablas_documentos": contexto["tablas"],
+        "total_activos": sum(p.get("activos", 0) for p in instancias_procesadas),
+        "total_inactivos": sum(p.get("inactivos", 0) for p in instancias_procesadas),
+        "instancias_procesadas": instancias_procesadas
+    }
 
-        # Enviar correo con el reporte
-        if settings.EMAIL_SUPERVISOR:
-            email_result = enviar_correo_actividad_proveedores(anos)
-            resultados["email_enviado"] = email_result
-        else:
-            resultados["email_enviado"] = {"success": False, "error": "EMAIL_SUPERVISOR no configurado"}
+    # Enviar correo con el reporte
+    if settings.EMAIL_SUPERVISOR:
+        email_result = enviar_correo_actividad_proveedores(contexto["anos"])
+        resultados["email_enviado"] = email_result
+    else:
+        resultados["email_enviado"] = {"success": False, "error": "EMAIL_SUPERVISOR no configurado"}
 
-        return {
-            "success": True,
-            "resultados": resultados
-        }
+    return {
+        "success": True,
+        "resultados": resultados
+    }
 
-    finally:
-        cursor_mssql.close()
-        conn_mssql.close()
+
+def _analizar_actividad_proveedores(anos: int, completo: bool) -> dict:
+    import concurrent.futures
+
+    settings = get_settings()
+    with mssql_connection() as conn_mssql:
+        cursor_mssql = conn_mssql.cursor()
+
+        try:
+            # Obtener todas las instancias SAP
+            cursor_mssql.execute("SELECT Instancia FROM SAP_EMPRESAS ORDER BY Instancia")
+            instancias = [row[0] for row in cursor_mssql.fetchall()]
+
+            if not instancias:
+                return {"success": False, "error": "No hay instancias en SAP_EMPRESAS"}
+
+            contexto = preparar_analisis_actividad(conn_mssql, cursor_mssql, anos, completo)
+
+            # Etapa 1: consultas a HANA en paralelo con conexiones del pool HANA
+            # (ACTIVIDAD_HANA_PARALELISMO, sin exceder HANA_POOL_SIZE). Etapa 2: escritura
+            # en MSSQL en este thread, instancia por instancia a medida que terminan sus consultas.
+            paralelismo = max(1, min(len(instancias), settings.ACTIVIDAD_HANA_PARALELISMO, settings.HANA_POOL_SIZE))
+            procesadas = {}
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=paralelismo, thread_name_prefix="actividad-hana") as executor:
+                futures = {
+                    executor.submit(consultar_actividad_contexto, instancia, contexto): instancia
+                    for instancia in instancias
+                }
+
+                for future in concurrent.futures.as_completed(futures):
+                    instancia = futures[future]
+                    try:
+                        escaneo, hana_segundos = future.result()
+                    except Exception as e:
+                        procesadas[instancia] = conservar_actividad_instancia(conn_mssql, cursor_mssql, instancia, str(e))
+                        continue
+                    procesadas[instancia] = escribir_actividad_instancia(
+                        conn_mssql, cursor_mssql, instancia, contexto, escaneo, hana_segundos
+                    )
+
+            # Publicar el nuevo análisis de forma atómica
+            return publicar_actividad(conn_mssql, cursor_mssql, contexto, instancias, procesadas)
+
+        finally:
+            cursor_mssql.close()
 
 
 def enviar_correo_actividad_proveedores(anos: int) -> dict:
@@ -1660,7 +2741,7 @@ def enviar_correo_actividad_proveedores(anos: int) -> dict:
 # Alias para compatibilidad con código existente
 def poblar_sap_proveedores() -> dict:
     """Alias de actualizar_sap_proveedores() para compatibilidad."""
-    return actualizar_sap_proveedores()
+    return actualizar_sap_proveedores(completa=True)
 
 
 
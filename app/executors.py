@@ -0,0 +1,154 @@
+"""
+Executors acotados para ejecutar trabajo bloqueante (pyodbc, hdbcli, httpx síncrono)
+fuera del event loop de uvicorn.
+Cada tipo de trabajo tiene su propio pool de threads para que una operación larga
+no deje sin threads a las demás (por ejemplo, la validación de sesiones):
+
+- session: operaciones de USER_SESSIONS (login, validación, logout)
+- mssql: consultas y escrituras en MSSQL
+- hana: consultas a SAP HANA
+- sl: llamadas a SAP B1 Service Layer
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from config import get_settings
+
+
+class BlockingExecutor:
+    """
+    Pool de threads con nombre para despachar funciones bloqueantes desde código async.
+    Lleva métricas de profundidad de cola (tareas esperando thread) y de ejecución.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"exec-{name}")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    def _dequeue(self, ticket: dict) -> None:
+        """Descuenta la tarea de la cola una sola vez. Requiere el lock."""
+        if not ticket["dequeued"]:
+            ticket["dequeued"] = True
+            self._queued -= 1
+
+    def _execute(self, ticket: dict, call: Callable[[], Any]) -> Any:
+        started_at = time.monotonic()
+        with self._lock:
+            self._dequeue(ticket)
+            self._active += 1
+            self._total_wait += started_at - ticket["submitted_at"]
+
+        failed = False
+        try:
+            return call()
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._total_run += time.monotonic() - started_at
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta func(*args, **kwargs) en el pool y espera el resultado sin bloquear el loop."""
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, func, *args, **kwargs)
+
+        ticket = {"submitted_at": time.monotonic(), "dequeued": False}
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        try:
+            return await loop.run_in_executor(self._executor, self._execute, ticket, call)
+        except (RuntimeError, asyncio.CancelledError):
+            # Executor detenido o petición cancelada antes de que la tarea empezara
+            with self._lock:
+                self._dequeue(ticket)
+            raise
+
+    def stats(self) -> dict:
+        """Retorna métricas del executor."""
+        with self._lock:
+            terminadas = self._completed + self._failed
+            return {
+                "nombre": self.name,
+                "max_workers": self.max_workers,
+                "en_ejecucion": self._active,
+                "en_cola": self._queued,
+                "max_en_cola": self._max_queued,
+                "completadas": self._completed,
+                "fallidas": self._failed,
+                "espera_promedio_ms": round(self._total_wait / terminadas * 1000, 1) if terminadas else 0.0,
+                "ejecucion_promedio_ms": round(self._total_run / terminadas * 1000, 1) if terminadas else 0.0
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_executors: dict[str, BlockingExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def _executor_sizes() -> dict[str, int]:
+    settings = get_settings()
+    return {
+        "session": settings.SESSION_EXECUTOR_WORKERS,
+        "mssql": settings.MSSQL_EXECUTOR_WORKERS,
+        "hana": settings.HANA_EXECUTOR_WORKERS,
+        "sl": settings.SL_EXECUTOR_WORKERS,
+    }
+
+
+def get_executor(name: str) -> BlockingExecutor:
+    """Retorna el executor con el nombre indicado, creándolo con el tamaño configurado."""
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            sizes = _executor_sizes()
+            if name not in sizes:
+                raise ValueError(f"Executor desconocido: {name}")
+            executor = BlockingExecutor(name, sizes[name])
+            _executors[name] = executor
+        return executor
+
+
+async def run_blocking(name: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Despacha una función bloqueante al executor indicado."""
+    return await get_executor(name).run(func, *args, **kwargs)
+
+
+def get_executor_stats() -> list[dict]:
+    """Retorna métricas de todos los executors creados."""
+    with _executors_lock:
+        executors = list(_executors.values())
+    return [executor.stats() for executor in executors]
+
+
+def shutdown_executors() -> None:
+    """Detiene todos los executors (al apagar la aplicación)."""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown()
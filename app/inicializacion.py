@@ -0,0 +1,454 @@
+"""
+Inicialización de datos (POST /inicializa_datos) como un grafo de etapas (pipeline.GrafoEtapas).
+
+Antes cada fase esperaba a que la anterior terminara para todas las instancias. Ahora el
+trabajo de cada instancia avanza en cuanto sus propias entradas están listas:
+
+    base_datos ─┬─ configuracion
+                ├─ sesion
+                ├─ service_layer:{i} ── proveedores:{i} ─┐
+                └─ actividad_preparar ── hana:{i} ───────┴─ actividad:{i}
+
+- base_datos: elimina y recrea la base de datos, carga SAP_EMPRESAS y agrega las etapas por instancia
+- service_layer:{i}: login de la instancia y de su _PRUEBAS
+- proveedores:{i}: sincronización completa de SAP_PROVEEDORES apenas su Service Layer respondió
+- hana:{i}: consulta de actividad en HANA; no depende de Service Layer
+- actividad:{i}: escritura en las tablas sombra. Espera a hana:{i} y a proveedores:{i}
+  porque activos e inactivos se cruzan con SAP_PROVEEDORES
+
+Las etapas resumen_service_layer (un solo UPDATE de SL/SLP), resumen_proveedores y
+publicar_actividad (intercambio de tablas sombra) esperan a todas las instancias;
+correo espera a las tres.
+Los cupos por recurso son los mismos de las funciones individuales: SL_PROBE_CONCURRENCIA,
+SYNC_PROVEEDORES_MAX_SL/MAX_MSSQL y ACTIVIDAD_HANA_PARALELISMO (sin exceder HANA_POOL_SIZE).
+"""
+import threading
+import time
+from typing import Callable
+
+from config import get_instancia_sl, get_modo_pruebas, get_settings
+from database import (
+    BloqueoActividad,
+    acumular_resultado_proveedores,
+    actualizar_flags_sl,
+    conservar_actividad_instancia,
+    consultar_actividad_contexto,
+    enviar_correo_inicializacion,
+    escribir_actividad_instancia,
+    get_instancias_sap_empresas,
+    inicializa_sap_empresas,
+    insertar_configuracion_settings,
+    mssql_connection,
+    nuevo_resultado_proveedores,
+    preparar_analisis_actividad,
+    probar_service_layer,
+    pruebas_service_layer,
+    publicar_actividad,
+    resumir_pruebas_service_layer,
+    sincronizar_proveedores_instancia,
+    slots_sync_proveedores,
+)
+from pipeline import (
+    ETAPA_COMPLETADA,
+    ETAPA_EN_EJECUCION,
+    ETAPA_FALLIDA,
+    ETAPA_OMITIDA,
+    ETAPA_PENDIENTE,
+    EtapaOmitida,
+    GrafoEtapas,
+)
+from utils import now as tz_now
+
+# Nombre legible de cada grupo de etapas (mensaje de progreso)
+ETIQUETAS = {
+    "base_datos": "Recreando base de datos y SAP_EMPRESAS",
+    "configuracion": "Guardando SETTINGS",
+    "sesion": "Restaurando sesión",
+    "actividad_preparar": "Preparando análisis de actividad",
+    "service_layer": "Service Layer",
+    "proveedores": "Proveedores",
+    "hana": "Actividad HANA",
+    "actividad": "Actividad MSSQL",
+    "resumen_service_layer": "Actualizando SL/SLP",
+    "resumen_proveedores": "Resumiendo proveedores",
+    "publicar_actividad": "Publicando SAP_PROV_ACTIVOS/INACTIVOS",
+    "correo": "Enviando correo con resultados",
+}
+
+# Como máximo una escritura de progreso al almacén de jobs por este intervalo (segundos)
+PROGRESO_INTERVALO = 1.0
+
+
+class _ReporteProgreso:
+    """
+    Resume el estado del grafo por grupo e instancia y lo entrega a reportar(mensaje, etapas).
+    Los cambios seguidos se agrupan: se reporta a lo más una vez por PROGRESO_INTERVALO y
+    un timer reporta el último cambio pendiente.
+    """
+
+    def __init__(self, grafo: GrafoEtapas, reportar: Callable[[str, dict], None] | None):
+        self.grafo = grafo
+        self.reportar = reportar
+        self._lock = threading.Lock()
+        self._ultimo = 0.0
+        self._timer: threading.Timer | None = None
+        self._cerrado = False
+
+    def al_cambiar(self, etapa) -> None:
+        if self.reportar is None:
+            return
+        with self._lock:
+            if self._cerrado:
+                return
+            espera = PROGRESO_INTERVALO - (time.monotonic() - self._ultimo)
+            if espera <= 0:
+                self._guardar()
+            elif self._timer is None:
+                self._timer = threading.Timer(espera, self._guardar_pendiente)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _guardar_pendiente(self) -> None:
+        with self._lock:
+            self._timer = None
+            # Un timer que ya disparó no debe escribir después del reporte final
+            if not self._cerrado:
+                self._guardar()
+
+    def _guardar(self) -> None:
+        """Requiere el lock."""
+        self._ultimo = time.monotonic()
+        etapas = self.resumen()
+        try:
+            self.reportar(self.mensaje(etapas), etapas)
+        except Exception as e:
+            print(f"[Inicialización] Error guardando progreso: {e}")
+
+    def finalizar(self) -> None:
+        with self._lock:
+            self._cerrado = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.reportar is not None:
+                self._guardar()
+
+    def resumen(self) -> dict:
+        """
+        {"grupos": {grupo: {estado, total, conteos por estado, segundos}},
+         "instancias": {instancia: {grupo: estado}}, "errores": [...]}
+        """
+        ahora = time.perf_counter()
+        grupos = {}
+        instancias = {}
+        errores = []
+        for etapa in self.grafo.instantanea():
+            grupo = grupos.setdefault(etapa.grupo, {
+                "etiqueta": ETIQUETAS.get(etapa.grupo, etapa.grupo),
+                "total": 0,
+                ETAPA_PENDIENTE: 0,
+                ETAPA_EN_EJECUCION: 0,
+                ETAPA_COMPLETADA: 0,
+                ETAPA_FALLIDA: 0,
+                ETAPA_OMITIDA: 0,
+                "_inicio": None,
+                "_fin": None
+            })
+            grupo["total"] += 1
+            grupo[etapa.estado] += 1
+            if etapa.inicio is not None:
+                grupo["_inicio"] = min(grupo["_inicio"] or etapa.inicio, etapa.inicio)
+                grupo["_fin"] = max(grupo["_fin"] or 0, etapa.fin or ahora)
+            if etapa.instancia is not None:
+                instancias.setdefault(etapa.instancia, {})[etapa.grupo] = etapa.estado
+            if etapa.estado == ETAPA_FALLIDA:
+                errores.append({"etapa": etapa.nombre, "error": etapa.error})
+
+        for grupo in grupos.values():
+            inicio, fin = grupo.pop("_inicio"), grupo.pop("_fin")
+            grupo["segundos"] = round(fin - inicio, 2) if inicio is not None else None
+            terminadas = grupo[ETAPA_COMPLETADA] + grupo[ETAPA_FALLIDA] + grupo[ETAPA_OMITIDA]
+            if grupo["total"] == 1 and terminadas == 1:
+                grupo["estado"] = ETAPA_COMPLETADA if grupo[ETAPA_COMPLETADA] else (
+                    ETAPA_FALLIDA if grupo[ETAPA_FALLIDA] else ETAPA_OMITIDA
+                )
+            elif terminadas == grupo["total"]:
+                grupo["estado"] = ETAPA_COMPLETADA
+            elif grupo[ETAPA_PENDIENTE] == grupo["total"]:
+                grupo["estado"] = ETAPA_PENDIENTE
+            else:
+                grupo["estado"] = ETAPA_EN_EJECUCION
+
+        return {"grupos": grupos, "instancias": instancias, "errores": errores}
+
+    @staticmethod
+    def mensaje(etapas: dict) -> str:
+        """Mensaje corto con los grupos en ejecución, p. ej. 'Service Layer 12/40, Proveedores 3/40'."""
+        partes = []
+        for grupo in etapas["grupos"].values():
+            if grupo["estado"] != ETAPA_EN_EJECUCION:
+                continue
+            if grupo["total"] > 1:
+                terminadas = grupo["total"] - grupo[ETAPA_PENDIENTE] - grupo[ETAPA_EN_EJECUCION]
+                partes.append(f"{grupo['etiqueta']} {terminadas}/{grupo['total']}")
+            else:
+                partes.append(grupo["etiqueta"])
+        if partes:
+            return ", ".join(partes)
+        if all(grupo["estado"] == ETAPA_COMPLETADA for grupo in etapas["grupos"].values()):
+            return "Finalizando..."
+        return "Procesando..."
+
+
+def inicializar_datos(
+    session_id: str,
+    username: str,
+    scopes: list[str],
+    anos: int = 0,
+    email: str | None = None,
+    modo: int = 0,
+    s_activas: int = 2,
+    reportar: Callable[[str, dict], None] | None = None
+) -> dict:
+    """
+    Ejecuta la inicialización completa como grafo de etapas.
+    reportar(mensaje, etapas) recibe el progreso por grupo e instancia.
+    Retorna el resultado de cada parte (mismas llaves que antes) más "etapas".
+    Si falla una etapa global (no de una instancia), lanza RuntimeError al terminar el grafo.
+    """
+    settings = get_settings()
+    inicio = time.perf_counter()
+
+    limites = {
+        "service_layer": settings.SL_PROBE_CONCURRENCIA,
+        "proveedores": max(settings.SYNC_PROVEEDORES_MAX_SL, settings.SYNC_PROVEEDORES_MAX_MSSQL),
+        "hana": min(settings.ACTIVIDAD_HANA_PARALELISMO, settings.HANA_POOL_SIZE),
+        # Una instancia a la vez en las tablas sombra, igual que en analizar_actividad_proveedores()
+        "actividad": 1,
+    }
+    grafo = GrafoEtapas(limites, max_workers=sum(max(1, limite) for limite in limites.values()) + 4)
+    reporte = _ReporteProgreso(grafo, reportar)
+    grafo.al_cambiar = reporte.al_cambiar
+
+    sl_slots, mssql_slots = slots_sync_proveedores()
+    # Lo toma actividad_preparar y lo suelta publicar_actividad; si esa etapa no llega a
+    # ejecutarse (una etapa falla o queda sin resolver), se suelta al terminar el grafo
+    bloqueo_actividad = BloqueoActividad()
+
+    def base_datos(entradas):
+        resultado_empresas = inicializa_sap_empresas()
+        instancias_info = get_instancias_sap_empresas()
+        _agregar_etapas_instancias(grafo, instancias_info, anos, email, sl_slots, mssql_slots, bloqueo_actividad)
+        return {"sap_empresas": resultado_empresas, "instancias": instancias_info}
+
+    def configuracion(entradas):
+        return insertar_configuracion_settings(modo, s_activas, anos, email or settings.EMAIL_SUPERVISOR)
+
+    def sesion(entradas):
+        # USER_SESSIONS ya existe: la sesión del usuario se restaura sin esperar al resto
+        with mssql_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                now = tz_now()
+                cursor.execute("""
+                    INSERT INTO USER_SESSIONS (SessionID, Username, CreatedAt, LastActivity, Scopes)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (session_id, username, now, now, ",".join(scopes)))
+                conn.commit()
+            finally:
+                cursor.close()
+        return True
+
+    grafo.agregar("base_datos", base_datos)
+    grafo.agregar("configuracion", configuracion, requiere=["base_datos"])
+    grafo.agregar("sesion", sesion, requiere=["base_datos"])
+
+    try:
+        etapas = grafo.ejecutar()
+    finally:
+        bloqueo_actividad.liberar()
+    reporte.finalizar()
+
+    # Una etapa global fallida u omitida falla el job, como antes cualquier excepción
+    for etapa in etapas.values():
+        if etapa.instancia is None and etapa.estado in (ETAPA_FALLIDA, ETAPA_OMITIDA):
+            raise RuntimeError(f"Etapa {etapa.nombre}: {etapa.error}")
+
+    def resultado(nombre: str, defecto=None):
+        etapa = etapas.get(nombre)
+        return etapa.resultado if etapa is not None and etapa.estado == ETAPA_COMPLETADA else defecto
+
+    resumen = reporte.resumen()
+    return {
+        "sap_empresas": etapas["base_datos"].resultado["sap_empresas"],
+        "service_layer": resultado("resumen_service_layer"),
+        "sap_proveedores": resultado("resumen_proveedores"),
+        "analisis_actividad": resultado(
+            "publicar_actividad", {"success": False, "error": "No hay instancias en SAP_EMPRESAS"}
+        ),
+        "email_enviado": resultado("correo"),
+        "session_restored": True,
+        "etapas": {
+            "duracion_segundos": round(time.perf_counter() - inicio, 2),
+            "grupos": {
+                grupo: {"estado": datos["estado"], "total": datos["total"], "segundos": datos["segundos"]}
+                for grupo, datos in resumen["grupos"].items()
+            },
+            "errores": resumen["errores"]
+        }
+    }
+
+
+def _agregar_etapas_instancias(
+    grafo: GrafoEtapas,
+    instancias_info: dict,
+    anos: int,
+    email: str | None,
+    sl_slots: threading.BoundedSemaphore,
+    mssql_slots: threading.BoundedSemaphore,
+    bloqueo_actividad: BloqueoActividad
+) -> None:
+    """Agrega las etapas por instancia y las que las resumen (se llama desde base_datos)."""
+    settings = get_settings()
+    instancias = list(instancias_info)
+    modo_pruebas = get_modo_pruebas()
+
+    def probar_sl(instancia):
+        def etapa(entradas):
+            company_dbs = [instancia]
+            if instancias_info[instancia]["tiene_prueba"]:
+                company_dbs.append(f"{instancia}_PRUEBAS")
+            return probar_service_layer(company_dbs)
+        return etapa
+
+    def sincronizar(instancia):
+        def etapa(entradas):
+            # Misma condición que vw_productivo / vw_pruebas
+            instancia_sl = get_instancia_sl(instancia)
+            if modo_pruebas and not instancias_info[instancia]["tiene_prueba"]:
+                raise EtapaOmitida("Sin instancia _PRUEBAS")
+            probados = entradas[f"service_layer:{instancia}"].resultado
+            if not probados.get(instancia_sl, {}).get("success"):
+                raise EtapaOmitida("Service Layer no disponible")
+            return sincronizar_proveedores_instancia(instancia, instancia_sl, True, sl_slots, mssql_slots)
+        return etapa
+
+    def consultar_hana(instancia):
+        def etapa(entradas):
+            return consultar_actividad_contexto(instancia, entradas["actividad_preparar"].resultado)
+        return etapa
+
+    def escribir_actividad(instancia):
+        def etapa(entradas):
+            contexto = entradas["actividad_preparar"].resultado
+            hana = entradas[f"hana:{instancia}"]
+            with mssql_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    if hana.estado != ETAPA_COMPLETADA:
+                        return conservar_actividad_instancia(conn, cursor, instancia, hana.error or "Consulta HANA no realizada")
+                    escaneo, hana_segundos = hana.resultado
+                    return escribir_actividad_instancia(conn, cursor, instancia, contexto, escaneo, hana_segundos)
+                finally:
+                    cursor.close()
+        return etapa
+
+    def resumen_service_layer(entradas):
+        probados = {}
+        for instancia in instancias:
+            etapa = entradas[f"service_layer:{instancia}"]
+            if etapa.estado == ETAPA_COMPLETADA:
+                probados.update(etapa.resultado)
+        resultado, flags = resumir_pruebas_service_layer(instancias_info, pruebas_service_layer(instancias_info), probados)
+        actualizar_flags_sl(flags)
+        return resultado
+
+    def resumen_proveedores(entradas):
+        etapas = [entradas[f"proveedores:{instancia}"] for instancia in instancias]
+        resultados = nuevo_resultado_proveedores(sum(1 for etapa in etapas if etapa.estado != ETAPA_OMITIDA))
+        for instancia, etapa in zip(instancias, etapas):
+            if etapa.estado == ETAPA_COMPLETADA:
+                acumular_resultado_proveedores(resultados, etapa.resultado)
+            elif etapa.estado == ETAPA_FALLIDA:
+                resultados["errores"].append({"instancia": instancia, "error": etapa.error})
+        iniciadas = [etapa for etapa in etapas if etapa.inicio is not None]
+        resultados["duracion_segundos"] = round(
+            max(etapa.fin for etapa in iniciadas) - min(etapa.inicio for etapa in iniciadas), 2
+        ) if iniciadas else 0.0
+        return resultados
+
+    def actividad_preparar(entradas):
+        # Serializa con otros análisis de actividad; publicar_actividad libera el lock
+        # (y si no llega a ejecutarse, inicializar_datos al terminar el grafo)
+        bloqueo_actividad.adquirir()
+        try:
+            with mssql_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    return preparar_analisis_actividad(conn, cursor, anos, False)
+                finally:
+                    cursor.close()
+        except Exception:
+            bloqueo_actividad.liberar()
+            raise
+
+    def publicar(entradas):
+        try:
+            procesadas = {}
+            for instancia in instancias:
+                etapa = entradas[f"actividad:{instancia}"]
+                procesadas[instancia] = etapa.resultado if etapa.estado == ETAPA_COMPLETADA else {
+                    "instancia": instancia,
+                    "error": etapa.error
+                }
+            with mssql_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    return publicar_actividad(conn, cursor, entradas["actividad_preparar"].resultado, instancias, procesadas)
+                finally:
+                    cursor.close()
+        finally:
+            bloqueo_actividad.liberar()
+
+    def correo(entradas):
+        # Usar email del formulario solo si es diferente a EMAIL_SUPERVISOR
+        base = entradas["base_datos"].resultado
+        destinatario = email if (email and email != settings.EMAIL_SUPERVISOR) else settings.EMAIL_SUPERVISOR
+        if not destinatario:
+            return {"success": False, "error": "No hay destinatario configurado"}
+
+        def resultado(nombre):
+            etapa = entradas.get(nombre)
+            return etapa.resultado if etapa is not None and etapa.estado == ETAPA_COMPLETADA else None
+
+        return enviar_correo_inicializacion(
+            base["sap_empresas"],
+            resultado("resumen_service_layer"),
+            resultado("resumen_proveedores"),
+            resultado("publicar_actividad"),
+            destinatario=destinatario
+        )
+
+    for instancia in instancias:
+        grafo.agregar(f"service_layer:{instancia}", probar_sl(instancia), requiere=["base_datos"],
+                      recurso="service_layer", grupo="service_layer", instancia=instancia)
+        grafo.agregar(f"proveedores:{instancia}", sincronizar(instancia), requiere=[f"service_layer:{instancia}"],
+                      recurso="proveedores", grupo="proveedores", instancia=instancia)
+
+    grafo.agregar("resumen_service_layer", resumen_service_layer, despues_de=[f"service_layer:{i}" for i in instancias])
+    grafo.agregar("resumen_proveedores", resumen_proveedores, despues_de=[f"proveedores:{i}" for i in instancias])
+
+    despues_de_correo = ["resumen_service_layer", "resumen_proveedores"]
+    if instancias:
+        grafo.agregar("actividad_preparar", actividad_preparar, requiere=["base_datos"])
+        for instancia in instancias:
+            grafo.agregar(f"hana:{instancia}", consultar_hana(instancia), requiere=["actividad_preparar"],
+                          recurso="hana", grupo="hana", instancia=instancia)
+            grafo.agregar(f"actividad:{instancia}", escribir_actividad(instancia), requiere=["actividad_preparar"],
+                          despues_de=[f"hana:{instancia}", f"proveedores:{instancia}"],
+                          recurso="actividad", grupo="actividad", instancia=instancia)
+        grafo.agregar("publicar_actividad", publicar, requiere=["actividad_preparar"],
+                      despues_de=[f"actividad:{i}" for i in instancias])
+        despues_de_correo.append("publicar_actividad")
+
+    grafo.agregar("correo", correo, requiere=["base_datos"], despues_de=despues_de_correo)
@@ -0,0 +1,410 @@
+"""
+Almacén persistente de jobs (inicialización de datos y otros trabajos largos).
+
+Reemplaza el diccionario en memoria de main.py: el estado de cada job vive en una tabla
+que cualquier worker de uvicorn puede leer, y los jobs pendientes los reclama el primer
+worker que los encuentra (UPDATE condicional sobre Status = 'pending').
+
+Backends (JOBS_BACKEND):
+- mssql: tabla INIT_JOBS en la base de datos {MSSQL_DATABASE}_JOBS. Va en una base aparte
+  porque la inicialización elimina y recrea la base de datos de la aplicación.
+- sqlite: archivo local JOBS_SQLITE_PATH (pruebas o un solo host).
+
+El worker que ejecuta un job renueva HeartbeatAt periódicamente; si un job 'running'
+deja de renovarlo por más de JOBS_STALE_SECONDS (el proceso murió o se reinició),
+recuperar_huerfanos() lo marca como fallido.
+
+Cada cambio de estado o progreso hecho en este proceso se avisa a los streams SSE
+suscritos (suscribir_job), que así no esperan a su siguiente lectura del almacén.
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from config import get_settings
+from database import mssql_connection
+from utils import now as tz_now
+
+# Estados de un job
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# Identificador de este proceso como dueño de los jobs que reclama
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Suscripciones de este proceso a cambios de un job: job_id -> {evento: loop del evento}
+_suscripciones: dict[str, dict[asyncio.Event, asyncio.AbstractEventLoop]] = {}
+_suscripciones_lock = threading.Lock()
+
+
+def suscribir_job(job_id: str) -> asyncio.Event:
+    """
+    Retorna un asyncio.Event (del loop actual) que se activa cada vez que este proceso
+    cambia el job. Los cambios hechos por otros workers no se avisan: el suscriptor
+    debe seguir leyendo el almacén periódicamente.
+    """
+    evento = asyncio.Event()
+    with _suscripciones_lock:
+        _suscripciones.setdefault(job_id, {})[evento] = asyncio.get_running_loop()
+    return evento
+
+
+def cancelar_suscripcion_job(job_id: str, evento: asyncio.Event) -> None:
+    with _suscripciones_lock:
+        eventos = _suscripciones.get(job_id)
+        if eventos is not None:
+            eventos.pop(evento, None)
+            if not eventos:
+                del _suscripciones[job_id]
+
+
+def _notificar_job(job_id: str) -> None:
+    """Activa los eventos suscritos al job (se llama desde cualquier thread)."""
+    with _suscripciones_lock:
+        eventos = list(_suscripciones.get(job_id, {}).items())
+    for evento, loop in eventos:
+        try:
+            loop.call_soon_threadsafe(evento.set)
+        except RuntimeError:
+            # El loop ya se cerró (apagado del proceso)
+            pass
+
+
+_COLUMNAS = (
+    "JobID, Tipo, Status, Progress, Params, Result, Error, "
+    "CreatedAt, StartedAt, FinishedAt, Owner, HeartbeatAt, Etapas"
+)
+
+
+def _fila_a_job(row) -> dict:
+    return {
+        "job_id": row[0],
+        "tipo": row[1],
+        "status": row[2],
+        "progress": row[3],
+        "params": json.loads(row[4]) if row[4] else {},
+        "result": json.loads(row[5]) if row[5] else None,
+        "error": row[6],
+        "created_at": row[7],
+        "started_at": row[8],
+        "finished_at": row[9],
+        "owner": row[10],
+        "heartbeat_at": row[11],
+        "etapas": json.loads(row[12]) if row[12] else None
+    }
+
+
+class JobStore(ABC):
+    """
+    Operaciones sobre la tabla INIT_JOBS. Las subclases solo aportan la conexión y el DDL;
+    el SQL es común (parámetros '?' en pyodbc y sqlite3).
+    Las fechas se guardan como texto ISO con zona horaria (igual que antes en memoria)
+    y el latido como epoch en segundos para compararlo sin depender de la zona.
+    """
+
+    # Hint para leer con bloqueo la verificación de "ningún job del tipo en ejecución"
+    _HINT_EXCLUSIVO = ""
+
+    @abstractmethod
+    def _conexion(self):
+        """Context manager que entrega una conexión DB-API (con commit/rollback a cargo del llamador)."""
+
+    @abstractmethod
+    def ensure_table(self) -> None:
+        """Crea INIT_JOBS (y migra sus columnas) si no existe."""
+
+    def _ejecutar(self, sql: str, params: tuple | list = ()) -> int:
+        """Ejecuta una sentencia, hace commit y retorna las filas afectadas."""
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                afectadas = cursor.rowcount
+                conn.commit()
+                return afectadas
+            finally:
+                cursor.close()
+
+    def _consultar(self, sql: str, params: tuple | list = ()) -> list:
+        with self._conexion() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def crear(self, tipo: str, params: dict) -> str:
+        """Registra un job pendiente y retorna su job_id."""
+        job_id = str(uuid.uuid4())
+        self._ejecutar(
+            """
+            INSERT INTO INIT_JOBS (JobID, Tipo, Status, Progress, Params, CreatedAt)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (job_id, tipo, JOB_PENDING, "Trabajo en cola...", json.dumps(params, default=str), tz_now().isoformat())
+        )
+        return job_id
+
+    def reclamar(self, job_id: str, owner: str = WORKER_ID) -> bool:
+        """
+        Toma un job pendiente para ejecutarlo. Solo un worker lo consigue, y solo si no hay
+        otro job del mismo tipo en ejecución (las inicializaciones no pueden traslaparse).
+        """
+        afectadas = self._ejecutar(
+            f"""
+            UPDATE INIT_JOBS
+            SET Status = ?, Owner = ?, StartedAt = ?, HeartbeatAt = ?
+            WHERE JobID = ? AND Status = ?
+              AND NOT EXISTS (
+                  SELECT 1 FROM INIT_JOBS otro {self._HINT_EXCLUSIVO}
+                  WHERE otro.Tipo = INIT_JOBS.Tipo AND otro.Status = ?
+              )
+            """,
+            (JOB_RUNNING, owner, tz_now().isoformat(), time.time(), job_id, JOB_PENDING, JOB_RUNNING)
+        )
+        if afectadas == 1:
+            _notificar_job(job_id)
+        return afectadas == 1
+
+    def reclamar_siguiente(self, owner: str = WORKER_ID) -> dict | None:
+        """Reclama el job pendiente más antiguo que se pueda ejecutar. Retorna el job o None."""
+        pendientes = self._consultar(
+            "SELECT JobID FROM INIT_JOBS WHERE Status = ? ORDER BY CreatedAt",
+            (JOB_PENDING,)
+        )
+        for (job_id,) in pendientes:
+            if self.reclamar(job_id, owner):
+                return self.obtener(job_id)
+        return None
+
+    def progreso(self, job_id: str, mensaje: str, etapas: dict | None = None) -> None:
+        """
+        Actualiza el mensaje de progreso (también cuenta como latido) y, si se indica,
+        el detalle por etapa e instancia.
+        """
+        if etapas is None:
+            self._ejecutar(
+                "UPDATE INIT_JOBS SET Progress = ?, HeartbeatAt = ? WHERE JobID = ?",
+                (mensaje, time.time(), job_id)
+            )
+        else:
+            self._ejecutar(
+                "UPDATE INIT_JOBS SET Progress = ?, Etapas = ?, HeartbeatAt = ? WHERE JobID = ?",
+                (mensaje, json.dumps(etapas, default=str), time.time(), job_id)
+            )
+        _notificar_job(job_id)
+
+    def latido(self, job_id: str) -> None:
+        self._ejecutar(
+            "UPDATE INIT_JOBS SET HeartbeatAt = ? WHERE JobID = ? AND Status = ?",
+            (time.time(), job_id, JOB_RUNNING)
+        )
+
+    def completar(self, job_id: str, result: dict, mensaje: str = "Completado") -> None:
+        self._ejecutar(
+            "UPDATE INIT_JOBS SET Status = ?, Progress = ?, Result = ?, FinishedAt = ? WHERE JobID = ?",
+            (JOB_COMPLETED, mensaje, json.dumps(result, default=str), tz_now().isoformat(), job_id)
+        )
+        _notificar_job(job_id)
+
+    def fallar(self, job_id: str, error: str) -> None:
+        self._ejecutar(
+            "UPDATE INIT_JOBS SET Status = ?, Error = ?, FinishedAt = ? WHERE JobID = ?",
+            (JOB_FAILED, error, tz_now().isoformat(), job_id)
+        )
+        _notificar_job(job_id)
+
+    def obtener(self, job_id: str) -> dict | None:
+        filas = self._consultar(f"SELECT {_COLUMNAS} FROM INIT_JOBS WHERE JobID = ?", (job_id,))
+        return _fila_a_job(filas[0]) if filas else None
+
+    def listar(self, limite: int = 50) -> list[dict]:
+        """Jobs más recientes primero (sin el resultado completo ni el detalle por etapa)."""
+        filas = self._consultar(f"SELECT {_COLUMNAS} FROM INIT_JOBS ORDER BY CreatedAt DESC")
+        jobs = []
+        for row in filas[:limite]:
+            job = _fila_a_job(row)
+            job.pop("result")
+            job.pop("etapas")
+            jobs.append(job)
+        return jobs
+
+    def recuperar_huerfanos(self, stale_seconds: float) -> int:
+        """Marca como fallidos los jobs en ejecución sin latido reciente. Retorna cuántos."""
+        return self._ejecutar(
+            """
+            UPDATE INIT_JOBS
+            SET Status = ?, Error = ?, FinishedAt = ?
+            WHERE Status = ? AND (HeartbeatAt IS NULL OR HeartbeatAt < ?)
+            """,
+            (
+                JOB_FAILED,
+                f"Job interrumpido: el worker que lo ejecutaba dejó de responder por más de {stale_seconds:g} s",
+                tz_now().isoformat(),
+                JOB_RUNNING,
+                time.time() - stale_seconds
+            )
+        )
+
+    def limpiar(self, horas: float = 24) -> int:
+        """Elimina jobs terminados (completados o fallidos) con más de 'horas' de antigüedad."""
+        limite = tz_now() - timedelta(hours=horas)
+        filas = self._consultar(
+            "SELECT JobID, CreatedAt FROM INIT_JOBS WHERE Status IN (?, ?)",
+            (JOB_COMPLETED, JOB_FAILED)
+        )
+        # CreatedAt es texto ISO con zona horaria: se compara como datetime, no como texto
+        viejos = [job_id for job_id, creado in filas if datetime.fromisoformat(creado) < limite]
+        for job_id in viejos:
+            self._ejecutar("DELETE FROM INIT_JOBS WHERE JobID = ?", (job_id,))
+        return len(viejos)
+
+    @contextmanager
+    def latiendo(self, job_id: str, intervalo: float):
+        """
+        Context manager que renueva el latido del job cada 'intervalo' segundos en un thread
+        aparte mientras el bloque se ejecuta (las etapas largas no reportan progreso seguido).
+        """
+        detener = threading.Event()
+
+        def latir():
+            while not detener.wait(intervalo):
+                try:
+                    self.latido(job_id)
+                except Exception as e:
+                    print(f"[Jobs] Error renovando latido de {job_id}: {e}")
+
+        hilo = threading.Thread(target=latir, name=f"job-latido-{job_id[:8]}", daemon=True)
+        hilo.start()
+        try:
+            yield
+        finally:
+            detener.set()
+            hilo.join(timeout=5)
+
+
+class MSSQLJobStore(JobStore):
+    """INIT_JOBS en la base de datos {MSSQL_DATABASE}_JOBS (sobrevive a la reinicialización)."""
+
+    _HINT_EXCLUSIVO = "WITH (UPDLOCK, HOLDLOCK)"
+
+    def __init__(self, database: str):
+        self.database = database
+
+    @contextmanager
+    def _conexion(self):
+        with mssql_connection(self.database) as conn:
+            yield conn
+
+    def ensure_table(self) -> None:
+        with mssql_connection(database="master") as conn:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sys.databases WHERE name = ?",
+                    (self.database,)
+                )
+                if cursor.fetchone()[0] == 0:
+                    cursor.execute(f"CREATE DATABASE [{self.database}]")
+            finally:
+                cursor.close()
+
+        self._ejecutar("""
+            IF OBJECT_ID('INIT_JOBS', 'U') IS NULL
+                CREATE TABLE INIT_JOBS (
+                    JobID NVARCHAR(36) NOT NULL PRIMARY KEY,
+                    Tipo NVARCHAR(50) NOT NULL,
+                    Status NVARCHAR(20) NOT NULL,
+                    Progress NVARCHAR(500),
+                    Params NVARCHAR(MAX),
+                    Result NVARCHAR(MAX),
+                    Error NVARCHAR(MAX),
+                    CreatedAt NVARCHAR(40) NOT NULL,
+                    StartedAt NVARCHAR(40),
+                    FinishedAt NVARCHAR(40),
+                    Owner NVARCHAR(100),
+                    HeartbeatAt FLOAT,
+                    Etapas NVARCHAR(MAX)
+                )
+        """)
+        self._ejecutar("""
+            IF COL_LENGTH('INIT_JOBS', 'Etapas') IS NULL
+                ALTER TABLE INIT_JOBS ADD Etapas NVARCHAR(MAX)
+        """)
+        self._ejecutar("""
+            IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_INIT_JOBS_Status')
+                CREATE INDEX IX_INIT_JOBS_Status ON INIT_JOBS (Status, CreatedAt)
+        """)
+
+
+class SQLiteJobStore(JobStore):
+    """INIT_JOBS en un archivo SQLite local. Las escrituras de SQLite ya son exclusivas."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def _conexion(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def ensure_table(self) -> None:
+        directorio = os.path.dirname(self.path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._ejecutar("""
+            CREATE TABLE IF NOT EXISTS INIT_JOBS (
+                JobID TEXT NOT NULL PRIMARY KEY,
+                Tipo TEXT NOT NULL,
+                Status TEXT NOT NULL,
+                Progress TEXT,
+                Params TEXT,
+                Result TEXT,
+                Error TEXT,
+                CreatedAt TEXT NOT NULL,
+                StartedAt TEXT,
+                FinishedAt TEXT,
+                Owner TEXT,
+                HeartbeatAt REAL,
+                Etapas TEXT
+            )
+        """)
+        columnas = [fila[1] for fila in self._consultar("PRAGMA table_info(INIT_JOBS)")]
+        if "Etapas" not in columnas:
+            self._ejecutar("ALTER TABLE INIT_JOBS ADD COLUMN Etapas TEXT")
+        self._ejecutar("CREATE INDEX IF NOT EXISTS IX_INIT_JOBS_Status ON INIT_JOBS (Status, CreatedAt)")
+
+
+_job_store: JobStore | None = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """Retorna el almacén de jobs configurado, creando su tabla la primera vez."""
+    global _job_store
+
+    with _job_store_lock:
+        if _job_store is None:
+            settings = get_settings()
+            if settings.JOBS_BACKEND == "sqlite":
+                store = SQLiteJobStore(settings.JOBS_SQLITE_PATH)
+            else:
+                store = MSSQLJobStore(settings.JOBS_DATABASE or f"{settings.MSSQL_DATABASE}_JOBS")
+            store.ensure_table()
+            _job_store = store
+        return _job_store
@@ -1,37 +1,58 @@
 from typing import Annotated
-import uuid
 import threading
 import asyncio
-from datetime import datetime
+import json
+import time
 
-from fastapi import Depends, FastAPI, HTTPException, status, BackgroundTasks
+from fastapi import Depends, FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
 from auth import (
     LoginRequest,
     TokenData,
     TokenResponse,
-    create_access_token,
+    create_access_token_async,
     get_current_user,
-    logout as logout_session,
+    logout_async as logout_session,
 )
 from config import get_settings, get_modo_pruebas, set_modo_pruebas
 from database import (
     get_empresas_sap,
-    inicializa_sap_empresas,
     test_service_layer_all_instances,
     get_proveedores_sl,
-    enviar_correo_inicializacion,
     actualizar_sap_empresas,
     actualizar_sap_proveedores,
     analizar_actividad_proveedores,
-    get_mssql_connection,
-    insertar_configuracion_settings,
+    get_mssql_pool_stats,
+    dispose_mssql_pools,
+    get_hana_pool_stats,
+    dispose_hana_pool,
+    ensure_schema_ready,
+)
+from executors import get_executor_stats, run_blocking, shutdown_executors
+from inicializacion import inicializar_datos
+from jobs import (
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JOB_RUNNING,
+    WORKER_ID,
+    cancelar_suscripcion_job,
+    get_job_store,
+    suscribir_job,
+)
+from sap_service_layer import (
+    close_sl_http_clients,
+    get_sl_health,
+    get_sl_session_pool,
+    logout_sl_sessions,
+    start_sl_http_clients,
 )
 from session import (
-    get_active_sessions,
-    cleanup_expired_sessions,
-    invalidate_user_sessions,
+    cleanup_expired_sessions_async,
+    flush_session_activity_async,
+    get_active_sessions_async,
+    invalidate_user_sessions_async,
 )
 from mcp import router as mcp_router
 from utils import now as tz_now
@@ -58,8 +79,12 @@ app.include_router(mcp_router)
 from websettings import router as websettings_router
 app.include_router(websettings_router)
 
-# Variable global para controlar el task de limpieza
+# Variables globales para controlar las tareas de background
 cleanup_task = None
+session_flush_task = None
+job_dispatch_task = None
+# Despierta al despachador de jobs en cuanto se registra uno nuevo en este worker
+job_dispatch_event: asyncio.Event | None = None
 
 
 async def scheduled_cleanup():
@@ -73,79 +98,175 @@ async def scheduled_cleanup():
             await asyncio.sleep(3600)
 
             # Ejecutar limpieza de sesiones expiradas
-            deleted_sessions = cleanup_expired_sessions()
+            deleted_sessions = await cleanup_expired_sessions_async()
             print(f"[Cleanup] Sesiones expiradas eliminadas: {deleted_sessions}")
 
             # Ejecutar limpieza de jobs antiguos
-            deleted_jobs = cleanup_old_jobs()
+            deleted_jobs = await run_blocking("mssql", cleanup_old_jobs)
             print(f"[Cleanup] Jobs antiguos eliminados: {deleted_jobs}")
 
         except Exception as e:
             print(f"[Cleanup] Error en limpieza programada: {e}")
 
 
+async def scheduled_session_flush():
+    """
+    Tarea de background que escribe en USER_SESSIONS las renovaciones
+    de LastActivity acumuladas en el cache de sesiones.
+    """
+    interval = get_settings().SESSION_FLUSH_INTERVAL_SECONDS
+    while True:
+        try:
+            await asyncio.sleep(interval)
+            await flush_session_activity_async()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[SessionFlush] Error escribiendo renovaciones de sesión: {e}")
+
+
+def _despachar_jobs_pendientes() -> list[dict]:
+    """
+    Marca como fallidos los jobs huérfanos (sin latido) y reclama los jobs pendientes
+    que este worker puede ejecutar. Retorna los jobs reclamados.
+    """
+    settings = get_settings()
+    store = get_job_store()
+
+    recuperados = store.recuperar_huerfanos(settings.JOBS_STALE_SECONDS)
+    if recuperados:
+        print(f"[Jobs] Jobs interrumpidos marcados como fallidos: {recuperados}")
+
+    reclamados = []
+    while True:
+        job = store.reclamar_siguiente()
+        if job is None:
+            return reclamados
+        reclamados.append(job)
+
+
+def _ejecutar_job(job: dict) -> None:
+    """Ejecuta un job reclamado en un thread propio, renovando su latido mientras corre."""
+    store = get_job_store()
+    handler = JOB_HANDLERS.get(job["tipo"])
+    if handler is None:
+        store.fallar(job["job_id"], f"Tipo de job desconocido: {job['tipo']}")
+        return
+
+    print(f"[Jobs] {WORKER_ID} ejecuta {job['tipo']} {job['job_id']}")
+    with store.latiendo(job["job_id"], get_settings().JOBS_HEARTBEAT_SECONDS):
+        handler(job["job_id"], **job["params"])
+
+
+async def scheduled_job_dispatch():
+    """
+    Tarea de background que reclama jobs pendientes del almacén compartido
+    (de este o de cualquier otro worker) y los ejecuta en threads propios.
+    Se despierta cada JOBS_POLL_SECONDS o cuando este worker registra un job.
+    """
+    interval = get_settings().JOBS_POLL_SECONDS
+    while True:
+        try:
+            try:
+                await asyncio.wait_for(job_dispatch_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            job_dispatch_event.clear()
+
+            for job in await run_blocking("mssql", _despachar_jobs_pendientes):
+                threading.Thread(
+                    target=_ejecutar_job,
+                    args=(job,),
+                    name=f"job-{job['job_id'][:8]}",
+                    daemon=True
+                ).start()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Jobs] Error despachando jobs: {e}")
+
+
 @app.on_event("startup")
 async def startup_event():
     """Ejecuta tareas de inicialización al arrancar la aplicación."""
-    global cleanup_task
+    global cleanup_task, session_flush_task, job_dispatch_task, job_dispatch_event
+
+    # Verificar base de datos y tablas una sola vez por proceso
+    try:
+        await run_blocking("session", ensure_schema_ready)
+        print("[Startup] Esquema MSSQL verificado")
+    except Exception as e:
+        print(f"[Startup] No se pudo verificar el esquema MSSQL (se reintentará en la primera petición): {e}")
+
+    # Clientes HTTP de larga vida hacia Service Layer
+    start_sl_http_clients()
 
     # Limpiar sesiones expiradas al inicio
-    cleanup_expired_sessions()
+    await cleanup_expired_sessions_async()
 
     # Limpiar jobs antiguos al inicio
-    cleanup_old_jobs()
+    try:
+        await run_blocking("mssql", cleanup_old_jobs)
+    except Exception as e:
+        print(f"[Startup] No se pudo limpiar el almacén de jobs: {e}")
 
     # Iniciar tarea de limpieza programada (cada 1 hora)
     cleanup_task = asyncio.create_task(scheduled_cleanup())
     print("[Startup] Tarea de limpieza programada iniciada (cada 1 hora)")
 
+    # Iniciar escritura periódica de renovaciones de sesión
+    session_flush_task = asyncio.create_task(scheduled_session_flush())
+
+    # Iniciar el despachador de jobs (reclama jobs pendientes y recupera los huérfanos)
+    job_dispatch_event = asyncio.Event()
+    job_dispatch_event.set()
+    job_dispatch_task = asyncio.create_task(scheduled_job_dispatch())
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Ejecuta tareas de limpieza al apagar la aplicación."""
-    global cleanup_task
+    global cleanup_task, session_flush_task, job_dispatch_task
 
-    # Cancelar la tarea de limpieza programada
-    if cleanup_task:
-        cleanup_task.cancel()
-        try:
-            await cleanup_task
-        except asyncio.CancelledError:
-            pass
+    # Cancelar las tareas programadas
+    for task in (cleanup_task, session_flush_task, job_dispatch_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
 
     print("[Shutdown] Tarea de limpieza programada detenida")
 
+    # Escribir las últimas renovaciones de sesión pendientes
+    try:
+        await flush_session_activity_async()
+    except Exception as e:
+        print(f"[Shutdown] Error escribiendo renovaciones de sesión: {e}")
 
-# Diccionario global para almacenar el estado de los jobs de inicialización
-# job_id -> {status, progress, result, error, created_at, completed_at}
-initialization_jobs = {}
-jobs_lock = threading.Lock()
-
+    # Liberar las sesiones de Service Layer (consumen licencias)
+    try:
+        cerradas = await run_blocking("sl", logout_sl_sessions)
+        print(f"[Shutdown] Sesiones de Service Layer cerradas: {cerradas}")
+    except Exception as e:
+        print(f"[Shutdown] Error cerrando sesiones de Service Layer: {e}")
+    await close_sl_http_clients()
 
-def cleanup_old_jobs():
-    """
-    Elimina jobs completados o fallidos que tengan más de 24 horas.
-    Mantiene jobs en ejecución (running) y pendientes (pending) sin importar su antigüedad.
-    """
-    from datetime import timedelta
+    # Detener los executors de trabajo bloqueante
+    shutdown_executors()
 
-    now = tz_now()
-    with jobs_lock:
-        jobs_to_remove = []
-        for job_id, job_info in initialization_jobs.items():
-            # Solo limpiar jobs completados o fallidos
-            if job_info["status"] in ["completed", "failed"]:
-                created_at = job_info.get("created_at")
-                if created_at and isinstance(created_at, datetime):
-                    age = now - created_at
-                    if age > timedelta(hours=24):
-                        jobs_to_remove.append(job_id)
+    # Cerrar conexiones inactivas de los pools MSSQL y HANA
+    dispose_mssql_pools()
+    dispose_hana_pool()
 
-        # Eliminar jobs antiguos
-        for job_id in jobs_to_remove:
-            del initialization_jobs[job_id]
 
-        return len(jobs_to_remove)
+def cleanup_old_jobs() -> int:
+    """
+    Elimina del almacén de jobs los completados o fallidos que tengan más de
+    JOBS_RETENTION_HOURS horas. Mantiene jobs en ejecución (running) y pendientes (pending).
+    """
+    return get_job_store().limpiar(get_settings().JOBS_RETENTION_HOURS)
 
 
 @app.post("/auth/login", response_model=TokenResponse, tags=["Autenticación"])
@@ -160,7 +281,7 @@ async def login(request: LoginRequest) -> TokenResponse:
             "mcp:resources:read",
             "sql:adm"
         ]
-        token = create_access_token(subject=request.username, scopes=scopes)
+        token = await create_access_token_async(subject=request.username, scopes=scopes)
         return TokenResponse(access_token=token)
 
     raise HTTPException(
@@ -177,7 +298,7 @@ async def logout(
     """
     Cierra la sesión del usuario invalidando su token.
     """
-    success = logout_session(current_user.session_id)
+    success = await logout_session(current_user.session_id)
     if success:
         return {"message": "Sesión cerrada exitosamente"}
     return {"message": "Sesión no encontrada"}
@@ -191,7 +312,7 @@ async def list_sessions(
     Lista todas las sesiones activas del usuario actual.
     Útil para ver desde qué dispositivos/ubicaciones está conectado.
     """
-    sessions = get_active_sessions(username=current_user.sub)
+    sessions = await get_active_sessions_async(username=current_user.sub)
     return {
         "username": current_user.sub,
         "total_sessions": len(sessions),
@@ -207,7 +328,7 @@ async def logout_all(
     Cierra todas las sesiones del usuario actual.
     Útil para cerrar sesión en todos los dispositivos.
     """
-    count = invalidate_user_sessions(current_user.sub)
+    count = await invalidate_user_sessions_async(current_user.sub)
     return {
         "message": f"Se cerraron {count} sesiones",
         "sessions_closed": count
@@ -224,8 +345,8 @@ async def cleanup_sessions(
 
     Esta limpieza también se ejecuta automáticamente cada 1 hora en segundo plano.
     """
-    sessions_count = cleanup_expired_sessions()
-    jobs_count = cleanup_old_jobs()
+    sessions_count = await cleanup_expired_sessions_async()
+    jobs_count = await run_blocking("mssql", cleanup_old_jobs)
     return {
         "message": f"Se eliminaron {sessions_count} sesiones expiradas y {jobs_count} jobs antiguos",
         "sessions_cleaned": sessions_count,
@@ -240,6 +361,52 @@ async def health_check() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/executors", tags=["Sistema"])
+async def executors_status(
+    current_user: Annotated[TokenData, Depends(get_current_user)]
+) -> dict:
+    """
+    Métricas de los executors de trabajo bloqueante (threads en ejecución,
+    profundidad de cola, tiempos promedio), de los pools de conexiones MSSQL y HANA
+    y del pool de sesiones de Service Layer.
+    """
+    return {
+        "executors": get_executor_stats(),
+        "mssql_pools": get_mssql_pool_stats(),
+        "hana_pool": get_hana_pool_stats(),
+        "sl_sessions": get_sl_session_pool().stats()
+    }
+
+
+@app.get("/service_layer/salud", tags=["Sistema"])
+async def service_layer_salud(
+    current_user: Annotated[TokenData, Depends(get_current_user)]
+) -> dict:
+    """
+    Estado del circuit breaker de Service Layer por CompanyDB: estado (cerrado/abierto/semiabierto),
+    fallas consecutivas, último resultado y error, latencia de la última respuesta
+    y segundos para el siguiente intento si el circuito está abierto.
+    """
+    estados = get_sl_health().estados()
+    return {
+        "abiertos": sum(1 for estado in estados if estado["estado"] != "cerrado"),
+        "companias": estados
+    }
+
+
+@app.post("/service_layer/salud/reiniciar", tags=["Sistema"])
+async def service_layer_salud_reiniciar(
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    company_db: str | None = None
+) -> dict:
+    """
+    Cierra el circuito de una CompanyDB (o de todas si no se indica) para volver
+    a intentar Service Layer de inmediato.
+    """
+    get_sl_health().reiniciar(company_db)
+    return {"success": True, "company_db": company_db}
+
+
 @app.get("/me", tags=["Usuario"])
 async def get_me(
     current_user: Annotated[TokenData, Depends(get_current_user)]
@@ -247,11 +414,10 @@ async def get_me(
     """
     Retorna información completa del usuario autenticado y su sesión actual.
     """
-    from session import get_active_sessions
     from datetime import datetime, timedelta
 
     # Obtener información completa de la sesión desde la BD
-    sessions = get_active_sessions(username=current_user.sub)
+    sessions = await get_active_sessions_async(username=current_user.sub)
 
     # Buscar la sesión actual
     current_session = None
@@ -345,7 +511,7 @@ async def get_sesiones_config(
 async def empresas_registradas(
     current_user: Annotated[TokenData, Depends(get_current_user)]
 ) -> dict:
-    empresas = get_empresas_sap()
+    empresas = await run_blocking("hana", get_empresas_sap)
     return {
         "total": len(empresas),
         "empresas": empresas
@@ -353,101 +519,61 @@ async def empresas_registradas(
 
 
 def _run_inicializa_datos_background(job_id: str, session_id: str, username: str, scopes: list[str], anos: int = 0, email: str | None = None, modo: int = 0, s_activas: int = 2):
-    """Función que se ejecuta en background para inicializar datos."""
-    from database import get_mssql_connection
+    """
+    Inicializa los datos para un job reclamado del almacén de jobs.
+    Las etapas se ejecutan como grafo (inicializacion.py); el progreso por etapa e instancia,
+    el resultado y el error se guardan en el almacén, visible para todos los workers.
+    """
+    store = get_job_store()
 
     try:
-        # Actualizar estado: iniciando
-        with jobs_lock:
-            initialization_jobs[job_id]["status"] = "running"
-            initialization_jobs[job_id]["progress"] = "Iniciando eliminación y recreación de base de datos..."
-
-        # Ejecutar inicialización (esto eliminará y recreará la base de datos)
-        with jobs_lock:
-            initialization_jobs[job_id]["progress"] = "Creando tablas SAP_EMPRESAS, SAP_PROVEEDORES, USER_SESSIONS y SETTINGS..."
-        resultado_empresas = inicializa_sap_empresas()
-
-        # Insertar configuración en tabla SETTINGS
-        with jobs_lock:
-            initialization_jobs[job_id]["progress"] = "Guardando configuración en tabla SETTINGS..."
-        insertar_configuracion_settings(modo, s_activas, anos, email or get_settings().EMAIL_SUPERVISOR)
-
-        # Prueba Service Layer
-        with jobs_lock:
-            initialization_jobs[job_id]["progress"] = "Probando conexión a Service Layer (productivo y pruebas)..."
-        resultado_sl = test_service_layer_all_instances(sap_empresas_result=resultado_empresas, skip_email=True)
-
-        # Poblar SAP_PROVEEDORES
-        with jobs_lock:
-            initialization_jobs[job_id]["progress"] = "Poblando SAP_PROVEEDORES desde Service Layer..."
-        resultado_proveedores = actualizar_sap_proveedores()
-
-        # Analizar actividad de proveedores usando el parámetro anos
-        with jobs_lock:
-            initialization_jobs[job_id]["progress"] = f"Analizando actividad de proveedores (años={anos}) y creando tablas SAP_PROV_ACTIVOS/INACTIVOS..."
-        resultado_actividad = analizar_actividad_proveedores(anos=anos)
-
-        # Restaurar la sesión del usuario actual
-        with jobs_lock:
-            initialization_jobs[job_id]["progress"] = "Restaurando sesión del usuario..."
-        conn = get_mssql_connection()
-        cursor = conn.cursor()
-        try:
-            now = tz_now()
-            scopes_str = ",".join(scopes)
-            cursor.execute("""
-                INSERT INTO USER_SESSIONS (SessionID, Username, CreatedAt, LastActivity, Scopes)
-                VALUES (?, ?, ?, ?, ?)
-            """, (session_id, username, now, now, scopes_str))
-            conn.commit()
-        finally:
-            cursor.close()
-            conn.close()
-
-        # Enviar correo con todos los resultados
-        # Si se proporcionó un email diferente al configurado, usar ese
-        with jobs_lock:
-            initialization_jobs[job_id]["progress"] = "Enviando correo con resultados..."
-        from config import get_settings
-        settings = get_settings()
-        # Usar email del formulario solo si es diferente a EMAIL_SUPERVISOR
-        destinatario = email if (email and email != settings.EMAIL_SUPERVISOR) else settings.EMAIL_SUPERVISOR
-        if destinatario:
-            email_result = enviar_correo_inicializacion(
-                resultado_empresas,
-                resultado_sl,
-                resultado_proveedores,
-                resultado_actividad,
-                destinatario=destinatario
-            )
-        else:
-            email_result = {"success": False, "error": "No hay destinatario configurado"}
-
-        # Marcar como completado
-        with jobs_lock:
-            initialization_jobs[job_id]["status"] = "completed"
-            initialization_jobs[job_id]["progress"] = "Inicialización completada exitosamente"
-            initialization_jobs[job_id]["result"] = {
-                "sap_empresas": resultado_empresas,
-                "service_layer": resultado_sl,
-                "sap_proveedores": resultado_proveedores,
-                "analisis_actividad": resultado_actividad,
-                "email_enviado": email_result,
-                "session_restored": True
-            }
-            initialization_jobs[job_id]["finished_at"] = tz_now().isoformat()
+        # El job ya quedó en running al reclamarlo
+        store.progreso(job_id, "Iniciando eliminación y recreación de base de datos...")
+        resultado = inicializar_datos(
+            session_id,
+            username,
+            scopes,
+            anos=anos,
+            email=email,
+            modo=modo,
+            s_activas=s_activas,
+            reportar=lambda mensaje, etapas: store.progreso(job_id, mensaje, etapas)
+        )
+        store.completar(job_id, resultado, "Inicialización completada exitosamente")
 
     except Exception as e:
         # Marcar como fallido
-        with jobs_lock:
-            initialization_jobs[job_id]["status"] = "failed"
-            initialization_jobs[job_id]["error"] = str(e)
-            initialization_jobs[job_id]["finished_at"] = tz_now().isoformat()
+        store.fallar(job_id, str(e))
+
+
+def _estado_job(job_info: dict) -> dict:
+    """Estado público de un job (respuesta de /status y datos de los eventos del stream)."""
+    return {
+        "job_id": job_info["job_id"],
+        "status": job_info["status"],
+        "progress": job_info["progress"],
+        "etapas": job_info["etapas"],
+        "created_at": job_info["created_at"],
+        "started_at": job_info["started_at"] or job_info["created_at"],
+        "finished_at": job_info["finished_at"],
+        "owner": job_info["owner"],
+        "result": job_info["result"] if job_info["status"] == JOB_COMPLETED else None,
+        "error": job_info["error"] if job_info["status"] == JOB_FAILED else None
+    }
+
+
+def _evento_sse(evento: str, datos: dict) -> str:
+    return f"event: {evento}\ndata: {json.dumps(datos, default=str)}\n\n"
+
+
+# Funciones que ejecutan cada tipo de job: handler(job_id, **params)
+JOB_HANDLERS = {
+    "inicializa_datos": _run_inicializa_datos_background,
+}
 
 
 @app.post("/inicializa_datos", tags=["MSSQL"])
 async def inicializa_datos(
-    background_tasks: BackgroundTasks,
     current_user: Annotated[TokenData, Depends(get_current_user)],
     anos: int = 0,
     email: str | None = None,
@@ -478,46 +604,38 @@ async def inicializa_datos(
     9. Actualiza los campos SL y SLP en SAP_EMPRESAS (1=éxito, 0=fallo)
     10. Puebla SAP_PROVEEDORES con datos del Service Layer
 
+    Después de cargar SAP_EMPRESAS, cada instancia avanza por su cuenta (inicializacion.py):
+    su sincronización de proveedores empieza en cuanto responde su Service Layer y su
+    consulta de actividad en HANA corre en paralelo. El progreso por etapa e instancia
+    se consulta en el campo "etapas" del estado del job.
+
     NOTA: Este endpoint recrea la base de datos completa, por lo que la sesión
     del usuario se elimina y se vuelve a crear automáticamente.
     """
-    # Generar job_id único
-    job_id = str(uuid.uuid4())
-
     # Guardar información de la sesión actual
     session_id = current_user.session_id
     username = current_user.sub
     scopes = current_user.scopes
 
-    # Registrar job
-    with jobs_lock:
-        initialization_jobs[job_id] = {
-            "status": "pending",
-            "progress": "Trabajo en cola...",
-            "result": None,
-            "error": None,
-            "started_at": tz_now().isoformat(),
-            "finished_at": None
-        }
-
-    # Ejecutar en background
-    background_tasks.add_task(
-        _run_inicializa_datos_background,
-        job_id,
-        session_id,
-        username,
-        scopes,
-        anos,
-        email,
-        modo,
-        s_activas
-    )
+    # Registrar job en el almacén compartido; lo ejecuta el primer worker que lo reclame
+    params = {
+        "session_id": session_id,
+        "username": username,
+        "scopes": scopes,
+        "anos": anos,
+        "email": email,
+        "modo": modo,
+        "s_activas": s_activas
+    }
+    job_id = await run_blocking("mssql", lambda: get_job_store().crear("inicializa_datos", params))
+    job_dispatch_event.set()
 
     return {
         "job_id": job_id,
         "status": "pending",
         "message": "Inicialización iniciada. Use GET /inicializa_datos/status/{job_id} para consultar el progreso",
-        "status_url": f"/inicializa_datos/status/{job_id}"
+        "status_url": f"/inicializa_datos/status/{job_id}",
+        "stream_url": f"/inicializa_datos/stream/{job_id}"
     }
 
 
@@ -537,24 +655,89 @@ async def get_inicializa_datos_status(
     - completed: El trabajo terminó exitosamente
     - failed: El trabajo falló
     """
-    with jobs_lock:
-        if job_id not in initialization_jobs:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Job ID {job_id} no encontrado"
-            )
+    job_info = await run_blocking("mssql", lambda: get_job_store().obtener(job_id))
+    if job_info is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job ID {job_id} no encontrado"
+        )
 
-        job_info = initialization_jobs[job_id].copy()
+    return _estado_job(job_info)
 
-    return {
-        "job_id": job_id,
-        "status": job_info["status"],
-        "progress": job_info["progress"],
-        "started_at": job_info["started_at"],
-        "finished_at": job_info["finished_at"],
-        "result": job_info["result"] if job_info["status"] == "completed" else None,
-        "error": job_info["error"] if job_info["status"] == "failed" else None
-    }
+
+@app.get("/inicializa_datos/stream/{job_id}", tags=["MSSQL"])
+async def stream_inicializa_datos_status(
+    job_id: str,
+    request: Request
+) -> StreamingResponse:
+    """
+    Stream de Server-Sent Events con el estado de un trabajo de inicialización.
+
+    Envía un evento 'progreso' (mismo contenido que GET /inicializa_datos/status/{job_id})
+    cada vez que cambia el estado, el mensaje de progreso o el detalle por etapa, y cierra el stream cuando el
+    job termina (completed o failed). Si el job no existe envía 'no_encontrado' y cierra.
+
+    Si el job se ejecuta en este worker, sus cambios llegan al instante y no se relee el
+    almacén mientras tanto; si está pendiente o lo ejecuta otro worker se relee cada
+    JOBS_STREAM_POLL_SECONDS.
+    No requiere autenticación, igual que el endpoint de estado.
+    """
+    settings = get_settings()
+
+    async def eventos():
+        cambio = suscribir_job(job_id)
+        ultimo = None
+        ultimo_envio = time.monotonic()
+        try:
+            while True:
+                # Limpiar antes de leer: un aviso que llegue durante la lectura no se pierde
+                cambio.clear()
+                job_info = await run_blocking("mssql", lambda: get_job_store().obtener(job_id))
+                if job_info is None:
+                    yield _evento_sse("no_encontrado", {"job_id": job_id, "detail": f"Job ID {job_id} no encontrado"})
+                    return
+
+                clave = (job_info["status"], job_info["progress"], json.dumps(job_info["etapas"], default=str))
+                if clave != ultimo:
+                    ultimo = clave
+                    yield _evento_sse("progreso", _estado_job(job_info))
+                    ultimo_envio = time.monotonic()
+                    if job_info["status"] in (JOB_COMPLETED, JOB_FAILED):
+                        return
+
+                # Un job en ejecución en este worker avisa cada cambio por el evento: no se relee
+                # el almacén hasta el aviso (mientras tanto solo se envían pings). Como respaldo se
+                # relee tras JOBS_STALE_SECONDS, cuando otro worker podría marcarlo interrumpido.
+                # Los jobs pendientes o de otro worker se releen cada JOBS_STREAM_POLL_SECONDS.
+                if job_info["status"] == JOB_RUNNING and job_info["owner"] == WORKER_ID:
+                    releer_en = time.monotonic() + settings.JOBS_STALE_SECONDS
+                else:
+                    releer_en = time.monotonic() + settings.JOBS_STREAM_POLL_SECONDS
+                while True:
+                    if await request.is_disconnected():
+                        return
+                    ping_en = ultimo_envio + settings.JOBS_STREAM_KEEPALIVE_SECONDS
+                    try:
+                        await asyncio.wait_for(
+                            cambio.wait(),
+                            timeout=max(0.0, min(releer_en, ping_en) - time.monotonic())
+                        )
+                        break
+                    except asyncio.TimeoutError:
+                        pass
+                    if time.monotonic() >= releer_en:
+                        break
+                    # Comentario SSE: mantiene viva la conexión en proxies con timeout de inactividad
+                    yield ": ping\n\n"
+                    ultimo_envio = time.monotonic()
+        finally:
+            cancelar_suscripcion_job(job_id, cambio)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/inicializa_datos/jobs", tags=["MSSQL"])
@@ -562,22 +745,25 @@ async def list_initialization_jobs(
     current_user: Annotated[TokenData, Depends(get_current_user)]
 ) -> dict:
     """
-    Lista todos los jobs de inicialización almacenados en memoria.
-    Útil para administración y debugging.
-    """
-    with jobs_lock:
-        jobs_summary = []
-        for job_id, job_info in initialization_jobs.items():
-            jobs_summary.append({
-                "job_id": job_id,
-                "status": job_info["status"],
-                "created_at": job_info.get("created_at"),
-                "completed_at": job_info.get("completed_at")
-            })
+    Lista los jobs de inicialización del almacén de jobs (compartido por todos los workers),
+    del más reciente al más antiguo. Útil para administración y debugging.
+    """
+    jobs = await run_blocking("mssql", lambda: get_job_store().listar())
+    jobs_summary = [
+        {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "progress": job["progress"],
+            "owner": job["owner"],
+            "created_at": job["created_at"],
+            "completed_at": job["finished_at"]
+        }
+        for job in jobs
+    ]
 
     return {
         "total_jobs": len(jobs_summary),
-        "jobs": sorted(jobs_summary, key=lambda x: x.get("created_at") or datetime.min, reverse=True)
+        "jobs": jobs_summary
     }
 
 
@@ -586,9 +772,9 @@ async def cleanup_initialization_jobs(
     current_user: Annotated[TokenData, Depends(get_current_user)]
 ) -> dict:
     """
-    Limpia manualmente los jobs completados o fallidos que tengan más de 24 horas.
+    Limpia manualmente los jobs completados o fallidos que tengan más de JOBS_RETENTION_HOURS horas.
     """
-    removed = cleanup_old_jobs()
+    removed = await run_blocking("mssql", cleanup_old_jobs)
     return {
         "message": f"Limpieza completada. {removed} job(s) eliminado(s).",
         "jobs_removed": removed
@@ -606,12 +792,13 @@ async def actualizar_empresas(
     - Elimina empresas que ya no existen en HANA
     - Preserva el campo SL
     """
-    return actualizar_sap_empresas()
+    return await run_blocking("hana", actualizar_sap_empresas)
 
 
 @app.post("/actualizar_proveedores", tags=["MSSQL"])
 async def actualizar_proveedores(
-    current_user: Annotated[TokenData, Depends(get_current_user)]
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    completa: bool = False
 ) -> dict:
     """
     Actualiza SAP_PROVEEDORES con datos de SAP Service Layer (fuente de verdad).
@@ -619,18 +806,22 @@ async def actualizar_proveedores(
     - Inserta nuevos proveedores
     - Elimina proveedores que ya no existen en SAP
 
+    Por defecto es incremental: solo se descargan los proveedores modificados desde
+    la última sincronización de cada instancia (UpdateDate). completa=true fuerza
+    la reconciliación completa de todas las instancias.
+
     El modo (productivo/pruebas) se controla con el endpoint /pruebas/{valor}:
     - /pruebas/0: modo productivo (usa instancias normales)
     - /pruebas/1: modo pruebas (usa instancias con Prueba=1 y conecta a {instancia}_PRUEBAS)
     """
-    return actualizar_sap_proveedores()
+    return await run_blocking("sl", actualizar_sap_proveedores, completa=completa)
 
 
 @app.get("/test_service_layer", tags=["SAP Service Layer"])
 async def test_service_layer(
     current_user: Annotated[TokenData, Depends(get_current_user)]
 ) -> dict:
-    resultado = test_service_layer_all_instances()
+    resultado = await run_blocking("sl", test_service_layer_all_instances)
     return resultado
 
 
@@ -651,7 +842,9 @@ async def get_proveedores(
     - **card_name**: Filtra por nombre que contenga el valor (opcional)
     - **federal_tax_id**: Filtra por RFC que contenga el valor (opcional)
     """
-    resultado = get_proveedores_sl(
+    resultado = await run_blocking(
+        "sl",
+        get_proveedores_sl,
         instancia,
         top=top,
         card_code=card_code,
@@ -660,7 +853,10 @@ async def get_proveedores(
     )
     if not resultado["success"]:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
+            status_code=(
+                status.HTTP_503_SERVICE_UNAVAILABLE if resultado.get("circuito_abierto")
+                else status.HTTP_400_BAD_REQUEST
+            ),
             detail=resultado.get("error", "Error al obtener proveedores")
         )
     return {
@@ -673,7 +869,8 @@ async def get_proveedores(
 @app.post("/proveedores/analizar-actividad", tags=["Proveedores"])
 async def analizar_actividad_proveedores_endpoint(
     current_user: Annotated[TokenData, Depends(get_current_user)],
-    anos: int = 1
+    anos: int = 1,
+    completo: bool = False
 ) -> dict:
     """
     Analiza la actividad de proveedores y crea/actualiza las tablas SAP_PROV_ACTIVOS y SAP_PROV_INACTIVOS.
@@ -687,6 +884,10 @@ async def analizar_actividad_proveedores_endpoint(
     - **2**: Año actual + 2 años anteriores (3 años en total: 2024-2026)
     - **N**: Año actual + N años anteriores
 
+    **Parámetro `completo`:**
+    - **false**: Solo se leen en HANA los documentos nuevos desde el último análisis [DEFAULT]
+    - **true**: Se vuelven a escanear todos los documentos del período
+
     **Proceso ejecutado:**
     1. Consulta transacciones OPCH y OPOR en SAP HANA para cada instancia
     2. Identifica proveedores con actividad en el período especificado
@@ -718,10 +919,13 @@ async def analizar_actividad_proveedores_endpoint(
 
     # Analizar últimos 3 años
     POST /proveedores/analizar-actividad?anos=2
+
+    # Volver a escanear todo el período
+    POST /proveedores/analizar-actividad?completo=true
     ```
     """
     try:
-        resultado = analizar_actividad_proveedores(anos=anos)
+        resultado = await run_blocking("hana", analizar_actividad_proveedores, anos=anos, completo=completo)
 
         if not resultado.get("success"):
             raise HTTPException(
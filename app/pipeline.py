@@ -0,0 +1,224 @@
+"""
+Ejecutor de un grafo de etapas (DAG) sobre un pool de threads.
+Cada etapa se inicia en cuanto terminan sus dependencias, sin esperar a que termine
+toda una fase: por ejemplo, la sincronización de proveedores de una instancia empieza
+apenas se probó su Service Layer, mientras otras instancias siguen en pruebas.
+
+- requiere: etapas que deben completarse con éxito; si alguna falla o se omite,
+  la etapa se omite también.
+- despues_de: etapas que solo deben haber terminado, con cualquier resultado
+  (la etapa decide qué hacer con una entrada fallida).
+- recurso: nombre de un cupo compartido (por ejemplo "hana"); el grafo no ejecuta más
+  etapas simultáneas de un recurso que su límite.
+
+Las etapas pueden agregar otras etapas mientras el grafo se ejecuta (para crear las
+etapas por instancia cuando ya se conocen las instancias).
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable
+
+# Estados de una etapa
+ETAPA_PENDIENTE = "pendiente"
+ETAPA_EN_EJECUCION = "en_ejecucion"
+ETAPA_COMPLETADA = "completada"
+ETAPA_FALLIDA = "fallida"
+ETAPA_OMITIDA = "omitida"
+
+ESTADOS_TERMINALES = (ETAPA_COMPLETADA, ETAPA_FALLIDA, ETAPA_OMITIDA)
+
+
+class EtapaOmitida(Exception):
+    """La función de una etapa la lanza para terminarla como omitida (por ejemplo, sin Service Layer)."""
+
+    def __init__(self, motivo: str):
+        self.motivo = motivo
+        super().__init__(motivo)
+
+
+class Etapa:
+    """
+    Nodo del grafo. 'grupo' e 'instancia' solo sirven para reportar el progreso
+    (por ejemplo grupo "proveedores", instancia "EMPRESA1").
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        funcion: Callable[[dict[str, "Etapa"]], Any],
+        requiere: tuple[str, ...] = (),
+        despues_de: tuple[str, ...] = (),
+        recurso: str | None = None,
+        grupo: str | None = None,
+        instancia: str | None = None
+    ):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.requiere = tuple(requiere)
+        self.despues_de = tuple(despues_de)
+        self.recurso = recurso
+        self.grupo = grupo or nombre
+        self.instancia = instancia
+        self.estado = ETAPA_PENDIENTE
+        self.resultado: Any = None
+        self.error: str | None = None
+        self.inicio: float | None = None
+        self.fin: float | None = None
+
+    @property
+    def segundos(self) -> float | None:
+        if self.inicio is None:
+            return None
+        return round((self.fin or time.perf_counter()) - self.inicio, 2)
+
+
+class GrafoEtapas:
+    """
+    Ejecuta las etapas agregadas con agregar() respetando dependencias y cupos por recurso.
+    al_cambiar(etapa) se llama (desde el thread que ejecuta el grafo) cada vez que una
+    etapa cambia de estado, para reportar el progreso.
+    """
+
+    def __init__(
+        self,
+        limites: dict[str, int] | None = None,
+        max_workers: int = 8,
+        al_cambiar: Callable[[Etapa], None] | None = None
+    ):
+        self.limites = {recurso: max(1, limite) for recurso, limite in (limites or {}).items()}
+        self.max_workers = max(1, max_workers)
+        self.al_cambiar = al_cambiar
+        self.etapas: dict[str, Etapa] = {}
+        self._lock = threading.Lock()
+        self._en_uso: dict[str, int] = {}
+
+    def agregar(
+        self,
+        nombre: str,
+        funcion: Callable[[dict[str, Etapa]], Any],
+        requiere: tuple[str, ...] | list[str] = (),
+        despues_de: tuple[str, ...] | list[str] = (),
+        recurso: str | None = None,
+        grupo: str | None = None,
+        instancia: str | None = None
+    ) -> None:
+        """
+        Agrega una etapa. funcion recibe {nombre: Etapa} de sus dependencias y su retorno
+        queda en etapa.resultado. Se puede llamar desde una etapa en ejecución.
+        """
+        with self._lock:
+            if nombre in self.etapas:
+                raise ValueError(f"La etapa {nombre} ya existe")
+            self.etapas[nombre] = Etapa(nombre, funcion, tuple(requiere), tuple(despues_de), recurso, grupo, instancia)
+
+    def instantanea(self) -> list[Etapa]:
+        """Etapas actuales (copia de la lista, segura mientras otras etapas agregan más)."""
+        with self._lock:
+            return list(self.etapas.values())
+
+    def _notificar(self, etapa: Etapa) -> None:
+        if self.al_cambiar is None:
+            return
+        try:
+            self.al_cambiar(etapa)
+        except Exception as e:
+            print(f"[Pipeline] Error reportando progreso de {etapa.nombre}: {e}")
+
+    def _terminar(self, etapa: Etapa, estado: str, resultado: Any = None, error: str | None = None) -> None:
+        etapa.estado = estado
+        etapa.resultado = resultado
+        etapa.error = error
+        etapa.fin = time.perf_counter()
+
+    def _clasificar_pendientes(self) -> tuple[list[Etapa], list[tuple[Etapa, Etapa]]]:
+        """
+        Retorna (etapas listas para ejecutarse, [(etapa a omitir, dependencia que falló)]). Requiere el lock.
+        Una dependencia que todavía no existe se espera: otra etapa puede agregarla.
+        """
+        listas = []
+        omitidas = []
+        for etapa in self.etapas.values():
+            if etapa.estado != ETAPA_PENDIENTE:
+                continue
+            dependencias = [self.etapas.get(nombre) for nombre in etapa.requiere + etapa.despues_de]
+            if any(dep is None or dep.estado not in ESTADOS_TERMINALES for dep in dependencias):
+                fallida = next(
+                    (self.etapas[n] for n in etapa.requiere
+                     if n in self.etapas and self.etapas[n].estado in (ETAPA_FALLIDA, ETAPA_OMITIDA)),
+                    None
+                )
+                if fallida is not None:
+                    omitidas.append((etapa, fallida))
+                continue
+            fallida = next(
+                (self.etapas[n] for n in etapa.requiere if self.etapas[n].estado != ETAPA_COMPLETADA),
+                None
+            )
+            if fallida is not None:
+                omitidas.append((etapa, fallida))
+            else:
+                listas.append(etapa)
+        return listas, omitidas
+
+    def _ejecutar_etapa(self, etapa: Etapa) -> Any:
+        entradas = {nombre: self.etapas[nombre] for nombre in etapa.requiere + etapa.despues_de}
+        return etapa.funcion(entradas)
+
+    def ejecutar(self) -> dict[str, Etapa]:
+        """Ejecuta el grafo hasta que todas las etapas terminen. Retorna {nombre: Etapa}."""
+        en_curso = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pipeline") as executor:
+            while True:
+                cambios = []
+                with self._lock:
+                    # Omitir en cascada las etapas cuya dependencia requerida falló
+                    while True:
+                        listas, omitidas = self._clasificar_pendientes()
+                        if not omitidas:
+                            break
+                        for etapa, dependencia in omitidas:
+                            self._terminar(etapa, ETAPA_OMITIDA, error=f"Requiere {dependencia.nombre} ({dependencia.estado})")
+                            cambios.append(etapa)
+
+                    for etapa in listas:
+                        if etapa.recurso is not None:
+                            en_uso = self._en_uso.get(etapa.recurso, 0)
+                            if en_uso >= self.limites.get(etapa.recurso, en_uso + 1):
+                                continue
+                            self._en_uso[etapa.recurso] = en_uso + 1
+                        etapa.estado = ETAPA_EN_EJECUCION
+                        etapa.inicio = time.perf_counter()
+                        en_curso[executor.submit(self._ejecutar_etapa, etapa)] = etapa
+                        cambios.append(etapa)
+
+                    if not en_curso:
+                        # Nada en ejecución ni listo: las pendientes que quedan dependen de etapas
+                        # que nunca se agregaron (o forman un ciclo)
+                        for etapa in self.etapas.values():
+                            if etapa.estado == ETAPA_PENDIENTE:
+                                self._terminar(etapa, ETAPA_FALLIDA, error="Dependencias sin resolver")
+                                cambios.append(etapa)
+
+                for etapa in cambios:
+                    self._notificar(etapa)
+
+                if not en_curso:
+                    break
+
+                terminadas, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                for future in terminadas:
+                    etapa = en_curso.pop(future)
+                    with self._lock:
+                        if etapa.recurso is not None:
+                            self._en_uso[etapa.recurso] -= 1
+                        try:
+                            self._terminar(etapa, ETAPA_COMPLETADA, resultado=future.result())
+                        except EtapaOmitida as e:
+                            self._terminar(etapa, ETAPA_OMITIDA, error=e.motivo)
+                        except Exception as e:
+                            self._terminar(etapa, ETAPA_FALLIDA, error=str(e))
+                    self._notificar(etapa)
+
+        return self.etapas
@@ -0,0 +1,289 @@
+"""
+Pool genérico de conexiones para drivers DB-API síncronos (pyodbc, hdbcli).
+Mantiene un número acotado de conexiones abiertas, las valida antes de
+entregarlas y descarta las que superan su tiempo de vida o de inactividad.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable
+
+
+class PoolTimeoutError(Exception):
+    """Se lanza cuando no se obtiene una conexión del pool dentro del tiempo de espera."""
+
+
+class _PoolEntry:
+    """Conexión física junto con sus marcas de tiempo."""
+
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn: Any):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class PooledConnection:
+    """
+    Envoltura de una conexión del pool.
+    Delega todos los atributos a la conexión real; close() la devuelve al pool
+    en lugar de cerrarla, de modo que el código existente que hace conn.close()
+    sigue funcionando sin cambios.
+    """
+
+    def __init__(self, pool: "ConnectionPool", entry: _PoolEntry):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_entry", entry)
+
+    def __getattr__(self, name: str) -> Any:
+        entry = object.__getattribute__(self, "_entry")
+        if entry is None:
+            raise RuntimeError("La conexión ya fue devuelta al pool")
+        return getattr(entry.conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        entry = object.__getattribute__(self, "_entry")
+        if entry is None:
+            raise RuntimeError("La conexión ya fue devuelta al pool")
+        setattr(entry.conn, name, value)
+
+    def close(self, discard: bool = False) -> None:
+        """Devuelve la conexión al pool (o la descarta si discard=True)."""
+        entry = object.__getattribute__(self, "_entry")
+        if entry is None:
+            return
+        object.__setattr__(self, "_entry", None)
+        object.__getattribute__(self, "_pool")._release(entry, discard=discard)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Pool acotado de conexiones.
+
+    Args:
+        name: Nombre descriptivo (para métricas y mensajes de error)
+        factory: Función que abre una conexión nueva
+        ping: Función que valida una conexión (lanza excepción si está rota)
+        reset: Función que deja la conexión en estado limpio al devolverla
+        max_size: Número máximo de conexiones abiertas (en uso + inactivas)
+        timeout: Segundos máximos de espera por una conexión libre
+        max_lifetime: Segundos máximos de vida de una conexión física
+        max_idle: Segundos máximos que una conexión puede estar inactiva
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        ping: Callable[[Any], None] | None = None,
+        reset: Callable[[Any], None] | None = None,
+        max_size: int = 10,
+        timeout: float = 30.0,
+        max_lifetime: float = 1800.0,
+        max_idle: float = 300.0
+    ):
+        self.name = name
+        self._factory = factory
+        self._ping = ping
+        self._reset = reset
+        self._max_size = max_size
+        self._timeout = timeout
+        self._max_lifetime = max_lifetime
+        self._max_idle = max_idle
+
+        self._idle: deque[_PoolEntry] = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Métricas
+        self._created = 0
+        self._discarded = 0
+        self._waits = 0
+
+    def _expired(self, entry: _PoolEntry, now: float) -> bool:
+        return (
+            now - entry.created_at > self._max_lifetime
+            or now - entry.last_used > self._max_idle
+        )
+
+    @staticmethod
+    def _close_quietly(entries: list[_PoolEntry]) -> None:
+        """
+        Cierra conexiones ya retiradas del pool (y contadas en _discarded). Se llama sin el
+        lock: cerrar una conexión TCP/TLS muerta puede tardar y bloquearía a los demás threads.
+        """
+        for entry in entries:
+            try:
+                entry.conn.close()
+            except Exception:
+                pass
+
+    def _reap_idle(self) -> list[_PoolEntry]:
+        """
+        Retira las conexiones inactivas que excedieron su tiempo de vida y las retorna
+        para cerrarlas fuera del lock. Requiere el lock.
+        """
+        now = time.monotonic()
+        vigentes = deque()
+        expiradas = []
+        while self._idle:
+            entry = self._idle.popleft()
+            if self._expired(entry, now):
+                expiradas.append(entry)
+            else:
+                vigentes.append(entry)
+        self._idle = vigentes
+        self._discarded += len(expiradas)
+        return expiradas
+
+    def _checkout(self, deadline: float) -> _PoolEntry | None:
+        """
+        Reserva un lugar en el pool. Retorna una conexión inactiva si la hay,
+        o None si el llamador debe abrir una nueva.
+        """
+        expiradas = []
+        try:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError(f"El pool {self.name} está cerrado")
+
+                    expiradas.extend(self._reap_idle())
+
+                    if self._idle:
+                        # LIFO: la conexión usada más recientemente es la que menos
+                        # probablemente haya sido cerrada por el servidor
+                        entry = self._idle.pop()
+                        self._in_use += 1
+                        return entry
+
+                    if self._in_use < self._max_size:
+                        self._in_use += 1
+                        return None
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"Tiempo de espera agotado ({self._timeout}s) esperando conexión del pool {self.name}"
+                        )
+                    self._waits += 1
+                    self._cond.wait(remaining)
+        finally:
+            self._close_quietly(expiradas)
+
+    def _give_back_slot(self) -> None:
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    def _discard_checked_out(self, entry: _PoolEntry) -> None:
+        """
+        Descarta una conexión reservada: libera su lugar bajo el lock y la cierra
+        fuera de él (cerrar una conexión rota puede tardar).
+        """
+        with self._cond:
+            self._in_use -= 1
+            self._discarded += 1
+            self._cond.notify()
+        self._close_quietly([entry])
+
+    def acquire(self) -> PooledConnection:
+        """
+        Obtiene una conexión validada del pool.
+        Si la conexión inactiva falla el ping se descarta y se vuelve a reservar
+        un lugar (otra conexión inactiva o una nueva).
+        """
+        deadline = time.monotonic() + self._timeout
+        while True:
+            entry = self._checkout(deadline)
+            if entry is None or self._ping is None:
+                break
+            try:
+                self._ping(entry.conn)
+                break
+            except Exception:
+                self._discard_checked_out(entry)
+            except BaseException:
+                self._discard_checked_out(entry)
+                raise
+
+        try:
+            if entry is None:
+                entry = _PoolEntry(self._factory())
+                with self._cond:
+                    self._created += 1
+        except BaseException:
+            self._give_back_slot()
+            raise
+
+        return PooledConnection(self, entry)
+
+    def _release(self, entry: _PoolEntry, discard: bool = False) -> None:
+        if not discard and self._reset is not None:
+            try:
+                self._reset(entry.conn)
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            now = time.monotonic()
+            if discard or self._closed or now - entry.created_at > self._max_lifetime:
+                self._discarded += 1
+            else:
+                entry.last_used = now
+                self._idle.append(entry)
+                entry = None
+            self._cond.notify()
+        if entry is not None:
+            self._close_quietly([entry])
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager que entrega una conexión y la devuelve al pool al salir.
+        Si el bloque lanza una excepción, la conexión se devuelve igualmente;
+        reset() se encarga de hacer rollback de la transacción pendiente.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def dispose(self) -> None:
+        """Cierra todas las conexiones inactivas. Las que están en uso se cierran al devolverse."""
+        with self._cond:
+            inactivas = list(self._idle)
+            self._idle.clear()
+            self._discarded += len(inactivas)
+        self._close_quietly(inactivas)
+
+    def close(self) -> None:
+        """Cierra el pool definitivamente."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.dispose()
+
+    def stats(self) -> dict:
+        """Retorna métricas del pool."""
+        with self._cond:
+            return {
+                "nombre": self.name,
+                "max_size": self._max_size,
+                "en_uso": self._in_use,
+                "inactivas": len(self._idle),
+                "creadas": self._created,
+                "descartadas": self._discarded,
+                "esperas": self._waits
+            }
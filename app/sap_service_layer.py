@@ -1,38 +1,786 @@
+import asyncio
+import concurrent.futures
+import math
+import threading
+import time
+from datetime import datetime
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Any, Awaitable, Callable, Iterator
+from urllib.parse import urljoin
+
 import httpx
 from config import get_settings
 
+try:
+    import h2  # noqa: F401  (httpx[http2])
+    HTTP2_DISPONIBLE = True
+except ImportError:
+    HTTP2_DISPONIBLE = False
+
+
+class ServiceLayerLoginError(Exception):
+    """Error al iniciar sesión en Service Layer para una CompanyDB."""
+
+    def __init__(self, company_db: str, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.company_db = company_db
+        self.message = message
+        self.status_code = status_code
+
+
+def sl_error_message(response: httpx.Response) -> str:
+    """Extrae el mensaje de error de una respuesta de Service Layer."""
+    error_msg = response.text
+    try:
+        error_json = response.json()
+        error_msg = error_json.get("error", {}).get("message", {}).get("value", response.text)
+    except Exception:
+        pass
+    return error_msg
+
+
+class ServiceLayerRequestError(Exception):
+    """Error de una petición a Service Layer (después de agotar los reintentos)."""
+
+    def __init__(self, company_db: str, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.company_db = company_db
+        self.message = message
+        self.status_code = status_code
+
+
+class ServiceLayerCircuitOpenError(ServiceLayerLoginError):
+    """
+    El circuito de la CompanyDB está abierto: Service Layer falló varias veces seguidas
+    y no se vuelve a intentar hasta que pase el tiempo de espera.
+    """
+
+
+# Estados del circuito por CompanyDB
+CIRCUITO_CERRADO = "cerrado"
+CIRCUITO_ABIERTO = "abierto"
+CIRCUITO_SEMIABIERTO = "semiabierto"
+
+
+class ServiceLayerHealthRegistry:
+    """
+    Registro de salud de Service Layer por CompanyDB con circuit breaker.
+
+    - cerrado: las peticiones pasan; cada falla de servicio (error de red, timeout o 5xx)
+      suma a fallos_consecutivos y una respuesta válida los reinicia.
+    - abierto: después de max_fallos fallas seguidas las peticiones se rechazan de inmediato
+      con ServiceLayerCircuitOpenError durante espera_segundos.
+    - semiabierto: pasada la espera se deja pasar una sola petición de prueba; si responde
+      el circuito se cierra y si falla se vuelve a abrir.
+
+    Un login rechazado por credenciales (4xx) no cuenta como falla: Service Layer respondió.
+    """
+
+    def __init__(self, max_fallos: int = 3, espera_segundos: float = 120.0):
+        self._max_fallos = max(1, max_fallos)
+        self._espera = espera_segundos
+        self._estados: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _estado(self, company_db: str) -> dict:
+        """Retorna (creándolo) el estado de una CompanyDB. Requiere el lock."""
+        estado = self._estados.get(company_db)
+        if estado is None:
+            estado = {
+                "estado": CIRCUITO_CERRADO,
+                "fallos_consecutivos": 0,
+                "ultimo_resultado": None,
+                "ultimo_error": None,
+                "latencia_ms": None,
+                "ultima_respuesta": None,
+                "abierto_desde": None,
+                "reintento_en": 0.0,
+                "prueba_en_curso": False
+            }
+            self._estados[company_db] = estado
+        return estado
+
+    def disponible(self, company_db: str) -> bool:
+        """True si una petición a la CompanyDB no sería rechazada (no modifica el estado)."""
+        with self._lock:
+            estado = self._estados.get(company_db)
+            if estado is None or estado["estado"] == CIRCUITO_CERRADO:
+                return True
+            return time.monotonic() >= estado["reintento_en"]
+
+    def verificar(self, company_db: str) -> None:
+        """
+        Autoriza una petición a la CompanyDB. Con el circuito abierto lanza
+        ServiceLayerCircuitOpenError; pasada la espera lo deja semiabierto y autoriza
+        una sola petición de prueba.
+        """
+        with self._lock:
+            estado = self._estado(company_db)
+            if estado["estado"] == CIRCUITO_CERRADO:
+                return
+
+            ahora = time.monotonic()
+            if ahora >= estado["reintento_en"]:
+                # Si la prueba anterior nunca reportó resultado, se permite otra
+                estado["estado"] = CIRCUITO_SEMIABIERTO
+                estado["prueba_en_curso"] = True
+                estado["reintento_en"] = ahora + self._espera
+                return
+
+            segundos = max(0, round(estado["reintento_en"] - ahora))
+            raise ServiceLayerCircuitOpenError(
+                company_db,
+                f"Service Layer no disponible para {company_db} ({estado['ultimo_error']}); "
+                f"circuito abierto, se reintentará en {segundos} s"
+            )
+
+    def registrar_exito(self, company_db: str, segundos: float) -> None:
+        """Registra una respuesta válida de Service Layer y cierra el circuito."""
+        with self._lock:
+            estado = self._estado(company_db)
+            estado.update({
+                "estado": CIRCUITO_CERRADO,
+                "fallos_consecutivos": 0,
+                "ultimo_resultado": "ok",
+                "latencia_ms": round(segundos * 1000, 1),
+                "ultima_respuesta": datetime.now().isoformat(timespec="seconds"),
+                "abierto_desde": None,
+                "reintento_en": 0.0,
+                "prueba_en_curso": False
+            })
+
+    def registrar_fallo(self, company_db: str, error: str, segundos: float) -> None:
+        """Registra una falla de servicio; abre el circuito al llegar a max_fallos (o si era la prueba)."""
+        with self._lock:
+            estado = self._estado(company_db)
+            estado["fallos_consecutivos"] += 1
+            estado["ultimo_resultado"] = "error"
+            estado["ultimo_error"] = error
+            estado["latencia_ms"] = round(segundos * 1000, 1)
+            estado["prueba_en_curso"] = False
+
+            if estado["estado"] == CIRCUITO_SEMIABIERTO or estado["fallos_consecutivos"] >= self._max_fallos:
+                if estado["estado"] != CIRCUITO_ABIERTO:
+                    estado["abierto_desde"] = datetime.now().isoformat(timespec="seconds")
+                    print(f"[SL] {company_db}: circuito abierto tras {estado['fallos_consecutivos']} fallas ({error})")
+                estado["estado"] = CIRCUITO_ABIERTO
+                estado["reintento_en"] = time.monotonic() + self._espera
+
+    def registrar_respuesta(self, company_db: str, response: httpx.Response, segundos: float) -> None:
+        """Registra una respuesta HTTP: 5xx cuenta como falla, cualquier otra como éxito."""
+        if response.status_code >= 500:
+            self.registrar_fallo(company_db, f"HTTP {response.status_code}", segundos)
+        else:
+            self.registrar_exito(company_db, segundos)
+
+    def estados(self) -> list[dict]:
+        """Estado del circuito de cada CompanyDB (para el endpoint de administración)."""
+        ahora = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "company_db": company_db,
+                    "estado": estado["estado"],
+                    "fallos_consecutivos": estado["fallos_consecutivos"],
+                    "ultimo_resultado": estado["ultimo_resultado"],
+                    "ultimo_error": estado["ultimo_error"],
+                    "latencia_ms": estado["latencia_ms"],
+                    "ultima_respuesta": estado["ultima_respuesta"],
+                    "abierto_desde": estado["abierto_desde"],
+                    "reintento_en_segundos": (
+                        max(0, round(estado["reintento_en"] - ahora))
+                        if estado["estado"] != CIRCUITO_CERRADO else None
+                    )
+                }
+                for company_db, estado in sorted(self._estados.items())
+            ]
+
+    def reiniciar(self, company_db: str | None = None) -> None:
+        """Olvida el estado de una CompanyDB (o de todas) y cierra su circuito."""
+        with self._lock:
+            if company_db is None:
+                self._estados.clear()
+            else:
+                self._estados.pop(company_db, None)
+
+
+class ServiceLayerSession:
+    """Sesión B1SESSION activa para una CompanyDB."""
+
+    __slots__ = ("company_db", "session_id", "cookies", "timeout_seconds", "last_used")
+
+    def __init__(self, company_db: str, session_id: str, cookies: dict, timeout_seconds: float):
+        self.company_db = company_db
+        self.session_id = session_id
+        self.cookies = cookies
+        self.timeout_seconds = timeout_seconds
+        self.last_used = time.monotonic()
+
+    @property
+    def cookie_header(self) -> str:
+        return "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+
+
+class ServiceLayerSessionPool:
+    """
+    Pool de sesiones de Service Layer, una por CompanyDB.
+
+    - Reutiliza la sesión mientras no haya vencido el SessionTimeout de Service Layer
+      (cada petición lo renueva, igual que en el servidor).
+    - Si una petición responde 401, descarta la sesión, vuelve a hacer login y reintenta una vez.
+    - Los logins de una misma CompanyDB se serializan para no consumir licencias de más:
+      hay a lo sumo un login en curso por CompanyDB, compartido por threads y corrutinas
+      (de cualquier event loop, incluido el temporal de run_sl_async).
+    - logout_all() libera todas las sesiones (al apagar la aplicación).
+    - Cada login y petición pasa por el registro de salud (salud): con el circuito
+      abierto se rechaza de inmediato en lugar de esperar el timeout.
+    """
+
+    # Margen para no reutilizar una sesión que está a punto de expirar en el servidor
+    EXPIRY_MARGIN_SECONDS = 60
+
+    def __init__(
+        self,
+        base_url: str,
+        username: str | None,
+        password: str | None,
+        session_timeout_minutes: int = 30,
+        salud: ServiceLayerHealthRegistry | None = None
+    ):
+        self.salud = salud or ServiceLayerHealthRegistry()
+        self._base_url = base_url.rstrip("/") + "/"
+        self._username = username
+        self._password = password
+        self._default_timeout_seconds = session_timeout_minutes * 60
+        self._sessions: dict[str, ServiceLayerSession] = {}
+        self._lock = threading.Lock()
+        self._logins_en_curso: dict[str, concurrent.futures.Future] = {}
+        self._logins = 0
+        self._reused = 0
+
+    def url(self, path: str) -> str:
+        """Construye la URL absoluta de un recurso de Service Layer."""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return self._base_url + path.lstrip("/")
+
+    # --- Gestión de sesiones en memoria ---
+
+    def _fresh_session(self, company_db: str) -> ServiceLayerSession | None:
+        with self._lock:
+            session = self._sessions.get(company_db)
+            if session is None:
+                return None
+            idle = time.monotonic() - session.last_used
+            if idle > session.timeout_seconds - self.EXPIRY_MARGIN_SECONDS:
+                del self._sessions[company_db]
+                return None
+            return session
+
+    def _store(self, session: ServiceLayerSession) -> None:
+        with self._lock:
+            self._sessions[session.company_db] = session
+            self._logins += 1
+
+    def _touch(self, session: ServiceLayerSession) -> None:
+        session.last_used = time.monotonic()
+
+    def invalidate(self, company_db: str, session: ServiceLayerSession | None = None) -> None:
+        """Descarta la sesión de una CompanyDB (solo si sigue siendo la indicada)."""
+        with self._lock:
+            actual = self._sessions.get(company_db)
+            if actual is not None and (session is None or actual is session):
+                del self._sessions[company_db]
+
+    def _login_payload(self, company_db: str) -> dict:
+        return {
+            "CompanyDB": company_db,
+            "UserName": self._username,
+            "Password": self._password
+        }
+
+    def _session_from_login(self, company_db: str, response: httpx.Response) -> ServiceLayerSession:
+        if response.status_code != 200:
+            raise ServiceLayerLoginError(company_db, sl_error_message(response), response.status_code)
+
+        cookies = dict(response.cookies.items())
+        session_id = cookies.get("B1SESSION")
+        timeout_seconds = self._default_timeout_seconds
+        try:
+            data = response.json()
+            session_id = session_id or data.get("SessionId")
+            if data.get("SessionTimeout"):
+                timeout_seconds = int(data["SessionTimeout"]) * 60
+        except Exception:
+            pass
+
+        if not session_id:
+            raise ServiceLayerLoginError(company_db, "Service Layer no devolvió B1SESSION", response.status_code)
+        cookies.setdefault("B1SESSION", session_id)
+
+        return ServiceLayerSession(company_db, session_id, cookies, timeout_seconds)
+
+    # --- API síncrona (httpx.Client) ---
+
+    def _send(self, client: httpx.Client, company_db: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """Envía una petición pasando por el circuit breaker de la CompanyDB."""
+        self.salud.verificar(company_db)
+        inicio = time.monotonic()
+        try:
+            response = client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            self.salud.registrar_fallo(company_db, f"Error de conexión: {str(e) or type(e).__name__}", time.monotonic() - inicio)
+            raise
+        self.salud.registrar_respuesta(company_db, response, time.monotonic() - inicio)
+        return response
+
+    def _iniciar_login(self, company_db: str) -> tuple[concurrent.futures.Future, bool]:
+        """
+        Retorna (login en curso de la CompanyDB, True si le toca a este llamador hacerlo).
+        El futuro solo avisa que el login terminó (con o sin éxito); no es de ningún event loop.
+        """
+        with self._lock:
+            en_curso = self._logins_en_curso.get(company_db)
+            if en_curso is not None:
+                return en_curso, False
+            en_curso = concurrent.futures.Future()
+            self._logins_en_curso[company_db] = en_curso
+            return en_curso, True
+
+    def _terminar_login(self, company_db: str, en_curso: concurrent.futures.Future) -> None:
+        with self._lock:
+            self._logins_en_curso.pop(company_db, None)
+        en_curso.set_result(None)
+
+    def get_session(self, client: httpx.Client, company_db: str, force_login: bool = False) -> ServiceLayerSession:
+        """
+        Retorna una sesión vigente para la CompanyDB, haciendo login solo si es necesario.
+        Lanza ServiceLayerLoginError si el login falla.
+        """
+        while True:
+            if not force_login:
+                session = self._fresh_session(company_db)
+                if session is not None:
+                    self._reused += 1
+                    return session
+
+            en_curso, propio = self._iniciar_login(company_db)
+            if not propio:
+                # Otro thread o corrutina está haciendo login: esperar y usar su sesión
+                # (si falló, se vuelve a intentar)
+                en_curso.result()
+                force_login = False
+                continue
+
+            try:
+                response = self._send(client, company_db, "POST", self.url("Login"), json=self._login_payload(company_db))
+                session = self._session_from_login(company_db, response)
+                self._store(session)
+                return session
+            finally:
+                self._terminar_login(company_db, en_curso)
+
+    def request(self, client: httpx.Client, method: str, company_db: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Ejecuta una petición con la sesión de la CompanyDB.
+        Si Service Layer responde 401, hace login de nuevo y reintenta una vez.
+        """
+        headers = dict(kwargs.pop("headers", None) or {})
+        session = self.get_session(client, company_db)
+
+        for intento in range(2):
+            headers["Cookie"] = session.cookie_header
+            response = self._send(client, company_db, method, self.url(path), headers=headers, **kwargs)
+            if response.status_code != 401 or intento == 1:
+                self._touch(session)
+                return response
+            self.invalidate(company_db, session)
+            session = self.get_session(client, company_db, force_login=True)
+
+        return response
+
+    def logout(self, client: httpx.Client, company_db: str) -> None:
+        """Cierra la sesión de una CompanyDB en Service Layer."""
+        with self._lock:
+            session = self._sessions.pop(company_db, None)
+        if session is not None:
+            try:
+                client.post(self.url("Logout"), headers={"Cookie": session.cookie_header})
+            except Exception:
+                pass
+
+    def logout_all(self, client: httpx.Client) -> int:
+        """Cierra todas las sesiones abiertas. Retorna cuántas se cerraron."""
+        with self._lock:
+            companies = list(self._sessions.keys())
+        for company_db in companies:
+            self.logout(client, company_db)
+        return len(companies)
+
+    # --- API async (httpx.AsyncClient) ---
+
+    async def _asend(self, client: httpx.AsyncClient, company_db: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """Versión async de _send(). Una petición cancelada (por ejemplo por un plazo) cuenta como falla."""
+        self.salud.verificar(company_db)
+        inicio = time.monotonic()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            self.salud.registrar_fallo(company_db, f"Error de conexión: {str(e) or type(e).__name__}", time.monotonic() - inicio)
+            raise
+        except asyncio.CancelledError:
+            self.salud.registrar_fallo(company_db, "Timeout: petición cancelada", time.monotonic() - inicio)
+            raise
+        self.salud.registrar_respuesta(company_db, response, time.monotonic() - inicio)
+        return response
+
+    async def aget_session(self, client: httpx.AsyncClient, company_db: str, force_login: bool = False) -> ServiceLayerSession:
+        """Versión async de get_session() (comparte con ella el login en curso por CompanyDB)."""
+        while True:
+            if not force_login:
+                session = self._fresh_session(company_db)
+                if session is not None:
+                    self._reused += 1
+                    return session
+
+            en_curso, propio = self._iniciar_login(company_db)
+            if not propio:
+                # shield: cancelar esta espera no debe cancelar el futuro compartido
+                await asyncio.shield(asyncio.wrap_future(en_curso))
+                force_login = False
+                continue
+
+            try:
+                response = await self._asend(client, company_db, "POST", self.url("Login"), json=self._login_payload(company_db))
+                session = self._session_from_login(company_db, response)
+                self._store(session)
+                return session
+            finally:
+                self._terminar_login(company_db, en_curso)
+
+    async def arequest(self, client: httpx.AsyncClient, method: str, company_db: str, path: str, **kwargs) -> httpx.Response:
+        """Versión async de request()."""
+        headers = dict(kwargs.pop("headers", None) or {})
+        session = await self.aget_session(client, company_db)
+
+        for intento in range(2):
+            headers["Cookie"] = session.cookie_header
+            response = await self._asend(client, company_db, method, self.url(path), headers=headers, **kwargs)
+            if response.status_code != 401 or intento == 1:
+                self._touch(session)
+                return response
+            self.invalidate(company_db, session)
+            session = await self.aget_session(client, company_db, force_login=True)
+
+        return response
+
+    async def alogout(self, client: httpx.AsyncClient, company_db: str) -> None:
+        """Versión async de logout()."""
+        with self._lock:
+            session = self._sessions.pop(company_db, None)
+        if session is not None:
+            try:
+                await client.post(self.url("Logout"), headers={"Cookie": session.cookie_header})
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        """Retorna métricas del pool de sesiones."""
+        with self._lock:
+            return {
+                "sesiones_abiertas": len(self._sessions),
+                "companias": sorted(self._sessions.keys()),
+                "logins": self._logins,
+                "reutilizadas": self._reused
+            }
+
+
+# Clientes HTTP de larga vida hacia Service Layer (conexiones keep-alive reutilizadas)
+_sl_http_client: httpx.Client | None = None
+_sl_async_client: httpx.AsyncClient | None = None
+_sl_http_lock = threading.Lock()
+# Event loop de la aplicación, dueño del cliente async (se registra al iniciar)
+_sl_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _sl_client_options() -> dict:
+    """Opciones comunes de los clientes HTTP de Service Layer."""
+    settings = get_settings()
+    return {
+        "verify": False,
+        "http2": settings.SL_HTTP2 and HTTP2_DISPONIBLE,
+        "limits": httpx.Limits(
+            max_connections=settings.SL_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.SL_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.SL_HTTP_KEEPALIVE_EXPIRY
+        ),
+        "timeout": httpx.Timeout(
+            settings.SL_HTTP_READ_TIMEOUT,
+            connect=settings.SL_HTTP_CONNECT_TIMEOUT
+        ),
+        # Las cookies B1SESSION/ROUTEID las maneja el pool de sesiones por CompanyDB;
+        # el cliente compartido no debe guardarlas ni mezclarlas entre compañías
+        "cookies": CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+    }
+
+
+def get_sl_http_client() -> httpx.Client:
+    """Retorna el cliente HTTP síncrono compartido (seguro entre threads)."""
+    global _sl_http_client
+    if _sl_http_client is None:
+        with _sl_http_lock:
+            if _sl_http_client is None:
+                _sl_http_client = httpx.Client(**_sl_client_options())
+    return _sl_http_client
+
+
+def get_sl_async_client() -> httpx.AsyncClient:
+    """Retorna el cliente HTTP async compartido (ligado al event loop de la aplicación)."""
+    global _sl_async_client
+    if _sl_async_client is None:
+        _sl_async_client = httpx.AsyncClient(**_sl_client_options())
+    return _sl_async_client
+
+
+def start_sl_http_clients() -> None:
+    """
+    Crea los clientes HTTP de Service Layer (al iniciar la aplicación) y registra
+    el event loop en curso para que el código síncrono pueda usar el cliente async.
+    """
+    global _sl_loop
+    get_sl_http_client()
+    get_sl_async_client()
+    try:
+        _sl_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _sl_loop = None
+
+
+async def close_sl_http_clients() -> None:
+    """Cierra los clientes HTTP de Service Layer (al apagar la aplicación)."""
+    global _sl_http_client, _sl_async_client, _sl_loop
+    _sl_loop = None
+    async_client, _sl_async_client = _sl_async_client, None
+    if async_client is not None:
+        await async_client.aclose()
+    with _sl_http_lock:
+        http_client, _sl_http_client = _sl_http_client, None
+    if http_client is not None:
+        http_client.close()
+
+
+_sl_session_pool: ServiceLayerSessionPool | None = None
+_sl_session_pool_lock = threading.Lock()
+
+
+def get_sl_session_pool() -> ServiceLayerSessionPool:
+    """Retorna el pool de sesiones de Service Layer del proceso."""
+    global _sl_session_pool
+    if _sl_session_pool is None:
+        with _sl_session_pool_lock:
+            if _sl_session_pool is None:
+                settings = get_settings()
+                _sl_session_pool = ServiceLayerSessionPool(
+                    base_url=settings.SAP_B1_SERVICE_LAYER_URL or "",
+                    username=settings.SAP_B1_USER,
+                    password=settings.SAP_B1_PASSWORD,
+                    session_timeout_minutes=settings.SL_SESSION_TIMEOUT_MINUTES,
+                    salud=ServiceLayerHealthRegistry(
+                        max_fallos=settings.SL_CIRCUITO_FALLOS,
+                        espera_segundos=settings.SL_CIRCUITO_ESPERA_SEGUNDOS
+                    )
+                )
+    return _sl_session_pool
+
+
+def get_sl_health() -> ServiceLayerHealthRegistry:
+    """Retorna el registro de salud (circuit breaker) de Service Layer del proceso."""
+    return get_sl_session_pool().salud
+
+
+def logout_sl_sessions() -> int:
+    """Cierra todas las sesiones del pool en Service Layer (al apagar la aplicación)."""
+    if _sl_session_pool is None:
+        return 0
+    return _sl_session_pool.logout_all(get_sl_http_client())
+
+
+def run_sl_async(factory: Callable[[httpx.AsyncClient], Awaitable[Any]], timeout: float | None = None) -> Any:
+    """
+    Ejecuta factory(cliente_async) desde código síncrono (threads de los executors).
+    Con la aplicación corriendo, la corrutina se agenda en el event loop de la aplicación
+    con el AsyncClient compartido; sin loop registrado (scripts), se ejecuta con
+    asyncio.run y un AsyncClient temporal.
+    Lanza TimeoutError si no termina dentro de timeout segundos.
+    """
+    loop = _sl_loop
+    if loop is not None and loop.is_running():
+        try:
+            en_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            en_loop = False
+        if en_loop:
+            raise RuntimeError("run_sl_async no puede llamarse desde el event loop; use await directamente")
+
+        future = asyncio.run_coroutine_threadsafe(factory(get_sl_async_client()), loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Service Layer no respondió en {timeout:g} s")
+
+    async def _con_cliente_temporal():
+        async with httpx.AsyncClient(**_sl_client_options()) as client:
+            return await asyncio.wait_for(factory(client), timeout)
+
+    return asyncio.run(_con_cliente_temporal())
+
+
+# Consulta autenticada mínima de las pruebas de Service Layer (un proveedor, un campo)
+SL_PROBE_PATH = "BusinessPartners?$select=CardCode&$top=1"
+
+
+async def aprobar_logins(
+    client: httpx.AsyncClient,
+    company_dbs: list[str],
+    max_concurrentes: int,
+    timeout: float
+) -> dict[str, dict]:
+    """
+    Prueba el login de varias CompanyDB en paralelo sobre un solo AsyncClient.
+    max_concurrentes acota los logins simultáneos; cada login tiene su propio plazo
+    (timeout segundos) y si lo excede se reporta con "timeout": True.
+    Usa el pool de sesiones, pero una sesión en caché no basta: cada prueba hace una
+    consulta autenticada (SL_PROBE_PATH) que llega al servidor; si la sesión venció,
+    se vuelve a hacer login. Las sesiones quedan abiertas para las siguientes llamadas.
+    Retorna {company_db: {"success", "status_code"?, "error"?, "timeout"?, "segundos"}}.
+    """
+    pool = get_sl_session_pool()
+    semaforo = asyncio.Semaphore(max(1, max_concurrentes))
+
+    async def probar(company_db: str) -> tuple[str, dict]:
+        async with semaforo:
+            inicio = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(pool.arequest(client, "GET", company_db, SL_PROBE_PATH), timeout)
+                if response.is_success:
+                    resultado = {"success": True, "status_code": response.status_code}
+                else:
+                    resultado = {
+                        "success": False,
+                        "status_code": response.status_code,
+                        "error": sl_error_message(response)
+                    }
+            except asyncio.TimeoutError:
+                resultado = {"success": False, "timeout": True, "error": f"Timeout: sin respuesta en {timeout:g} s"}
+            except ServiceLayerCircuitOpenError as e:
+                resultado = {"success": False, "circuito_abierto": True, "error": e.message}
+            except ServiceLayerLoginError as e:
+                resultado = {"success": False, "status_code": e.status_code, "error": e.message}
+            except httpx.TimeoutException:
+                resultado = {"success": False, "timeout": True, "error": "Timeout de conexión"}
+            except httpx.ConnectError as e:
+                resultado = {"success": False, "error": f"Error de conexión: {str(e)}"}
+            except Exception as e:
+                resultado = {"success": False, "error": str(e)}
+            resultado["segundos"] = round(time.perf_counter() - inicio, 2)
+            return company_db, resultado
+
+    return dict(await asyncio.gather(*(probar(company_db) for company_db in company_dbs)))
+
+
+def probar_logins_sl(company_dbs: list[str]) -> dict[str, dict]:
+    """
+    Versión síncrona de aprobar_logins() con SL_PROBE_CONCURRENCIA y SL_PROBE_TIMEOUT.
+    El plazo total alcanza para todas las tandas de logins más un margen.
+    """
+    settings = get_settings()
+    if not company_dbs:
+        return {}
+
+    concurrentes = max(1, settings.SL_PROBE_CONCURRENCIA)
+    tandas = math.ceil(len(company_dbs) / concurrentes)
+    return run_sl_async(
+        lambda client: aprobar_logins(client, company_dbs, concurrentes, settings.SL_PROBE_TIMEOUT),
+        timeout=settings.SL_PROBE_TIMEOUT * tandas + 10
+    )
+
+
+def _next_link(data: dict) -> str | None:
+    """Retorna el enlace a la siguiente página (OData v3 y v4)."""
+    return data.get("odata.nextLink") or data.get("@odata.nextLink")
+
+
+def iter_sl_pages(
+    company_db: str,
+    path: str,
+    page_size: int | None = None,
+    max_retries: int | None = None
+) -> Iterator[dict]:
+    """
+    Recorre una consulta de Service Layer página por página siguiendo odata.nextLink.
+    Cada página se pide con 'Prefer: odata.maxpagesize' y se entrega como el JSON
+    de la respuesta (registros en "value"), así que solo hay una página en memoria.
+
+    Una página que falla por timeout, error de red o 5xx se reintenta sola
+    (max_retries veces, con espera creciente); si sigue fallando se lanza
+    ServiceLayerRequestError.
+    """
+    settings = get_settings()
+    page_size = page_size or settings.SL_PAGE_SIZE
+    max_retries = settings.SL_PAGE_RETRIES if max_retries is None else max_retries
+    pool = get_sl_session_pool()
+    headers = {"Prefer": f"odata.maxpagesize={page_size}"}
+
+    url = pool.url(path)
+    while url:
+        intento = 0
+        while True:
+            try:
+                response = pool.request(get_sl_http_client(), "GET", company_db, url, headers=headers)
+                if response.status_code < 500:
+                    break
+                error = ServiceLayerRequestError(company_db, sl_error_message(response), response.status_code)
+            except httpx.TransportError as e:
+                error = ServiceLayerRequestError(company_db, f"Error de conexión: {str(e)}")
+            intento += 1
+            if intento > max_retries:
+                raise error
+            print(f"[SL] {company_db}: reintento {intento}/{max_retries} de página ({error.message})")
+            time.sleep(intento)
+
+        if response.status_code != 200:
+            raise ServiceLayerRequestError(company_db, sl_error_message(response), response.status_code)
+
+        data = response.json()
+        yield data
+
+        next_link = _next_link(data)
+        # El nextLink puede venir relativo a la raíz del servicio o al host
+        url = urljoin(pool.url(""), next_link) if next_link else None
+
 
 class SAPServiceLayerClient:
-    def __init__(self):
-        self._session_id: str | None = None
+    def __init__(self, company_db: str | None = None):
         self._settings = get_settings()
+        self._company_db = company_db or self._settings.SAP_B1_COMPANY_DB
+        self._pool = get_sl_session_pool()
+
+    @property
+    def _session_id(self) -> str | None:
+        session = self._pool._fresh_session(self._company_db)
+        return session.session_id if session else None
 
     async def login(self) -> str:
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.post(
-                f"{self._settings.SAP_B1_SERVICE_LAYER_URL}/Login",
-                json={
-                    "CompanyDB": self._settings.SAP_B1_COMPANY_DB,
-                    "UserName": self._settings.SAP_B1_USER,
-                    "Password": self._settings.SAP_B1_PASSWORD
-                }
-            )
-            response.raise_for_status()
-            self._session_id = response.cookies.get("B1SESSION")
-            return self._session_id
+        session = await self._pool.aget_session(get_sl_async_client(), self._company_db)
+        return session.session_id
 
     async def logout(self) -> None:
-        if self._session_id:
-            async with httpx.AsyncClient(verify=False) as client:
-                await client.post(
-                    f"{self._settings.SAP_B1_SERVICE_LAYER_URL}/Logout",
-                    cookies={"B1SESSION": self._session_id}
-                )
-            self._session_id = None
+        await self._pool.alogout(get_sl_async_client(), self._company_db)
 
     def _build_url(self, endpoint: str, include_count: bool = True) -> str:
         """Construye la URL con $inlinecount=allpages por defecto."""
-        url = f"{self._settings.SAP_B1_SERVICE_LAYER_URL}/{endpoint}"
+        url = self._pool.url(endpoint)
         if include_count:
             separator = "&" if "?" in endpoint else "?"
             url = f"{url}{separator}$inlinecount=allpages"
@@ -43,26 +791,24 @@ class SAPServiceLayerClient:
         return {"Prefer": f"odata.maxpagesize={max_pagesize}"}
 
     async def get(self, endpoint: str, include_count: bool = True, max_pagesize: int = 0) -> dict:
-        if not self._session_id:
-            await self.login()
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.get(
-                self._build_url(endpoint, include_count),
-                cookies={"B1SESSION": self._session_id},
-                headers=self._get_headers(max_pagesize)
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self._pool.arequest(
+            get_sl_async_client(),
+            "GET",
+            self._company_db,
+            self._build_url(endpoint, include_count),
+            headers=self._get_headers(max_pagesize)
+        )
+        response.raise_for_status()
+        return response.json()
 
     async def post(self, endpoint: str, data: dict, include_count: bool = True, max_pagesize: int = 0) -> dict:
-        if not self._session_id:
-            await self.login()
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.post(
-                self._build_url(endpoint, include_count),
-                cookies={"B1SESSION": self._session_id},
-                headers=self._get_headers(max_pagesize),
-                json=data
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self._pool.arequest(
+            get_sl_async_client(),
+            "POST",
+            self._company_db,
+            self._build_url(endpoint, include_count),
+            headers=self._get_headers(max_pagesize),
+            json=data
+        )
+        response.raise_for_status()
+        return response.json()
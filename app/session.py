@@ -1,46 +1,196 @@
 """
 Gestión de sesiones de usuario con tokens en base de datos.
 Permite renovación automática y control total sobre las sesiones activas.
+
+Las sesiones validadas se guardan en un cache en memoria del proceso (TTL + LRU).
+La renovación de LastActivity se acumula en memoria y se escribe en lote
+mediante flush_session_activity(), que se ejecuta periódicamente desde main.py.
 """
 import os
+import time
 import uuid
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from database import get_mssql_connection
+from config import get_settings
+from database import mssql_connection, ensure_schema_ready, register_schema_check
+from executors import run_blocking
 from utils import now as tz_now, get_timezone
 
 
-def ensure_sessions_table_exists() -> None:
+class SessionCache:
     """
-    Crea la base de datos (si no existe) y la tabla USER_SESSIONS (si no existe).
-    Esto permite que el sistema de autenticación funcione incluso si la base de datos
-    no ha sido inicializada aún.
+    Cache en memoria de sesiones válidas.
+
+    - Cada entrada vive como máximo ttl_seconds; después se vuelve a leer de la BD.
+      Esto acota el tiempo en que un logout hecho en otro proceso sigue aceptándose.
+    - Al superar max_entries se expulsa la entrada usada menos recientemente.
+    - Las renovaciones de LastActivity quedan pendientes hasta el siguiente flush.
     """
-    from database import ensure_database_exists
 
-    # Primero asegurar que la base de datos existe
-    ensure_database_exists()
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60.0):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._pending: dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> dict | None:
+        """Retorna una copia de la entrada si existe y no ha vencido su TTL."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["cached_at"] > self._ttl_seconds:
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return dict(entry)
+
+    def put(self, session_id: str, username: str, scopes: list[str], last_activity: datetime) -> None:
+        """Agrega o reemplaza una sesión en el cache."""
+        with self._lock:
+            self._entries[session_id] = {
+                "username": username,
+                "scopes": scopes,
+                "last_activity": last_activity,
+                "cached_at": time.monotonic()
+            }
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, session_id: str, last_activity: datetime) -> None:
+        """Renueva LastActivity en memoria y lo marca como pendiente de escribir."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry["last_activity"] = last_activity
+            self._pending[session_id] = last_activity
+
+    def pending_activity(self, session_id: str) -> datetime | None:
+        """Retorna la renovación pendiente de escribir para una sesión, si existe."""
+        with self._lock:
+            return self._pending.get(session_id)
+
+    def remove(self, session_id: str) -> None:
+        with self._lock:
+            self._entries.pop(session_id, None)
+            self._pending.pop(session_id, None)
+
+    def remove_user(self, username: str) -> None:
+        with self._lock:
+            for session_id in [sid for sid, e in self._entries.items() if e["username"] == username]:
+                del self._entries[session_id]
+                self._pending.pop(session_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+
+    def take_pending(self) -> dict[str, datetime]:
+        """Extrae todas las renovaciones pendientes."""
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            return pending
+
+    def restore_pending(self, pending: dict[str, datetime]) -> None:
+        """Devuelve renovaciones que no pudieron escribirse (sin pisar otras más recientes)."""
+        with self._lock:
+            for session_id, last_activity in pending.items():
+                actual = self._pending.get(session_id)
+                if actual is None or actual < last_activity:
+                    self._pending[session_id] = last_activity
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entradas": len(self._entries),
+                "renovaciones_pendientes": len(self._pending),
+                "max_entries": self._max_entries,
+                "ttl_seconds": self._ttl_seconds
+            }
+
+
+_session_cache: SessionCache | None = None
+_session_cache_lock = threading.Lock()
+
+
+def get_session_cache() -> SessionCache:
+    """Retorna el cache de sesiones del proceso, creándolo con la configuración actual."""
+    global _session_cache
+    if _session_cache is None:
+        with _session_cache_lock:
+            if _session_cache is None:
+                settings = get_settings()
+                _session_cache = SessionCache(
+                    max_entries=settings.SESSION_CACHE_MAX_ENTRIES,
+                    ttl_seconds=settings.SESSION_CACHE_TTL_SECONDS
+                )
+    return _session_cache
 
-    # Luego crear la tabla USER_SESSIONS si no existe
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+
+def flush_session_activity() -> int:
+    """
+    Escribe en USER_SESSIONS las renovaciones de LastActivity acumuladas en memoria.
+    Nunca retrocede LastActivity si la BD ya tiene un valor más reciente.
+    Retorna el número de sesiones renovadas enviadas a la BD.
+    """
+    cache = get_session_cache()
+    pending = cache.take_pending()
+    if not pending:
+        return 0
+
+    params = [(last_activity, session_id, last_activity) for session_id, last_activity in pending.items()]
 
     try:
-        cursor.execute("""
-            IF NOT EXISTS (SELECT * FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'USER_SESSIONS')
-            CREATE TABLE USER_SESSIONS (
-                SessionID NVARCHAR(100) PRIMARY KEY,
-                Username NVARCHAR(100) NOT NULL,
-                CreatedAt DATETIME NOT NULL,
-                LastActivity DATETIME NOT NULL,
-                Scopes NVARCHAR(500),
-                INDEX idx_username (Username),
-                INDEX idx_last_activity (LastActivity)
-            )
-        """)
-        conn.commit()
-    finally:
-        cursor.close()
-        conn.close()
+        with mssql_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.executemany("""
+                    UPDATE USER_SESSIONS
+                    SET LastActivity = ?
+                    WHERE SessionID = ? AND LastActivity < ?
+                """, params)
+                conn.commit()
+            finally:
+                cursor.close()
+    except Exception:
+        cache.restore_pending(pending)
+        raise
+
+    return len(params)
+
+
+@register_schema_check
+def ensure_sessions_table_exists() -> None:
+    """
+    Crea la tabla USER_SESSIONS (si no existe).
+    Forma parte del registro de esquema: ensure_schema_ready() crea antes la base de datos,
+    lo que permite que el sistema de autenticación funcione incluso si la base de datos
+    no ha sido inicializada aún.
+    """
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = 'USER_SESSIONS')
+                CREATE TABLE USER_SESSIONS (
+                    SessionID NVARCHAR(100) PRIMARY KEY,
+                    Username NVARCHAR(100) NOT NULL,
+                    CreatedAt DATETIME NOT NULL,
+                    LastActivity DATETIME NOT NULL,
+                    Scopes NVARCHAR(500),
+                    INDEX idx_username (Username),
+                    INDEX idx_last_activity (LastActivity)
+                )
+            """)
+            conn.commit()
+        finally:
+            cursor.close()
 
 
 def create_session(username: str, scopes: list[str]) -> str:
@@ -49,7 +199,10 @@ def create_session(username: str, scopes: list[str]) -> str:
     Si el usuario excede el límite de sesiones activas, elimina la más antigua.
     Retorna el SessionID (token).
     """
-    ensure_sessions_table_exists()
+    ensure_schema_ready()
+
+    # Escribir renovaciones pendientes para que la sesión más antigua se elija con datos actuales
+    flush_session_activity()
 
     session_id = str(uuid.uuid4())
     now = tz_now()
@@ -57,42 +210,71 @@ def create_session(username: str, scopes: list[str]) -> str:
 
     # Obtener límite de sesiones activas desde variable de entorno
     max_sessions = int(os.getenv("SESIONES_ACTIVAS", "2"))
+    cache = get_session_cache()
 
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        # Contar sesiones activas del usuario
-        cursor.execute("""
-            SELECT COUNT(*)
-            FROM USER_SESSIONS
-            WHERE Username = ?
-        """, (username,))
-        active_sessions = cursor.fetchone()[0]
-
-        # Si excede el límite, eliminar la sesión más antigua
-        if active_sessions >= max_sessions:
+        try:
+            # Contar sesiones activas del usuario
             cursor.execute("""
-                DELETE FROM USER_SESSIONS
-                WHERE SessionID = (
-                    SELECT TOP 1 SessionID
-                    FROM USER_SESSIONS
-                    WHERE Username = ?
-                    ORDER BY LastActivity ASC
-                )
+                SELECT COUNT(*)
+                FROM USER_SESSIONS
+                WHERE Username = ?
             """, (username,))
+            active_sessions = cursor.fetchone()[0]
+
+            # Si excede el límite, eliminar la sesión más antigua
+            if active_sessions >= max_sessions:
+                cursor.execute("""
+                    DELETE FROM USER_SESSIONS
+                    OUTPUT DELETED.SessionID
+                    WHERE SessionID = (
+                        SELECT TOP 1 SessionID
+                        FROM USER_SESSIONS
+                        WHERE Username = ?
+                        ORDER BY LastActivity ASC
+                    )
+                """, (username,))
+                deleted_ids = [deleted_id for (deleted_id,) in cursor.fetchall()]
+                conn.commit()
+                # Después del commit: una validación simultánea pudo volver a cachear la fila
+                for deleted_id in deleted_ids:
+                    cache.remove(deleted_id)
+
+            # Crear nueva sesión
+            cursor.execute("""
+                INSERT INTO USER_SESSIONS (SessionID, Username, CreatedAt, LastActivity, Scopes)
+                VALUES (?, ?, ?, ?, ?)
+            """, (session_id, username, now, now, scopes_str))
             conn.commit()
 
-        # Crear nueva sesión
-        cursor.execute("""
-            INSERT INTO USER_SESSIONS (SessionID, Username, CreatedAt, LastActivity, Scopes)
-            VALUES (?, ?, ?, ?, ?)
-        """, (session_id, username, now, now, scopes_str))
-        conn.commit()
-        return session_id
-    finally:
-        cursor.close()
-        conn.close()
+            cache.put(session_id, username, list(scopes), now)
+            return session_id
+        finally:
+            cursor.close()
+
+
+def _validate_from_cache(session_id: str, timeout_minutes: int) -> dict | None:
+    """
+    Valida la sesión solo con el cache en memoria (sin I/O).
+    Retorna None si no está en cache o si expiró; en ese caso hay que ir a la BD.
+    """
+    cache = get_session_cache()
+    entry = cache.get(session_id)
+    if entry is None:
+        return None
+
+    now = tz_now()
+    if now > entry["last_activity"] + timedelta(minutes=timeout_minutes):
+        return None
+
+    cache.touch(session_id, now)
+    return {
+        "username": entry["username"],
+        "scopes": list(entry["scopes"]),
+        "session_id": session_id
+    }
 
 
 def validate_and_renew_session(session_id: str, timeout_minutes: int = 30) -> dict | None:
@@ -100,6 +282,9 @@ def validate_and_renew_session(session_id: str, timeout_minutes: int = 30) -> di
     Valida si la sesión existe y no ha expirado.
     Si es válida, renueva el LastActivity (sliding expiration).
 
+    La validación se responde desde el cache en memoria cuando es posible;
+    la renovación se escribe en la BD de forma diferida (ver flush_session_activity).
+
     Args:
         session_id: ID de la sesión a validar
         timeout_minutes: Minutos de inactividad antes de expirar (default: 30)
@@ -107,54 +292,72 @@ def validate_and_renew_session(session_id: str, timeout_minutes: int = 30) -> di
     Returns:
         dict con username y scopes si es válida, None si expiró o no existe
     """
-    ensure_sessions_table_exists()
+    cache = get_session_cache()
+    entry = cache.get(session_id)
+
+    if entry is not None:
+        username = entry["username"]
+        scopes = entry["scopes"]
+        last_activity = entry["last_activity"]
+    else:
+        ensure_schema_ready()
+
+        with mssql_connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                # Buscar sesión
+                cursor.execute("""
+                    SELECT Username, Scopes, LastActivity
+                    FROM USER_SESSIONS
+                    WHERE SessionID = ?
+                """, (session_id,))
 
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+                row = cursor.fetchone()
+            finally:
+                cursor.close()
 
-    try:
-        # Buscar sesión
-        cursor.execute("""
-            SELECT Username, Scopes, LastActivity
-            FROM USER_SESSIONS
-            WHERE SessionID = ?
-        """, (session_id,))
-
-        row = cursor.fetchone()
         if not row:
+            cache.remove(session_id)
             return None
 
         username, scopes_str, last_activity = row
+        scopes = scopes_str.split(",") if scopes_str else []
 
         # Hacer que last_activity sea timezone-aware si no lo es
         if last_activity.tzinfo is None:
             last_activity = last_activity.replace(tzinfo=get_timezone())
 
-        # Verificar si expiró
-        expiration_time = last_activity + timedelta(minutes=timeout_minutes)
-        if tz_now() > expiration_time:
-            # Sesión expirada, eliminar
-            cursor.execute("DELETE FROM USER_SESSIONS WHERE SessionID = ?", (session_id,))
-            conn.commit()
-            return None
+        # Una renovación pendiente de escribir es más reciente que la BD
+        pending = cache.pending_activity(session_id)
+        if pending is not None and pending > last_activity:
+            last_activity = pending
 
-        # Sesión válida, renovar LastActivity
-        cursor.execute("""
-            UPDATE USER_SESSIONS
-            SET LastActivity = ?
-            WHERE SessionID = ?
-        """, (tz_now(), session_id))
-        conn.commit()
+        cache.put(session_id, username, scopes, last_activity)
 
-        scopes = scopes_str.split(",") if scopes_str else []
-        return {
-            "username": username,
-            "scopes": scopes,
-            "session_id": session_id
-        }
-    finally:
-        cursor.close()
-        conn.close()
+    # Verificar si expiró
+    now = tz_now()
+    expiration_time = last_activity + timedelta(minutes=timeout_minutes)
+    if now > expiration_time:
+        # Sesión expirada, eliminar
+        cache.remove(session_id)
+        with mssql_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM USER_SESSIONS WHERE SessionID = ?", (session_id,))
+                conn.commit()
+            finally:
+                cursor.close()
+        return None
+
+    # Sesión válida, renovar LastActivity (se escribe en el siguiente flush)
+    cache.touch(session_id, now)
+
+    return {
+        "username": username,
+        "scopes": list(scopes),
+        "session_id": session_id
+    }
 
 
 def invalidate_session(session_id: str) -> bool:
@@ -162,18 +365,25 @@ def invalidate_session(session_id: str) -> bool:
     Invalida (elimina) una sesión específica.
     Retorna True si se eliminó, False si no existía.
     """
-    ensure_sessions_table_exists()
+    ensure_schema_ready()
 
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+    cache = get_session_cache()
+    cache.remove(session_id)
 
-    try:
-        cursor.execute("DELETE FROM USER_SESSIONS WHERE SessionID = ?", (session_id,))
-        conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        cursor.close()
-        conn.close()
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("DELETE FROM USER_SESSIONS WHERE SessionID = ?", (session_id,))
+            conn.commit()
+            deleted = cursor.rowcount > 0
+        finally:
+            cursor.close()
+
+    # De nuevo tras el commit: una validación que leyó la fila antes del DELETE
+    # pudo volver a cachearla y el token seguiría siendo válido en este proceso
+    cache.remove(session_id)
+    return deleted
 
 
 def invalidate_user_sessions(username: str) -> int:
@@ -181,18 +391,24 @@ def invalidate_user_sessions(username: str) -> int:
     Invalida todas las sesiones de un usuario.
     Retorna el número de sesiones eliminadas.
     """
-    ensure_sessions_table_exists()
+    ensure_schema_ready()
 
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+    cache = get_session_cache()
+    cache.remove_user(username)
 
-    try:
-        cursor.execute("DELETE FROM USER_SESSIONS WHERE Username = ?", (username,))
-        conn.commit()
-        return cursor.rowcount
-    finally:
-        cursor.close()
-        conn.close()
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute("DELETE FROM USER_SESSIONS WHERE Username = ?", (username,))
+            conn.commit()
+            deleted_count = cursor.rowcount
+        finally:
+            cursor.close()
+
+    # De nuevo tras el commit (ver invalidate_session)
+    cache.remove_user(username)
+    return deleted_count
 
 
 def cleanup_expired_sessions(timeout_minutes: int = 30) -> int:
@@ -200,22 +416,24 @@ def cleanup_expired_sessions(timeout_minutes: int = 30) -> int:
     Elimina sesiones expiradas de la base de datos.
     Retorna el número de sesiones eliminadas.
     """
-    ensure_sessions_table_exists()
+    ensure_schema_ready()
 
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+    # Sin el flush, sesiones activas con renovaciones pendientes parecerían expiradas
+    flush_session_activity()
 
-    try:
-        expiration_time = tz_now() - timedelta(minutes=timeout_minutes)
-        cursor.execute("""
-            DELETE FROM USER_SESSIONS
-            WHERE LastActivity < ?
-        """, (expiration_time,))
-        conn.commit()
-        return cursor.rowcount
-    finally:
-        cursor.close()
-        conn.close()
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            expiration_time = tz_now() - timedelta(minutes=timeout_minutes)
+            cursor.execute("""
+                DELETE FROM USER_SESSIONS
+                WHERE LastActivity < ?
+            """, (expiration_time,))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            cursor.close()
 
 
 def get_active_sessions(username: str | None = None) -> list[dict]:
@@ -223,36 +441,82 @@ def get_active_sessions(username: str | None = None) -> list[dict]:
     Obtiene lista de sesiones activas.
     Si se proporciona username, solo retorna sesiones de ese usuario.
     """
-    ensure_sessions_table_exists()
+    ensure_schema_ready()
 
-    conn = get_mssql_connection()
-    cursor = conn.cursor()
+    # Reflejar en la BD las renovaciones acumuladas en memoria
+    flush_session_activity()
+
+    with mssql_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            if username:
+                cursor.execute("""
+                    SELECT SessionID, Username, CreatedAt, LastActivity, Scopes
+                    FROM USER_SESSIONS
+                    WHERE Username = ?
+                    ORDER BY LastActivity DESC
+                """, (username,))
+            else:
+                cursor.execute("""
+                    SELECT SessionID, Username, CreatedAt, LastActivity, Scopes
+                    FROM USER_SESSIONS
+                    ORDER BY LastActivity DESC
+                """)
+
+            sessions = []
+            for row in cursor.fetchall():
+                sessions.append({
+                    "session_id": row[0],
+                    "username": row[1],
+                    "created_at": row[2].isoformat() if row[2] else None,
+                    "last_activity": row[3].isoformat() if row[3] else None,
+                    "scopes": row[4].split(",") if row[4] else []
+                })
+            return sessions
+        finally:
+            cursor.close()
+
+
+# API async: las operaciones que tocan MSSQL se despachan al executor "session"
+# para no bloquear el event loop de uvicorn.
+
+async def create_session_async(username: str, scopes: list[str]) -> str:
+    """Versión async de create_session()."""
+    return await run_blocking("session", create_session, username, scopes)
+
+
+async def validate_and_renew_session_async(session_id: str, timeout_minutes: int = 30) -> dict | None:
+    """
+    Versión async de validate_and_renew_session().
+    Si la sesión está en cache se responde en el propio event loop (sin threads ni BD).
+    """
+    session_data = _validate_from_cache(session_id, timeout_minutes)
+    if session_data is not None:
+        return session_data
+    return await run_blocking("session", validate_and_renew_session, session_id, timeout_minutes)
+
+
+async def invalidate_session_async(session_id: str) -> bool:
+    """Versión async de invalidate_session()."""
+    return await run_blocking("session", invalidate_session, session_id)
+
+
+async def invalidate_user_sessions_async(username: str) -> int:
+    """Versión async de invalidate_user_sessions()."""
+    return await run_blocking("session", invalidate_user_sessions, username)
+
+
+async def cleanup_expired_sessions_async(timeout_minutes: int = 30) -> int:
+    """Versión async de cleanup_expired_sessions()."""
+    return await run_blocking("session", cleanup_expired_sessions, timeout_minutes)
+
+
+async def get_active_sessions_async(username: str | None = None) -> list[dict]:
+    """Versión async de get_active_sessions()."""
+    return await run_blocking("session", get_active_sessions, username)
 
-    try:
-        if username:
-            cursor.execute("""
-                SELECT SessionID, Username, CreatedAt, LastActivity, Scopes
-                FROM USER_SESSIONS
-                WHERE Username = ?
-                ORDER BY LastActivity DESC
-            """, (username,))
-        else:
-            cursor.execute("""
-                SELECT SessionID, Username, CreatedAt, LastActivity, Scopes
-                FROM USER_SESSIONS
-                ORDER BY LastActivity DESC
-            """)
 
-        sessions = []
-        for row in cursor.fetchall():
-            sessions.append({
-                "session_id": row[0],
-                "username": row[1],
-                "created_at": row[2].isoformat() if row[2] else None,
-                "last_activity": row[3].isoformat() if row[3] else None,
-                "scopes": row[4].split(",") if row[4] else []
-            })
-        return sessions
-    finally:
-        cursor.close()
-        conn.close()
+async def flush_session_activity_async() -> int:
+    """Versión async de flush_session_activity()."""
+    return await run_blocking("session", flush_session_activity)
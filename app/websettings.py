@@ -1010,7 +1010,8 @@ async def start_page():
                 }
             }
 
-            // Variable global para almacenar el interval de polling
+            // Variables globales del monitoreo: stream SSE y, si no está disponible, interval de polling
+            let progresoStream = null;
             let pollingInterval = null;
 
             // Función para habilitar/deshabilitar todos los botones de ajustes
@@ -1043,91 +1044,38 @@ async def start_page():
                 return null;
             }
 
-            // Función para monitorear el progreso de un job
-            async function monitorearProgreso(jobId) {
-                const statusMessage = document.getElementById('statusMessage');
-
-                try {
-                    const response = await fetch(`/inicializa_datos/status/${jobId}`, {
-                        method: 'GET'
-                    });
-
-                    if (response.ok) {
-                        const data = await response.json();
-
-                        // Si el job terminó (completed o failed)
-                        if (data.status === 'completed' || data.status === 'failed') {
-                            // Detener polling
-                            if (pollingInterval) {
-                                clearInterval(pollingInterval);
-                                pollingInterval = null;
-                            }
+            // Función para detener el monitoreo (stream SSE o polling)
+            function detenerMonitoreo() {
+                if (progresoStream) {
+                    progresoStream.close();
+                    progresoStream = null;
+                }
+                if (pollingInterval) {
+                    clearInterval(pollingInterval);
+                    pollingInterval = null;
+                }
+            }
 
-                            // Actualizar clase del mensaje
-                            statusMessage.className = 'status-message ' + data.status;
-                            statusMessage.style.display = 'block';
-
-                            // Habilitar botones
-                            setButtonsEnabled(true);
-
-                            // Mensaje final con historial de jobs
-                            if (data.status === 'completed') {
-                                const historial = await obtenerHistorialJobs();
-                                let mensaje = '✓ Inicialización completada exitosamente';
-
-                                if (historial && historial.total_jobs > 0) {
-                                    mensaje += `\n\nHistorial de inicializaciones: ${historial.total_jobs} total`;
-
-                                    // Mostrar últimos 3 jobs
-                                    const ultimosJobs = historial.jobs.slice(0, 3);
-                                    ultimosJobs.forEach((job, index) => {
-                                        // Validar que created_at exista y sea válido
-                                        if (job.created_at) {
-                                            const fecha = new Date(job.created_at);
-                                            // Validar que la fecha sea válida (después del año 2000)
-                                            if (fecha.getFullYear() > 2000) {
-                                                const fechaFormateada = fecha.toLocaleString('es-MX', {
-                                                    year: 'numeric',
-                                                    month: '2-digit',
-                                                    day: '2-digit',
-                                                    hour: '2-digit',
-                                                    minute: '2-digit',
-                                                    second: '2-digit'
-                                                });
-                                                const estado = job.status === 'completed' ? '✓' : job.status === 'failed' ? '✗' : '⏳';
-                                                mensaje += `\n${estado} ${fechaFormateada} - ${job.status}`;
-                                            }
-                                        }
-                                    });
-                                }
+            // Función para mostrar el estado de un job (recibido del stream o del polling)
+            async function mostrarEstadoJob(data) {
+                const statusMessage = document.getElementById('statusMessage');
 
-                                statusMessage.innerHTML = mensaje.replace(/\\n/g, '<br>');
-                            } else {
-                                statusMessage.textContent = '✗ Error: ' + (data.error || 'Error desconocido');
-                            }
-                        } else {
-                            // Todavía está corriendo - mostrar spinner con mensaje de progreso
-                            statusMessage.className = 'status-message running';
-                            statusMessage.style.display = 'block';
-                            statusMessage.innerHTML = '<span>Ejecutando proceso de inicialización<br>' + (data.progress || 'Procesando...') + '   </span><span class="spinner"></span>';
-                        }
-                    } else if (response.status === 404) {
-                        // Job no encontrado - el servidor pudo haber reiniciado
-                        // Detener polling
-                        if (pollingInterval) {
-                            clearInterval(pollingInterval);
-                            pollingInterval = null;
-                        }
+                // Si el job terminó (completed o failed)
+                if (data.status === 'completed' || data.status === 'failed') {
+                    // Detener stream o polling
+                    detenerMonitoreo();
 
-                        // Re-habilitar botones
-                        setButtonsEnabled(true);
+                    // Actualizar clase del mensaje
+                    statusMessage.className = 'status-message ' + data.status;
+                    statusMessage.style.display = 'block';
 
-                        // Mostrar mensaje indicando que el tracking se perdió pero la inicialización pudo completarse
-                        statusMessage.className = 'status-message completed';
-                        statusMessage.style.display = 'block';
+                    // Habilitar botones
+                    setButtonsEnabled(true);
 
+                    // Mensaje final con historial de jobs
+                    if (data.status === 'completed') {
                         const historial = await obtenerHistorialJobs();
-                        let mensaje = '✓ Proceso de inicialización completado';
+                        let mensaje = '✓ Inicialización completada exitosamente';
 
                         if (historial && historial.total_jobs > 0) {
                             mensaje += `\n\nHistorial de inicializaciones: ${historial.total_jobs} total`;
@@ -1156,12 +1104,122 @@ async def start_page():
                         }
 
                         statusMessage.innerHTML = mensaje.replace(/\\n/g, '<br>');
+                    } else {
+                        statusMessage.textContent = '✗ Error: ' + (data.error || 'Error desconocido');
+                    }
+                } else {
+                    // Todavía está corriendo - mostrar spinner con mensaje de progreso
+                    statusMessage.className = 'status-message running';
+                    statusMessage.style.display = 'block';
+                    statusMessage.innerHTML = '<span>Ejecutando proceso de inicialización<br>' + (data.progress || 'Procesando...') + '   </span><span class="spinner"></span>';
+                }
+            }
+
+            // Función para mostrar que el job ya no existe en el almacén de jobs
+            async function mostrarJobNoEncontrado() {
+                const statusMessage = document.getElementById('statusMessage');
+
+                // Job no encontrado - ya se eliminó del almacén de jobs
+                // Detener stream o polling
+                detenerMonitoreo();
+
+                // Re-habilitar botones
+                setButtonsEnabled(true);
+
+                // Mostrar mensaje indicando que el tracking se perdió pero la inicialización pudo completarse
+                statusMessage.className = 'status-message completed';
+                statusMessage.style.display = 'block';
+
+                const historial = await obtenerHistorialJobs();
+                let mensaje = '✓ Proceso de inicialización completado';
+
+                if (historial && historial.total_jobs > 0) {
+                    mensaje += `\n\nHistorial de inicializaciones: ${historial.total_jobs} total`;
+
+                    // Mostrar últimos 3 jobs
+                    const ultimosJobs = historial.jobs.slice(0, 3);
+                    ultimosJobs.forEach((job, index) => {
+                        // Validar que created_at exista y sea válido
+                        if (job.created_at) {
+                            const fecha = new Date(job.created_at);
+                            // Validar que la fecha sea válida (después del año 2000)
+                            if (fecha.getFullYear() > 2000) {
+                                const fechaFormateada = fecha.toLocaleString('es-MX', {
+                                    year: 'numeric',
+                                    month: '2-digit',
+                                    day: '2-digit',
+                                    hour: '2-digit',
+                                    minute: '2-digit',
+                                    second: '2-digit'
+                                });
+                                const estado = job.status === 'completed' ? '✓' : job.status === 'failed' ? '✗' : '⏳';
+                                mensaje += `\n${estado} ${fechaFormateada} - ${job.status}`;
+                            }
+                        }
+                    });
+                }
+
+                statusMessage.innerHTML = mensaje.replace(/\\n/g, '<br>');
+            }
+
+            // Función para consultar el estado de un job una vez (polling)
+            async function monitorearProgreso(jobId) {
+                try {
+                    const response = await fetch(`/inicializa_datos/status/${jobId}`, {
+                        method: 'GET'
+                    });
+
+                    if (response.ok) {
+                        await mostrarEstadoJob(await response.json());
+                    } else if (response.status === 404) {
+                        await mostrarJobNoEncontrado();
                     }
                 } catch (error) {
                     console.error('Error monitoreando progreso:', error);
                 }
             }
 
+            // Función para iniciar el polling cada 2 segundos (respaldo sin SSE)
+            function iniciarPolling(jobId) {
+                detenerMonitoreo();
+                pollingInterval = setInterval(() => {
+                    monitorearProgreso(jobId);
+                }, 2000);
+
+                // Primera consulta inmediata
+                monitorearProgreso(jobId);
+            }
+
+            // Función para seguir el progreso de un job: stream SSE, o polling si el navegador
+            // no soporta EventSource o el stream se corta antes de que el job termine
+            function seguirProgreso(jobId) {
+                detenerMonitoreo();
+                if (!window.EventSource) {
+                    iniciarPolling(jobId);
+                    return;
+                }
+
+                const stream = new EventSource(`/inicializa_datos/stream/${jobId}`);
+                progresoStream = stream;
+
+                stream.addEventListener('progreso', (event) => {
+                    mostrarEstadoJob(JSON.parse(event.data));
+                });
+
+                stream.addEventListener('no_encontrado', () => {
+                    detenerMonitoreo();
+                    mostrarJobNoEncontrado();
+                });
+
+                stream.onerror = () => {
+                    // Si el stream sigue activo es un corte (no un cierre por fin del job)
+                    if (progresoStream === stream) {
+                        console.warn('Stream de progreso interrumpido, cambiando a polling');
+                        iniciarPolling(jobId);
+                    }
+                };
+            }
+
             // Funciones para el modal de confirmación
             function abrirModalConfirmacion() {
                 const modo = document.getElementById('modeSelect').value;
@@ -1244,13 +1302,8 @@ async def start_page():
                     if (initResponse.ok) {
                         const data = await initResponse.json();
 
-                        // Hacer polling cada 2 segundos
-                        pollingInterval = setInterval(() => {
-                            monitorearProgreso(data.job_id);
-                        }, 2000);
-
-                        // Primera consulta inmediata
-                        monitorearProgreso(data.job_id);
+                        // Recibir el progreso por SSE (con polling como respaldo)
+                        seguirProgreso(data.job_id);
                     } else {
                         const errorData = await initResponse.json();
                         statusMessage.className = 'status-message failed';
@@ -0,0 +1,58 @@
+#!/bin/bash
+#
+# Benchmark de endpoints autenticados con clientes concurrentes.
+# Mide requests/s de GET /me (valida y renueva la sesión en cada petición).
+#
+# Uso:
+#   ./benchmark_auth_concurrencia.sh [CONCURRENCIA] [TOTAL_REQUESTS]
+#
+# Ejecutar antes y después de un cambio contra el mismo servidor para comparar.
+
+BASE_URL="${BASE_URL:-http://localhost:8000}"
+USERNAME="${API_USER:-sa}"
+PASSWORD="${API_PASSWORD:-G3XP@Ns10n}"
+CONCURRENCIA="${1:-50}"
+TOTAL="${2:-2000}"
+
+echo "=========================================="
+echo "BENCHMARK DE AUTENTICACIÓN CONCURRENTE"
+echo "=========================================="
+echo "Servidor:     $BASE_URL"
+echo "Concurrencia: $CONCURRENCIA clientes"
+echo "Peticiones:   $TOTAL"
+echo ""
+
+TOKEN=$(curl -s -X POST "$BASE_URL/auth/login" \
+  -H "Content-Type: application/json" \
+  -d "{\"username\":\"$USERNAME\",\"password\":\"$PASSWORD\"}" | jq -r '.access_token')
+
+if [ -z "$TOKEN" ] || [ "$TOKEN" = "null" ]; then
+    echo "✗ Error obteniendo token"
+    exit 1
+fi
+echo "✓ Token obtenido: ${TOKEN:0:30}..."
+echo ""
+
+RESULTADOS=$(mktemp)
+
+INICIO=$(date +%s.%N)
+seq "$TOTAL" | xargs -P "$CONCURRENCIA" -I{} \
+    curl -s -o /dev/null -w "%{http_code} %{time_total}\n" \
+    -H "Authorization: Bearer $TOKEN" "$BASE_URL/me" >> "$RESULTADOS"
+FIN=$(date +%s.%N)
+
+DURACION=$(echo "$FIN - $INICIO" | bc -l)
+EXITOSAS=$(grep -c "^200 " "$RESULTADOS")
+FALLIDAS=$((TOTAL - EXITOSAS))
+RPS=$(echo "$TOTAL / $DURACION" | bc -l)
+P50=$(awk '{print $2}' "$RESULTADOS" | sort -n | awk '{a[NR]=$1} END {print a[int(NR*0.50)+1]}')
+P95=$(awk '{print $2}' "$RESULTADOS" | sort -n | awk '{a[NR]=$1} END {print a[int(NR*0.95)+1]}')
+
+printf "Duración total:  %.2f s\n" "$DURACION"
+printf "Requests/s:      %.1f\n" "$RPS"
+echo "Exitosas (200):  $EXITOSAS"
+echo "Fallidas:        $FALLIDAS"
+echo "Latencia p50:    ${P50}s"
+echo "Latencia p95:    ${P95}s"
+
+rm -f "$RESULTADOS"
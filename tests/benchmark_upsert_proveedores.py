@@ -0,0 +1,136 @@
+"""
+Benchmark de sincronización de SAP_PROVEEDORES con datos sintéticos.
+
+Compara el ciclo fila por fila (SELECT 1 + UPDATE/INSERT por proveedor) contra
+la carga masiva (fast_executemany a tabla temporal + MERGE por instancia).
+Cada método se mide en tres pasadas: inserción inicial, actualización de todas las filas
+y una pasada sin cambios (la carga masiva solo reescribe filas cuyo RowHash cambió).
+
+Uso (dentro del contenedor, donde /app tiene el código y el .env):
+    docker compose exec -T api-mcp python - [TOTAL_PROVEEDORES] < tests/benchmark_upsert_proveedores.py
+
+Los datos se escriben bajo la instancia BENCH_UPSERT y se eliminan al terminar.
+"""
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, "/app")
+
+from database import (  # noqa: E402
+    CAMPOS_PROVEEDOR,
+    ensure_schema_ready,
+    fila_proveedor,
+    mssql_connection,
+    upsert_proveedores_instancia,
+)
+
+INSTANCIA = "BENCH_UPSERT"
+PAGE_SIZE = 500
+
+
+def texto(rng: random.Random, n: int) -> str:
+    return "".join(rng.choices(string.ascii_uppercase + string.digits, k=n))
+
+
+def proveedor_sintetico(i: int, version: int) -> dict:
+    # Determinista por (proveedor, versión): repetir una versión no cambia los datos
+    rng = random.Random(i * 1000 + version)
+    return {
+        "CardCode": f"P{i:08d}",
+        "CardName": f"Proveedor {i} v{version} {texto(rng, 20)}",
+        "GroupCode": 101,
+        "FederalTaxID": texto(rng, 13),
+        "CreateDate": "2020-01-15",
+        "CreateTime": "10:30:00",
+        "UpdateDate": "2024-06-01",
+        "UpdateTime": f"{version % 24:02d}:00:00",
+        "Address": f"Calle {texto(rng, 10)} {i}",
+        "City": "Monterrey",
+        "Country": "MX",
+        "Phone1": texto(rng, 10),
+        "EmailAddress": f"p{i}@ejemplo.com",
+        "PayTermsGrpCode": 1,
+        "CreditLimit": round(rng.uniform(0, 100000), 2),
+        "DiscountPercent": 0.0,
+        "Currency": "MXN",
+        "CurrentAccountBalance": round(rng.uniform(0, 50000), 2),
+        "OpenOpportunities": 0,
+        "Valid": "tYES",
+        "Frozen": "tNO",
+    }
+
+
+def paginas(total: int, version: int):
+    for inicio in range(0, total, PAGE_SIZE):
+        yield [proveedor_sintetico(i, version) for i in range(inicio, min(inicio + PAGE_SIZE, total))]
+
+
+def ciclo_fila_por_fila(cursor, total: int, version: int) -> None:
+    """Método anterior: una consulta de existencia y un UPDATE o INSERT por proveedor."""
+    update_set = ", ".join([f"{campo} = ?" for campo in CAMPOS_PROVEEDOR + ["RowHash"]])
+    update_sql = f"UPDATE SAP_PROVEEDORES SET {update_set} WHERE Instancia = ? AND CardCode = ?"
+    campos_insert = ["Instancia", "CardCode"] + CAMPOS_PROVEEDOR + ["RowHash"]
+    insert_sql = (
+        f"INSERT INTO SAP_PROVEEDORES ({', '.join(campos_insert)}) "
+        f"VALUES ({', '.join(['?'] * len(campos_insert))})"
+    )
+    for pagina in paginas(total, version):
+        for prov in pagina:
+            fila = fila_proveedor(INSTANCIA, prov)
+            cursor.execute(
+                "SELECT 1 FROM SAP_PROVEEDORES WHERE Instancia = ? AND CardCode = ?",
+                [INSTANCIA, prov["CardCode"]]
+            )
+            if cursor.fetchone() is not None:
+                cursor.execute(update_sql, fila[2:] + fila[:2])
+            else:
+                cursor.execute(insert_sql, fila)
+
+
+def carga_masiva(cursor, total: int, version: int) -> None:
+    errores = []
+    upsert_proveedores_instancia(cursor, INSTANCIA, paginas(total, version), errores)
+    if errores:
+        print(f"  ! {len(errores)} filas con error, primera: {errores[0]}")
+
+
+def medir(conn, nombre: str, metodo, total: int) -> None:
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM SAP_PROVEEDORES WHERE Instancia = ?", [INSTANCIA])
+    conn.commit()
+
+    for version, fase in ((1, "inserción"), (2, "actualización"), (2, "sin cambios")):
+        inicio = time.perf_counter()
+        metodo(cursor, total, version)
+        conn.commit()
+        duracion = time.perf_counter() - inicio
+        print(f"{nombre:<16} {fase:<14} {duracion:8.2f} s   {total / duracion:10.0f} filas/s")
+
+    cursor.close()
+
+
+def main() -> None:
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    ensure_schema_ready()
+
+    print("==========================================")
+    print("BENCHMARK UPSERT SAP_PROVEEDORES")
+    print("==========================================")
+    print(f"Proveedores sintéticos: {total}")
+    print("")
+
+    with mssql_connection() as conn:
+        try:
+            medir(conn, "fila por fila", ciclo_fila_por_fila, total)
+            medir(conn, "carga + MERGE", carga_masiva, total)
+        finally:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM SAP_PROVEEDORES WHERE Instancia = ?", [INSTANCIA])
+            conn.commit()
+            cursor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Pruebas del almacén de jobs (app/jobs.py) con SQLiteJobStore sobre un archivo temporal.
+El SQL es el mismo de MSSQLJobStore, así que cubren la lógica común de JobStore.
+
+Uso (dentro del contenedor, donde están las dependencias de la aplicación):
+    docker compose exec -T api-mcp python -m pytest -q tests/test_jobs.py
+
+Se omite si no se pueden importar los módulos de la aplicación.
+"""
+import os
+import sys
+import threading
+from datetime import timedelta
+
+import pytest
+
+sys.path.insert(0, "/app")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+jobs = pytest.importorskip("jobs")
+utils = pytest.importorskip("utils")
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = jobs.SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    store.ensure_table()
+    return store
+
+
+def test_solo_un_worker_reclama_el_job(store):
+    job_id = store.crear("inicializa_datos", {})
+    barrera = threading.Barrier(8)
+    reclamados = []
+
+    def worker(n):
+        barrera.wait()
+        if store.reclamar(job_id, owner=f"worker-{n}"):
+            reclamados.append(n)
+
+    hilos = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len(reclamados) == 1
+    job = store.obtener(job_id)
+    assert job["status"] == jobs.JOB_RUNNING
+    assert job["owner"] == f"worker-{reclamados[0]}"
+    # Ya en ejecución: nadie más puede reclamarlo
+    assert not store.reclamar(job_id, owner="otro")
+
+
+def test_no_se_traslapan_jobs_del_mismo_tipo(store):
+    primero = store.crear("inicializa_datos", {})
+    segundo = store.crear("inicializa_datos", {})
+
+    assert store.reclamar_siguiente(owner="worker-1")["job_id"] == primero
+    assert store.reclamar_siguiente(owner="worker-2") is None
+
+    store.completar(primero, {"ok": True})
+    job = store.reclamar_siguiente(owner="worker-2")
+    assert job["job_id"] == segundo
+    assert job["owner"] == "worker-2"
+
+
+def test_recuperar_huerfanos_marca_latidos_vencidos(store):
+    huerfano = store.crear("inicializa_datos", {})
+    assert store.reclamar(huerfano, owner="worker-muerto")
+    vivo = store.crear("otro_tipo", {})
+    assert store.reclamar(vivo, owner="worker-vivo")
+
+    # El worker del primer job dejó de latir hace 10 minutos
+    store._ejecutar("UPDATE INIT_JOBS SET HeartbeatAt = HeartbeatAt - 600 WHERE JobID = ?", (huerfano,))
+
+    assert store.recuperar_huerfanos(120) == 1
+    job = store.obtener(huerfano)
+    assert job["status"] == jobs.JOB_FAILED
+    assert job["error"].startswith("Job interrumpido")
+    assert store.obtener(vivo)["status"] == jobs.JOB_RUNNING
+
+
+def test_limpiar_elimina_solo_jobs_terminados_antiguos(store):
+    hace_dos_dias = (utils.now() - timedelta(days=2)).isoformat()
+
+    viejo_completado = store.crear("inicializa_datos", {})
+    store.completar(viejo_completado, {})
+    viejo_fallido = store.crear("inicializa_datos", {})
+    store.fallar(viejo_fallido, "error")
+    viejo_pendiente = store.crear("inicializa_datos", {})
+    reciente = store.crear("inicializa_datos", {})
+    store.completar(reciente, {})
+
+    for job_id in (viejo_completado, viejo_fallido, viejo_pendiente):
+        store._ejecutar("UPDATE INIT_JOBS SET CreatedAt = ? WHERE JobID = ?", (hace_dos_dias, job_id))
+
+    assert store.limpiar(24) == 2
+    assert store.obtener(viejo_completado) is None
+    assert store.obtener(viejo_fallido) is None
+    assert store.obtener(viejo_pendiente) is not None
+    assert store.obtener(reciente) is not None
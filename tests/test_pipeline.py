@@ -0,0 +1,111 @@
+"""
+Pruebas del ejecutor de grafos de etapas (app/pipeline.py, sin dependencias externas).
+
+Uso:
+    python -m pytest -q tests/test_pipeline.py
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from pipeline import (  # noqa: E402
+    ETAPA_COMPLETADA,
+    ETAPA_FALLIDA,
+    ETAPA_OMITIDA,
+    EtapaOmitida,
+    GrafoEtapas,
+)
+
+
+def falla(entradas):
+    raise ValueError("error de prueba")
+
+
+def test_dependiente_se_omite_si_su_requisito_falla():
+    grafo = GrafoEtapas()
+    grafo.agregar("a", falla)
+    grafo.agregar("b", lambda entradas: "b", requiere=["a"])
+    grafo.agregar("c", lambda entradas: "c", requiere=["b"])
+    grafo.agregar("d", lambda entradas: entradas["a"].estado, despues_de=["a"])
+
+    etapas = grafo.ejecutar()
+
+    assert etapas["a"].estado == ETAPA_FALLIDA
+    assert etapas["a"].error == "error de prueba"
+    # La omisión se propaga en cascada
+    assert etapas["b"].estado == ETAPA_OMITIDA
+    assert etapas["c"].estado == ETAPA_OMITIDA
+    # despues_de solo espera a que termine: la etapa recibe la entrada fallida
+    assert etapas["d"].estado == ETAPA_COMPLETADA
+    assert etapas["d"].resultado == ETAPA_FALLIDA
+
+
+def test_etapa_omitida_omite_a_sus_dependientes():
+    def omitir(entradas):
+        raise EtapaOmitida("sin Service Layer")
+
+    grafo = GrafoEtapas()
+    grafo.agregar("a", omitir)
+    grafo.agregar("b", lambda entradas: "b", requiere=["a"])
+
+    etapas = grafo.ejecutar()
+
+    assert etapas["a"].estado == ETAPA_OMITIDA
+    assert etapas["a"].error == "sin Service Layer"
+    assert etapas["b"].estado == ETAPA_OMITIDA
+
+
+def test_recurso_limita_etapas_simultaneas():
+    en_curso = 0
+    maximo = 0
+    lock = threading.Lock()
+
+    def trabajo(entradas):
+        nonlocal en_curso, maximo
+        with lock:
+            en_curso += 1
+            maximo = max(maximo, en_curso)
+        time.sleep(0.02)
+        with lock:
+            en_curso -= 1
+
+    grafo = GrafoEtapas(limites={"hana": 2}, max_workers=8)
+    for i in range(8):
+        grafo.agregar(f"hana:{i}", trabajo, recurso="hana")
+
+    etapas = grafo.ejecutar()
+
+    assert all(etapa.estado == ETAPA_COMPLETADA for etapa in etapas.values())
+    assert maximo == 2
+
+
+def test_agregar_desde_una_etapa_en_ejecucion():
+    grafo = GrafoEtapas()
+
+    def base(entradas):
+        for i in range(3):
+            grafo.agregar(f"instancia:{i}", lambda entradas, i=i: i * 10, requiere=["base"])
+        return "ok"
+
+    grafo.agregar("base", base)
+    # Depende de etapas que todavía no existen: se espera a que base las agregue
+    grafo.agregar("resumen", lambda entradas: sum(e.resultado for e in entradas.values()),
+                  despues_de=[f"instancia:{i}" for i in range(3)])
+
+    etapas = grafo.ejecutar()
+
+    assert etapas["resumen"].estado == ETAPA_COMPLETADA
+    assert etapas["resumen"].resultado == 30
+
+
+def test_dependencia_que_nunca_se_agrega_falla():
+    grafo = GrafoEtapas()
+    grafo.agregar("a", lambda entradas: "a", requiere=["no_existe"])
+
+    etapas = grafo.ejecutar()
+
+    assert etapas["a"].estado == ETAPA_FALLIDA
+    assert etapas["a"].error == "Dependencias sin resolver"
@@ -0,0 +1,162 @@
+"""
+Pruebas del pool genérico de conexiones (app/pool.py, sin dependencias externas).
+
+Uso:
+    python -m pytest -q tests/test_pool.py
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from pool import ConnectionPool  # noqa: E402
+
+
+class ConexionFalsa:
+    """
+    Conexión de prueba que lleva la cuenta de las conexiones abiertas a la vez
+    (una conexión que se está cerrando ya no cuenta).
+    """
+
+    abiertas = 0
+    max_abiertas = 0
+    lock = threading.Lock()
+
+    def __init__(self):
+        with ConexionFalsa.lock:
+            ConexionFalsa.abiertas += 1
+            ConexionFalsa.max_abiertas = max(ConexionFalsa.max_abiertas, ConexionFalsa.abiertas)
+        self.cerrada = False
+
+    def close(self):
+        with ConexionFalsa.lock:
+            if not self.cerrada:
+                self.cerrada = True
+                ConexionFalsa.abiertas -= 1
+        # Cerrar una conexión rota puede tardar: ensancha la ventana de la carrera
+        time.sleep(0.001)
+
+
+def ping_roto(conn):
+    raise ConnectionError("conexión rota")
+
+
+def test_ping_fallido_con_adquisiciones_concurrentes():
+    ConexionFalsa.abiertas = 0
+    ConexionFalsa.max_abiertas = 0
+    max_size = 4
+    pool = ConnectionPool("prueba", ConexionFalsa, ping=ping_roto, max_size=max_size, timeout=10)
+    errores = []
+
+    def trabajador():
+        try:
+            for _ in range(50):
+                with pool.connection() as conn:
+                    assert not conn.cerrada
+                    time.sleep(0.0005)
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=trabajador) for _ in range(12)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert errores == []
+    assert ConexionFalsa.max_abiertas <= max_size
+
+    stats = pool.stats()
+    assert stats["en_uso"] == 0
+    assert stats["inactivas"] <= max_size
+    # Toda conexión creada está inactiva en el pool o fue descartada (y cerrada)
+    assert stats["creadas"] == stats["descartadas"] + stats["inactivas"]
+    assert ConexionFalsa.abiertas == stats["inactivas"]
+
+    pool.close()
+    assert ConexionFalsa.abiertas == 0
+
+
+def test_ping_fallido_usa_otra_conexion_inactiva():
+    class Conexion:
+        def __init__(self, sana):
+            self.sana = sana
+
+        def close(self):
+            pass
+
+    conexiones = iter([Conexion(True), Conexion(False)])
+
+    def ping(conn):
+        if not conn.sana:
+            raise ConnectionError("conexión rota")
+
+    pool = ConnectionPool("prueba", lambda: next(conexiones), ping=ping, max_size=2)
+    sana = pool.acquire()
+    rota = pool.acquire()
+    sana.close()
+    rota.close()
+
+    # LIFO entrega primero la rota; se descarta y se usa la sana sin abrir otra
+    with pool.connection() as conn:
+        assert conn.sana
+
+    stats = pool.stats()
+    assert stats["creadas"] == 2
+    assert stats["descartadas"] == 1
+    assert stats["en_uso"] == 0
+
+
+class ConexionLenta:
+    """Conexión cuyo close() se bloquea hasta que la prueba lo permita (conexión TCP muerta)."""
+
+    def __init__(self, liberar: threading.Event):
+        self.liberar = liberar
+
+    def close(self):
+        self.liberar.wait(5)
+
+
+def test_cierre_lento_no_bloquea_al_pool():
+    liberar = threading.Event()
+    pool = ConnectionPool("prueba", lambda: ConexionLenta(liberar), max_size=3, timeout=5)
+    lenta = pool.acquire()
+    inactiva = pool.acquire()
+    inactiva.close()
+
+    # Descartar la conexión deja un thread bloqueado dentro de close()
+    hilo = threading.Thread(target=lenta.close, kwargs={"discard": True})
+    hilo.start()
+    time.sleep(0.05)
+
+    inicio = time.monotonic()
+    with pool.connection():
+        pass
+    stats = pool.stats()
+    assert time.monotonic() - inicio < 1
+    assert stats["en_uso"] == 0
+
+    liberar.set()
+    hilo.join()
+
+
+def test_expiradas_se_cierran_fuera_del_lock():
+    liberar = threading.Event()
+    pool = ConnectionPool("prueba", lambda: ConexionLenta(liberar), max_size=2, timeout=5, max_idle=0.01)
+    pool.acquire().close()
+    time.sleep(0.05)
+
+    # Este acquire retira la inactiva expirada y se queda cerrándola
+    hilo = threading.Thread(target=lambda: pool.acquire().close())
+    hilo.start()
+    time.sleep(0.05)
+
+    inicio = time.monotonic()
+    stats = pool.stats()
+    assert time.monotonic() - inicio < 1
+    assert stats["descartadas"] == 1
+
+    liberar.set()
+    hilo.join()
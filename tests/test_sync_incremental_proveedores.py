@@ -0,0 +1,108 @@
+"""
+Prueba de la marca de agua de sincronización de SAP_PROVEEDORES.
+
+Ejecuta dos sincronizaciones seguidas de una instancia sintética (sin Service Layer:
+las páginas se sustituyen por proveedores fijos) y verifica que la segunda tome el
+camino incremental, es decir, que la primera dejó guardada la marca en SAP_PROV_SYNC.
+También verifica que un proveedor cuya fila no se puede cargar no se elimine.
+
+Uso (dentro del contenedor, donde /app tiene el código y el .env):
+    docker compose exec -T api-mcp python -m pytest -q tests/test_sync_incremental_proveedores.py
+
+Se omite si pyodbc no está instalado o no hay conexión a MSSQL. Los datos se escriben
+bajo la instancia TEST_SYNC_INC y se eliminan al terminar.
+"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pyodbc")
+
+sys.path.insert(0, "/app")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import database  # noqa: E402
+
+INSTANCIA = "TEST_SYNC_INC"
+INSTANCIA_SL = "TEST_SYNC_INC_SL"
+
+
+def proveedor_sintetico(i: int) -> dict:
+    return {
+        "CardCode": f"T{i:08d}",
+        "CardName": f"Proveedor prueba {i}",
+        "GroupCode": 101,
+        "CreateDate": "2020-01-15",
+        "CreateTime": "10:30:00",
+        "UpdateDate": "2024-06-01",
+        "UpdateTime": "12:00:00",
+        "Country": "MX",
+        "Currency": "MXN",
+        "Valid": "tYES",
+        "Frozen": "tNO",
+    }
+
+
+def _limpiar() -> None:
+    with database.mssql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM SAP_PROVEEDORES WHERE Instancia = ?", [INSTANCIA])
+        cursor.execute("DELETE FROM SAP_PROV_SYNC WHERE Instancia = ?", [INSTANCIA])
+        conn.commit()
+        cursor.close()
+
+
+@pytest.fixture
+def instancia_sintetica(monkeypatch):
+    try:
+        database.ensure_schema_ready()
+        _limpiar()
+    except Exception as e:
+        pytest.skip(f"MSSQL no disponible: {e}")
+
+    proveedores = [proveedor_sintetico(i) for i in range(20)]
+
+    def paginas(company_db, page_size=None, **filtros):
+        assert company_db == INSTANCIA_SL
+        if filtros.get("select") == "CardCode":
+            yield [{"CardCode": prov["CardCode"]} for prov in proveedores]
+        else:
+            yield proveedores
+
+    monkeypatch.setattr(database, "iter_paginas_proveedores_sl", paginas)
+    yield proveedores
+    _limpiar()
+
+
+def test_segunda_sincronizacion_es_incremental(instancia_sintetica):
+    sl_slots, mssql_slots = database.slots_sync_proveedores()
+
+    primera = database.sincronizar_proveedores_instancia(INSTANCIA, INSTANCIA_SL, False, sl_slots, mssql_slots)
+    assert primera["errores"] == []
+    assert primera["procesada"]["sincronizacion"] == "completa"
+    assert primera["procesada"]["insertados"] == 20
+
+    segunda = database.sincronizar_proveedores_instancia(INSTANCIA, INSTANCIA_SL, False, sl_slots, mssql_slots)
+    assert segunda["errores"] == []
+    assert segunda["procesada"]["sincronizacion"] == "incremental"
+    assert segunda["procesada"]["insertados"] == 0
+    assert segunda["procesada"]["eliminados"] == 0
+
+
+def test_fila_con_error_no_elimina_al_proveedor(instancia_sintetica):
+    proveedores = instancia_sintetica
+    sl_slots, mssql_slots = database.slots_sync_proveedores()
+    database.sincronizar_proveedores_instancia(INSTANCIA, INSTANCIA_SL, True, sl_slots, mssql_slots)
+
+    # CardName no cabe en NVARCHAR(200): el lote falla y la fila se rechaza al reintentar
+    proveedores[3] = {**proveedores[3], "CardName": "X" * 300}
+    resultado = database.sincronizar_proveedores_instancia(INSTANCIA, INSTANCIA_SL, True, sl_slots, mssql_slots)
+
+    assert [error["cardcode"] for error in resultado["errores"]] == [proveedores[3]["CardCode"]]
+    assert resultado["procesada"]["eliminados"] == 0
+    with database.mssql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM SAP_PROVEEDORES WHERE Instancia = ?", [INSTANCIA])
+        assert cursor.fetchone()[0] == 20
+        cursor.close()